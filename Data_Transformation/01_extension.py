@@ -1,12 +1,13 @@
 # Import des bibliothèques nécessaires
-import psycopg2  # Pour se connecter et interagir avec une base de données PostgreSQL
+from db import get_conn  # Connexion PostgreSQL partagée (pool en mode runner)
 import pandas as pd  # Pour manipuler des données tabulaires (DataFrame)
 import os  # Pour accéder aux variables d'environnement
+import loader  # Chargeur COPY + MERGE partagé
 
 # Fonction pour créer la table 'extension' dans la base de données
 def create_extension_table():
     # Connexion à la base de données PostgreSQL
-    conn = psycopg2.connect(host='localhost', port=5432, dbname='postgres', user='postgres')
+    conn = get_conn()
     cur = conn.cursor()
 
     # Suppression de la table 'extension' si elle existe déjà, puis création d'une nouvelle table
@@ -28,48 +29,41 @@ def create_extension_table():
 # Fonction pour insérer les données du DataFrame dans la table 'extension'
 def insert_extensions_data(df):
     # Connexion à la base de données
-    conn = psycopg2.connect(host='localhost', port=5432, dbname='postgres', user='postgres')
-    cur = conn.cursor()
+    conn = get_conn()
 
-    inserted = 0  # Compteur de lignes insérées ou mises à jour
+    rows = []  # Lignes prêtes à être chargées
 
     # Parcours de chaque ligne du DataFrame
     for _, row in df.iterrows():
         try:
             # Récupération et transformation des données de la ligne
-            extension_code = row["Code_extension"]
-            extension_name = row['Extension']
-            extension_nb_card = int(row['Nb_carte'])
-            extension_date_sortie = pd.to_datetime(row['Date'], dayfirst=True).date()
-
-            # Insertion dans la table avec mise à jour en cas de conflit sur la clé primaire
-            cur.execute("""
-                INSERT INTO extension (extension_code, extension_name, extension_nb_card, extension_date_sortie)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (extension_code) DO UPDATE SET
-                    extension_name = EXCLUDED.extension_name,
-                    extension_nb_card = EXCLUDED.extension_nb_card,
-                    extension_date_sortie = EXCLUDED.extension_date_sortie;
-            """, (
-                extension_code,
-                extension_name,
-                extension_nb_card,
-                extension_date_sortie
+            rows.append((
+                row["Code_extension"],
+                row['Extension'],
+                int(row['Nb_carte']),
+                pd.to_datetime(row['Date'], dayfirst=True).date()
             ))
-            inserted += 1  # Incrémentation du compteur si l'insertion/mise à jour réussit
 
         except Exception as e:
             # Gestion des erreurs : affichage du code d'extension problématique
             code = row.get("Code_extension", 'inconnu')
             print(f"⚠️ Erreur insertion pour {code} : {e}")
 
+    # Chargement COPY puis mise à jour en cas de conflit sur la clé primaire
+    inserted = loader.load_rows(
+        conn, 'extension',
+        ('extension_code', 'extension_name', 'extension_nb_card', 'extension_date_sortie'),
+        rows, policy='upsert', key=('extension_code',)
+    )
+
     # Validation des modifications et fermeture de la connexion
     conn.commit()
     conn.close()
     print(f"{inserted} lignes insérées/mises à jour dans 'extension'.")
 
-# Bloc principal exécuté si le script est lancé directement
-if __name__ == '__main__':
+# Point d'entrée (appelé directement ou par le runner Exe.py)
+def main():
+    """Charge la table de correspondance des extensions depuis le fichier Excel PATH_EXCEL."""
     # Récupération du chemin vers le fichier Excel via une variable d'environnement
     path_excel = os.getenv("PATH_EXCEL")
     if not path_excel:
@@ -84,3 +78,6 @@ if __name__ == '__main__':
     # Création de la table puis insertion des données
     create_extension_table()
     insert_extensions_data(df_extensions)
+
+if __name__ == '__main__':
+    main()
@@ -1,169 +1,166 @@
-# -*- coding: utf-8 -*-
-import psycopg2
-import psycopg2.extras
-import json
-import re
-import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from itertools import islice
-import time
-
-# Configuration de la connexion à la base de données et des paramètres généraux
-host = 'localhost'
-port = 5432
-database = 'postgres'
-user = 'postgres'
-json_folder = os.getenv("JSON_FOLDER")  # Dossier contenant les fichiers JSON
-BATCH_SIZE = 10000                      # Taille des lots pour les insertions
-MAX_WORKERS = 8                         # Nombre maximum de threads pour le traitement parallèle
-
-# Regex compilée pour supprimer les caractères non-ASCII (optimisation de performance)
-ASCII_PATTERN = re.compile(r'[^\x00-\x7F]')
-
-def remove_non_ascii(text):
-    """Supprime les caractères non-ASCII d'une chaîne de texte."""
-    return ASCII_PATTERN.sub(' ', text).strip() if isinstance(text, str) else None
-
-def safe_json_load(file_path):
-    """
-    Tente de charger un fichier JSON avec différents encodages.
-    Gère les erreurs Unicode et JSON pour une meilleure robustesse.
-    """
-    encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1', 'utf-16', 'utf-8-sig']
-    
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                return json.load(f)
-        except (UnicodeDecodeError, UnicodeError):
-            continue
-        except json.JSONDecodeError as e:
-            print(f"[JSON ERREUR] {file_path} avec {encoding}: {e}")
-            continue
-        except Exception as e:
-            print(f"[ERREUR] {file_path} avec {encoding}: {e}")
-            continue
-    
-    # Dernier recours : remplacer les erreurs de décodage
-    try:
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[ERREUR FATALE] Impossible de lire {file_path}: {e}")
-        return None
-
-def create_tournament_table(conn):
-    """
-    Crée la table 'tournament' (non journalisée) dans la base de données.
-    Utilisation de UNLOGGED pour accélérer les insertions (pas de WAL).
-    """
-    with conn.cursor() as cur:
-        cur.execute("""
-            DROP TABLE IF EXISTS tournament CASCADE;
-            CREATE UNLOGGED TABLE tournament (
-                tournament_id TEXT,
-                tournament_name TEXT,
-                tournament_date TIMESTAMP,
-                tournament_organizer TEXT,
-                tournament_format TEXT,
-                tournament_nb_player SMALLINT,
-                last_extension TEXT
-            );
-        """)
-        conn.commit()
-        print("[OK] Table UNLOGGED 'tournament' créée.")
-
-def process_file(filename):
-    """
-    Traite un fichier JSON et extrait les données du tournoi.
-    Nettoie et valide les champs nécessaires avant insertion.
-    """
-    file_path = os.path.join(json_folder, filename)
-    
-    data = safe_json_load(file_path)
-    if data is None:
-        return None
-    
-    try:
-        tournament_id = remove_non_ascii(data.get('id', ''))
-        if not tournament_id:
-            return None  # Identifiant manquant ou invalide
-        
-        # Conversion sécurisée du nombre de joueurs
-        nb_players = data.get('nb_players', 0)
-        try:
-            nb_players = int(nb_players) if nb_players else 0
-        except (ValueError, TypeError):
-            nb_players = 0
-        
-        # Construction du tuple de données à insérer
-        tournament = (
-            tournament_id,
-            remove_non_ascii(data.get('name', '')),
-            data.get('date'),
-            remove_non_ascii(data.get('organizer', '')),
-            remove_non_ascii(data.get('format', '')),
-            nb_players
-        )
-        
-        return tournament
-
-    except Exception as e:
-        print(f"[ATTENTION] Données invalides dans {filename} : {e}")
-        return None
-
-def chunked_iterable(iterable, size):
-    """
-    Génère des sous-listes (chunks) d'une taille donnée à partir d'un itérable.
-    Utile pour le traitement en lots.
-    """
-    it = iter(iterable)
-    while True:
-        chunk = list(islice(it, size))
-        if not chunk:
-            break
-        yield chunk
-
-def update_last_extension_optimized(conn):
-    """
-    Met à jour le champ 'last_extension' dans la table 'tournament'
-    en fonction de la date du tournoi et des dates de sortie des extensions.
-    Version optimisée utilisant une requête SQL unique avec des sous-requêtes.
-    """
-    start_time = time.time()
-    
-    with conn.cursor() as cur:
-        # Récupère la première extension disponible (hors cas particulier 'P-A')
-        cur.execute("""
-            SELECT extension_code, extension_date_sortie
-            FROM extension
-            WHERE extension_code <> 'P-A'
-            ORDER BY extension_date_sortie ASC
-            LIMIT 1
-        """)
-        first_ext = cur.fetchone()
-        
-        if not first_ext:
-            print("[ATTENTION] Pas d'extensions valides trouvées.")
-            return
-        
-        first_extension_code, first_extension_date = first_ext
-        
-        # Mise à jour du champ last_extension pour tous les tournois
-        cur.execute("""
-            UPDATE tournament 
-            SET last_extension = CASE
-                WHEN tournament_date IS NULL OR tournament_date < %s THEN %s
-                ELSE COALESCE((
-                    SELECT e.extension_code
-                    FROM extension e
-                    WHERE e.extension_date_sortie <= tournament.tournament_date
-                      AND e.extension_code <> 'P-A'
-                    ORDER BY e.extension_date_sortie DESC
-                    LIMIT 1
-                ), %s)
-            END
-        """, (first_extension_date, first_extension_code, first_extension_code))
-        
-        updated_rows = cur.rowcount
-        conn.commit()
+# -*- coding: utf-8 -*-
+from db import get_conn
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from tournament_cache import load_tournament
+import epochs
+import incremental
+import loader
+import metrics
+
+# Paramètres généraux (connexion PostgreSQL : voir db.py)
+json_folder = os.getenv("JSON_FOLDER")  # Dossier contenant les fichiers JSON
+MAX_WORKERS = 8                         # Nombre maximum de threads pour le traitement parallèle
+
+def create_tournament_table(conn):
+    """
+    Crée la table 'tournament' (non journalisée) dans la base de données.
+    Utilisation de UNLOGGED pour accélérer les insertions (pas de WAL).
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            DROP TABLE IF EXISTS tournament CASCADE;
+            CREATE UNLOGGED TABLE tournament (
+                tournament_id TEXT,
+                tournament_key INT,
+                tournament_name TEXT,
+                tournament_date TIMESTAMP,
+                tournament_organizer TEXT,
+                tournament_format TEXT,
+                tournament_nb_player SMALLINT,
+                last_extension TEXT,
+                extension_epoch INT
+            );
+        """)
+        conn.commit()
+        print("[OK] Table UNLOGGED 'tournament' créée.")
+
+def process_file(filename):
+    """
+    Traite un fichier JSON et extrait les données du tournoi.
+    Les champs sont déjà nettoyés par le cache des tournois normalisés.
+    """
+    record = load_tournament(os.path.join(json_folder, filename))
+    if record is None:
+        return None  # Fichier illisible ou identifiant manquant
+
+    # Construction du tuple de données à insérer
+    return (
+        record['id'],
+        record['name'],
+        record['date'],
+        record['organizer'],
+        record['format'],
+        record['nb_players']
+    )
+
+def update_last_extension_optimized(conn, tournament_ids=None):
+    """
+    Met à jour 'last_extension' et 'extension_epoch' dans la table 'tournament' en
+    fonction de la date du tournoi : une seule jointure de plages sur extension_epoch
+    (index GiST, voir epochs.py), reconstruite au préalable depuis 'extension'.
+    Si tournament_ids est fourni (mode incrémental), seuls ces tournois sont mis à jour.
+    """
+    start_time = time.time()
+    
+    if not epochs.build_epochs(conn):
+        print("[ATTENTION] Pas d'extensions valides trouvées.")
+        return
+    
+    with conn.cursor() as cur:
+        # Une date absente tombe dans la première époque (ouverte vers le passé)
+        cur.execute(f"""
+            UPDATE tournament t
+            SET last_extension = e.extension_code,
+                extension_epoch = e.epoch_id
+            FROM {epochs.EPOCH_TABLE} e
+            WHERE e.validity @> COALESCE(t.tournament_date::date, '-infinity'::date)
+              AND (%s::text[] IS NULL OR t.tournament_id = ANY(%s::text[]))
+        """, (tournament_ids, tournament_ids))
+        
+        updated_rows = cur.rowcount
+        conn.commit()
+        
+        elapsed = time.time() - start_time
+        print(f"[OK] last_extension mis à jour pour {updated_rows:,} tournois en {elapsed:.1f}s")
+
+def main():
+    start_time = time.time()
+    
+    try:
+        print("[INFO] Démarrage du traitement tournois...")
+        
+        conn = get_conn()
+        conn.set_client_encoding('UTF8')
+        
+        # Mode incrémental : seuls les fichiers nouveaux ou modifiés sont relus
+        is_incremental = incremental.is_incremental(conn, 'tournament', 'extension_epoch')
+        if is_incremental:
+            files, affected_ids = incremental.get_changes(conn, json_folder)
+        else:
+            create_tournament_table(conn)
+            try:
+                files = [f for f in os.listdir(json_folder) if f.endswith('.json')]
+            except Exception:
+                files = []
+        total_files = len(files)
+        print(f"[INFO] {total_files} fichiers trouvés")
+        
+        # Extraction parallèle des tournois (déduplication sur tournament_id)
+        tournaments = {}
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [executor.submit(metrics.bind(process_file), filename) for filename in files]
+            for i, future in enumerate(as_completed(futures)):
+                tournament = future.result()
+                if tournament:
+                    tournaments[tournament[0]] = tournament
+                if i % 1000 == 0:
+                    print(f"[PROGRESS] {i}/{total_files} fichiers traités")
+        
+        all_tournaments = list(tournaments.values())
+        total_tournaments = len(all_tournaments)
+        
+        # Chargement COPY (upsert sur tournament_id en mode incrémental)
+        inserted = loader.load_rows(
+            conn, 'tournament',
+            ('tournament_id', 'tournament_name', 'tournament_date', 'tournament_organizer',
+             'tournament_format', 'tournament_nb_player'),
+            all_tournaments,
+            policy='upsert' if is_incremental else 'insert',
+            key=('tournament_id',) if is_incremental else None,
+            surrogates=(('tournament_key', 'tournament', 'tournament_id'),)
+        )
+        conn.commit()
+        print(f"[INSERTION] {inserted:,}/{total_tournaments:,} tournois insérés")
+        
+        print(f"\n[INFO] Calcul de last_extension...")
+        update_last_extension_optimized(conn, list(affected_ids) if is_incremental else None)
+        
+        # Finalisation : clé primaire (référencée par participation et match), table LOGGED
+        if not is_incremental:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute("ALTER TABLE tournament SET LOGGED")
+                    cur.execute("ALTER TABLE tournament ADD PRIMARY KEY (tournament_id)")
+                    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tournament_key ON tournament(tournament_key)")
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_tournament_date ON tournament(tournament_date)")
+                    conn.commit()
+                except Exception as e:
+                    print(f"[ERREUR FINALISATION] {e}")
+                    raise
+        
+        conn.close()
+        
+        elapsed = time.time() - start_time
+        rate = total_tournaments / elapsed if elapsed > 0 else 0
+        
+        print(f"[OK] Terminé en {elapsed:.1f}s : {total_tournaments:,} tournois insérés")
+        print(f"[PERFORMANCE] {rate:,.0f} tournois/sec")
+        
+    except Exception as e:
+        print(f"[ERREUR CRITIQUE] {e}")
+        raise
+
+if __name__ == '__main__':
+    main()
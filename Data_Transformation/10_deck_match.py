@@ -1,136 +1,147 @@
-# -*- coding: utf-8 -*-
-import sys
-import os
-
-# Force l'encodage UTF-8 dès le début pour éviter les problèmes d'encodage dans les sorties standard et d'erreur
-if hasattr(sys.stdout, 'reconfigure'):
-    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-if hasattr(sys.stderr, 'reconfigure'):
-    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
-
-import psycopg2
-import psycopg2.extras
-from itertools import islice
-import time
-
-# Configuration de la connexion à la base PostgreSQL
-host = 'localhost'
-port = 5432
-database = 'postgres'
-user = 'postgres'
-
-# Taille des batchs pour insertion massive — très grande pour optimiser les performances
-BATCH_SIZE = 500000  
-PROGRESS_INTERVAL = 100000  # Intervalle pour afficher la progression (non utilisé dans ce script)
-
-def get_conn():
-    """Établit une connexion robuste à PostgreSQL avec encodage UTF-8 forcé."""
-    try:
-        os.environ['PGCLIENTENCODING'] = 'UTF8'  # Force l'encodage client
-        
-        conn = psycopg2.connect(
-            host=host, 
-            port=port, 
-            dbname=database, 
-            user=user
-        )
-        conn.set_client_encoding('UTF8')  # Assure la cohérence côté client
-        return conn
-    except UnicodeDecodeError:
-        # En cas d'erreur d'encodage, tente une connexion sans forcer l'encodage (solution de secours)
-        conn = psycopg2.connect(
-            host=host, 
-            port=port, 
-            dbname=database, 
-            user=user
-        )
-        return conn
-
-def create_deck_match_table(conn):
-    """Supprime la table 'deck_match' si elle existe et en crée une nouvelle en mode UNLOGGED (insertion plus rapide, mais pas durable en cas de crash)."""
-    with conn.cursor() as cur:
-        cur.execute("""
-            DROP TABLE IF EXISTS deck_match;
-            CREATE UNLOGGED TABLE deck_match (
-                id SERIAL,                   -- Clé primaire auto-incrémentée
-                match_id INT NOT NULL,       -- Référence au match
-                player_id TEXT NOT NULL,     -- Identifiant du joueur
-                deck_id TEXT,                -- Identifiant du deck (player_id + tournoi)
-                wins SMALLINT DEFAULT 0,     -- Nombre de victoires sur ce match
-                draws SMALLINT DEFAULT 0,    -- Nombre de matchs nuls
-                losses SMALLINT DEFAULT 0    -- Nombre de défaites
-            );
-        """)
-        conn.commit()
-        print("[OK] Table UNLOGGED 'deck_match' créée.")
-
-def populate_deck_match_ultra_fast(conn):
-    """Insertion ultra-rapide des données dans deck_match à partir de la table match.
-    
-    La colonne deck_id est créée dynamiquement en concaténant player_id et tournament_id.
-    """
-    start_time = time.time()
-    
-    print("[INFO] Insertion directe avec SQL pur...")
-    print("[INFO] Utilisation du deck_id = player_id + '_' + tournament_id")
-    
-    with conn.cursor() as cur:
-        # Requête SQL insérant les données dans deck_match avec calcul des victoires, nuls, et défaites
-        cur.execute("""
-            INSERT INTO deck_match (match_id, player_id, deck_id, wins, draws, losses)
-            SELECT 
-                m.match_id,
-                m.player1_id as player_id,
-                CONCAT(m.player1_id, '_', m.tournament_id) as deck_id,
-                CASE WHEN m.match_winner = m.player1_id THEN 1 ELSE 0 END as wins,
-                CASE WHEN m.match_winner IS NULL THEN 1 ELSE 0 END as draws,
-                CASE WHEN m.match_winner = m.player2_id THEN 1 ELSE 0 END as losses
-            FROM match m
-            
-            UNION ALL
-            
-            SELECT 
-                m.match_id,
-                m.player2_id as player_id,
-                CONCAT(m.player2_id, '_', m.tournament_id) as deck_id,
-                CASE WHEN m.match_winner = m.player2_id THEN 1 ELSE 0 END as wins,
-                CASE WHEN m.match_winner IS NULL THEN 1 ELSE 0 END as draws,
-                CASE WHEN m.match_winner = m.player1_id THEN 1 ELSE 0 END as losses
-            FROM match m;
-        """)
-        
-        total_inserted = cur.rowcount  # Nombre total de lignes insérées
-        conn.commit()
-        
-        elapsed = time.time() - start_time
-        rate = total_inserted / elapsed if elapsed > 0 else 0
-        
-        print(f"[OK] {total_inserted:,} lignes insérées en {elapsed:.1f}s ({rate:,.0f} lignes/sec)")
-        
-        # Finalisation : passage de la table en mode LOGGED, ajout d'une clé primaire et d'indexes pour accélérer les requêtes futures
-        print("[INFO] Finalisation...")
-        cur.execute("ALTER TABLE deck_match SET LOGGED")
-        cur.execute("ALTER TABLE deck_match ADD PRIMARY KEY (id)")
-        cur.execute("CREATE INDEX idx_deck_match_deck_id ON deck_match(deck_id)")
-        cur.execute("CREATE INDEX idx_deck_match_player_id ON deck_match(player_id)")
-        cur.execute("CREATE INDEX idx_deck_match_match_id ON deck_match(match_id)")
-        conn.commit()
-
-def main():
-    """Point d'entrée principal du script."""
-    try:
-        print("[INFO] Démarrage du traitement deck_match ULTRA-RAPIDE...")
-        
-        conn = get_conn()
-        
-        create_deck_match_table(conn)
-        populate_deck_match_ultra_fast(conn)
-        
-        conn.close()
-        print("[OK] Script ULTRA-RAPIDE terminé avec succès.")
-        
-    except Exception as e:
-        print(f"[ERREUR CRITIQUE] {e}")
-
-if __name__ == '__main__':
-    main()
+# -*- coding: utf-8 -*-
+import sys
+import os
+
+# Force l'encodage UTF-8 dès le début pour éviter les problèmes d'encodage dans les sorties standard et d'erreur
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+if hasattr(sys.stderr, 'reconfigure'):
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+from db import get_conn
+import time
+import incremental
+import keys
+import partitions
+import shadow
+
+# Taille des batchs pour insertion massive — très grande pour optimiser les performances
+BATCH_SIZE = 500000  
+PROGRESS_INTERVAL = 100000  # Intervalle pour afficher la progression (non utilisé dans ce script)
+json_folder = os.getenv("JSON_FOLDER")  # Utilisé pour détecter les tournois touchés en mode incrémental
+
+def create_deck_match_table(conn):
+    """
+    Crée la table fantôme de 'deck_match' : la table en service reste lisible jusqu'à la bascule.
+    Partitionnée par époque d'extension comme match (partitions.py). Retourne son nom.
+    """
+    target = shadow.create_shadow(conn, 'deck_match', """
+        id SERIAL,                   -- Identifiant auto-incrémenté (unique avec extension_epoch)
+        match_id INT NOT NULL,       -- Référence au match
+        player_key INT,              -- Clé entière du joueur (dim_player)
+        deck_key INT,                -- Clé entière du deck (NULL si le joueur n'a pas de deck)
+        player_id TEXT NOT NULL,     -- Identifiant du joueur
+        deck_id TEXT,                -- Identifiant du deck (player_id + tournoi)
+        wins SMALLINT DEFAULT 0,     -- Nombre de victoires sur ce match
+        draws SMALLINT DEFAULT 0,    -- Nombre de matchs nuls
+        losses SMALLINT DEFAULT 0,   -- Nombre de défaites
+        extension_epoch INT          -- Ère de format du match (clé de partition)
+    """, options=partitions.PARTITION_CLAUSE)
+    partitions.ensure_partitions(conn, target)
+    return target
+
+def delete_stale_deck_match(conn, tournament_ids):
+    """Mode incrémental : supprime les lignes des tournois touchés et celles dont le match a disparu."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            DELETE FROM deck_match dm
+            WHERE NOT EXISTS (SELECT 1 FROM match m WHERE m.match_id = dm.match_id)
+               OR dm.match_id IN (SELECT match_id FROM match WHERE tournament_key IN ({keys.key_subquery('tournament')}))
+        """, (list(tournament_ids),))
+        print(f"[INCREMENTAL] {cur.rowcount:,} lignes supprimées de 'deck_match'")
+
+def populate_deck_match_ultra_fast(conn, tournament_ids=None, finalize=True, table='deck_match'):
+    """Insertion ultra-rapide des données dans 'table' (deck_match ou sa table fantôme) à partir de la table match.
+    
+    La colonne deck_id est créée dynamiquement en concaténant player_id et tournament_id ;
+    deck_key est résolue sur les clés entières de match via deck(tournament_key, player_key),
+    comme dans 15_deck_performance.py, les autres clés viennent de match.
+    Si tournament_ids est fourni (mode incrémental), seuls les matchs de ces tournois sont insérés.
+    """
+    start_time = time.time()
+    
+    print("[INFO] Insertion directe avec SQL pur...")
+    print("[INFO] Utilisation du deck_id = player_id + '_' + tournament_id")
+    
+    match_filter = f"%(ids)s::text[] IS NULL OR m.tournament_key IN ({keys.key_subquery('tournament', '%(ids)s')})"
+    
+    with conn.cursor() as cur:
+        # Requête SQL insérant les données dans deck_match avec calcul des victoires, nuls, et défaites
+        cur.execute(f"""
+            INSERT INTO {table} (match_id, player_key, deck_key, player_id, deck_id, wins, draws, losses, extension_epoch)
+            SELECT 
+                m.match_id,
+                m.player1_key as player_key,
+                d.deck_key,
+                m.player1_id as player_id,
+                CONCAT(m.player1_id, '_', m.tournament_id) as deck_id,
+                CASE WHEN m.winner_key = m.player1_key THEN 1 ELSE 0 END as wins,
+                CASE WHEN m.winner_key IS NULL THEN 1 ELSE 0 END as draws,
+                CASE WHEN m.winner_key = m.player2_key THEN 1 ELSE 0 END as losses,
+                m.extension_epoch
+            FROM match m
+            LEFT JOIN deck d ON d.tournament_key = m.tournament_key AND d.player_key = m.player1_key
+            WHERE {match_filter}
+            
+            UNION ALL
+            
+            SELECT 
+                m.match_id,
+                m.player2_key as player_key,
+                d.deck_key,
+                m.player2_id as player_id,
+                CONCAT(m.player2_id, '_', m.tournament_id) as deck_id,
+                CASE WHEN m.winner_key = m.player2_key THEN 1 ELSE 0 END as wins,
+                CASE WHEN m.winner_key IS NULL THEN 1 ELSE 0 END as draws,
+                CASE WHEN m.winner_key = m.player1_key THEN 1 ELSE 0 END as losses,
+                m.extension_epoch
+            FROM match m
+            LEFT JOIN deck d ON d.tournament_key = m.tournament_key AND d.player_key = m.player2_key
+            WHERE {match_filter};
+        """, {'ids': tournament_ids})
+        
+        total_inserted = cur.rowcount  # Nombre total de lignes insérées
+        conn.commit()
+        
+        elapsed = time.time() - start_time
+        rate = total_inserted / elapsed if elapsed > 0 else 0
+        
+        print(f"[OK] {total_inserted:,} lignes insérées en {elapsed:.1f}s ({rate:,.0f} lignes/sec)")
+        
+        if not finalize:
+            return
+        
+        # Finalisation : index unique (id, clé de partition) et index créés après chargement, puis bascule atomique
+        print("[INFO] Finalisation...")
+        cur.execute(f"CREATE UNIQUE INDEX idx_{table}_key ON {table}(id, extension_epoch)")
+        cur.execute(f"CREATE INDEX idx_{table}_deck_key ON {table}(deck_key)")
+        cur.execute(f"CREATE INDEX idx_{table}_player_key ON {table}(player_key)")
+        cur.execute(f"CREATE INDEX idx_{table}_match_id ON {table}(match_id)")
+        conn.commit()
+        shadow.swap_in(conn, 'deck_match')
+
+def main():
+    """Point d'entrée principal du script."""
+    try:
+        print("[INFO] Démarrage du traitement deck_match ULTRA-RAPIDE...")
+        
+        conn = get_conn()
+        
+        # Mode incrémental : seules les lignes des tournois touchés sont recalculées
+        if incremental.is_incremental(conn, 'deck_match', 'extension_epoch', partitioned=True):
+            partitions.ensure_partitions(conn, 'deck_match')  # Partition d'une nouvelle extension
+            _, affected_ids = incremental.get_changes(conn, json_folder)
+            delete_stale_deck_match(conn, affected_ids)
+            populate_deck_match_ultra_fast(conn, list(affected_ids), finalize=False)
+        else:
+            populate_deck_match_ultra_fast(conn, table=create_deck_match_table(conn))
+        
+        conn.close()
+        print("[OK] Script ULTRA-RAPIDE terminé avec succès.")
+        
+    except Exception as e:
+        print(f"[ERREUR CRITIQUE] {e}")
+        raise
+
+if __name__ == '__main__':
+    main()
@@ -1,302 +1,259 @@
-# -*- coding: utf-8 -*-
-import sys
-import os
-
-# Forcer l'encodage UTF-8 dès le début pour éviter les problèmes d'encodage lors des sorties console
-if hasattr(sys.stdout, 'reconfigure'):
-    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-if hasattr(sys.stderr, 'reconfigure'):
-    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
-
-import psycopg2
-import psycopg2.extras
-import json
-import re
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from itertools import islice
-import time
-import multiprocessing
-import io
-import csv
-from collections import defaultdict
-
-# --- CONFIGURATION ULTRA-OPTIMISÉE ---
-
-host = 'localhost'  # Hôte PostgreSQL
-port = 5432         # Port PostgreSQL
-database = 'postgres'  # Nom de la base
-user = 'postgres'      # Utilisateur PostgreSQL
-json_folder = r"E:\DataCollection\output"  # Dossier contenant les fichiers JSON à traiter
-
-BATCH_SIZE = 2000000  # Très gros batch pour la commande COPY (insertion massive rapide)
-MAX_WORKERS = min(32, multiprocessing.cpu_count() * 2)  # Nombre de processus parallèles, adapté au CPU
-CHUNK_SIZE = 1000     # Nombre de fichiers JSON traités par processus
-
-# --- FONCTIONS UTILITAIRES ---
-
-def clean_text(text):
-    """Nettoie un texte en remplaçant les caractères non-ASCII par des espaces, sans regex (ultra rapide)."""
-    if not text:
-        return ''
-    return ''.join(c if ord(c) < 128 else ' ' for c in str(text)).strip()
-
-def safe_json_load(file_path):
-    """Charge un fichier JSON avec plusieurs essais d'encodages, utilise ujson si possible (plus rapide)."""
-    try:
-        import ujson as json_lib  # ujson est une alternative rapide au json standard
-    except ImportError:
-        import json as json_lib
-    
-    encodings = ['utf-8', 'latin-1', 'cp1252']  # Tentatives d'encodages successifs
-    
-    for encoding in encodings:
-        try:
-            with open(file_path, 'rb') as f:
-                content = f.read()
-                text = content.decode(encoding, errors='replace')  # Décodage robuste
-                return json_lib.loads(text)
-        except:
-            continue
-    return None  # Aucun encodage n'a fonctionné
-
-def get_conn():
-    """Connexion PostgreSQL ultra-optimisée avec paramètres de session pour meilleure perf."""
-    try:
-        os.environ['PGCLIENTENCODING'] = 'UTF8'  # Forcer encodage client
-        
-        conn = psycopg2.connect(
-            host=host, port=port, dbname=database, user=user
-        )
-        conn.set_client_encoding('UTF8')
-        
-        # Paramètres session pour améliorer les performances d'insertion et de gestion mémoire
-        with conn.cursor() as cur:
-            cur.execute("SET work_mem = '1GB'")
-            cur.execute("SET maintenance_work_mem = '2GB'")
-            cur.execute("SET synchronous_commit = off")  # Désactive l'attente de confirmation disque pour plus de vitesse
-            cur.execute("SET checkpoint_completion_target = 0.9")
-            cur.execute("SET wal_buffers = '64MB'")
-        conn.commit()
-        
-        return conn
-    except Exception:
-        # En cas d'erreur, connexion sans réglages spécifiques
-        return psycopg2.connect(host=host, port=port, dbname=database, user=user)
-
-def create_deck_id(player_id, tournament_id):
-    """Création simple d'un identifiant deck par concaténation player_id + '_' + tournament_id."""
-    return f"{player_id}_{tournament_id}"
-
-def create_deck_card_table_optimized(conn):
-    """Création d'une table PostgreSQL UNLOGGED pour insertion rapide, avec autovacuum désactivé."""
-    with conn.cursor() as cur:
-        cur.execute("""
-            DROP TABLE IF EXISTS deck_card CASCADE;
-            CREATE UNLOGGED TABLE deck_card (
-                deck_id TEXT,
-                card_id TEXT,
-                card_name TEXT,
-                count INT
-            ) WITH (
-                fillfactor = 90,
-                autovacuum_enabled = false
-            );
-        """)
-        conn.commit()
-        print("[OK] Table UNLOGGED deck_card créée (mode vitesse max)")
-
-def process_files_chunk(file_chunk):
-    """Traitement parallèle d'un groupe de fichiers JSON."""
-    deck_cards_dict = defaultdict(lambda: defaultdict(int))  # Dictionnaire imbriqué pour déduplication et max(count)
-    
-    for filename in file_chunk:
-        try:
-            file_path = os.path.join(json_folder, filename)
-            data = safe_json_load(file_path)  # Chargement JSON sécurisé
-            
-            if not data:
-                continue
-            
-            tournament_id = clean_text(data.get('id', ''))
-            if not tournament_id:
-                continue
-            
-            for player in data.get('players', []):
-                player_id = clean_text(player.get('id', ''))
-                decklist = player.get('decklist', [])
-                
-                if not decklist or not player_id:
-                    continue
-                
-                deck_id = create_deck_id(player_id, tournament_id)
-                
-                for card in decklist:
-                    card_url = card.get('url', '')
-                    if not card_url:
-                        continue
-                    
-                    card_id = clean_text(card_url)
-                    card_name = clean_text(card.get('name', ''))
-                    count = int(card.get('count', 1))
-                    
-                    key = (deck_id, card_id)
-                    # Garde la valeur maximale de count en cas de doublon
-                    if key in deck_cards_dict:
-                        deck_cards_dict[key] = max(deck_cards_dict[key], count)
-                    else:
-                        deck_cards_dict[key] = count
-                        
-        except Exception:
-            # Ignorer silencieusement les erreurs pour continuer le traitement massif
-            continue
-    
-    # Conversion en liste pour l'insertion en base (card_name laissé vide pour accélérer)
-    result = []
-    for (deck_id, card_id), count in deck_cards_dict.items():
-        result.append((deck_id, card_id, '', count))
-    
-    return result
-
-def chunked_files(files, chunk_size):
-    """Découpe une liste de fichiers en morceaux de taille chunk_size."""
-    for i in range(0, len(files), chunk_size):
-        yield files[i:i + chunk_size]
-
-def bulk_copy_insert(conn, data):
-    """Insertion ultra-rapide en base avec la commande COPY via un buffer CSV en mémoire."""
-    if not data:
-        return 0
-    
-    csv_buffer = io.StringIO()
-    csv_writer = csv.writer(csv_buffer, delimiter='\t')
-    
-    for row in data:
-        csv_writer.writerow(row)
-    
-    csv_buffer.seek(0)
-    
-    with conn.cursor() as cur:
-        cur.copy_from(
-            csv_buffer,
-            'deck_card',
-            columns=('deck_id', 'card_id', 'card_name', 'count'),
-            sep='\t'
-        )
-    
-    return len(data)
-
-def create_indexes_without_transaction(conn):
-    """Création des index et clé primaire en dehors d'une transaction pour pouvoir utiliser CONCURRENTLY."""
-    conn.close()
-    
-    # Nouvelle connexion en autocommit pour éviter les erreurs liées à CONCURRENTLY
-    new_conn = psycopg2.connect(host=host, port=port, dbname=database, user=user)
-    new_conn.set_client_encoding('UTF8')
-    new_conn.autocommit = True
-    
-    with new_conn.cursor() as cur:
-        try:
-            print("[INFO] Création des index sans transaction...")
-            
-            # PRIMARY KEY (doit être dans une transaction)
-            new_conn.autocommit = False
-            cur.execute("ALTER TABLE deck_card ADD PRIMARY KEY (deck_id, card_id)")
-            new_conn.commit()
-            
-            # Index avec CONCURRENTLY (permet de ne pas bloquer les requêtes)
-            new_conn.autocommit = True
-            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_deck_card_card_id ON deck_card(card_id)")
-            cur.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_deck_card_deck_id ON deck_card(deck_id)")
-            
-            # Retour en mode LOGGED pour fiabilité après insertion massive
-            new_conn.autocommit = False
-            cur.execute("ALTER TABLE deck_card SET LOGGED")
-            new_conn.commit()
-            
-            print("[OK] Index créés avec succès")
-            
-        except Exception as e:
-            print(f"[ERREUR INDEX] {e}")
-        finally:
-            new_conn.close()
-
-def main():
-    start_time = time.time()
-    
-    try:
-        print("[INFO] Démarrage ULTRA-RAPIDE deck_card...")
-        print("[INFO] deck_id = player_id + '_' + tournament_id")
-        
-        conn = get_conn()
-        create_deck_card_table_optimized(conn)
-        
-        # Phase 1 : Récupération des fichiers JSON à traiter
-        try:
-            files = [f for f in os.listdir(json_folder) if f.endswith('.json')]
-        except:
-            files = []
-        
-        total_files = len(files)
-        print(f"[INFO] {total_files} fichiers trouvés")
-        
-        if not files:
-            print("[INFO] Aucun fichier à traiter")
-            return
-        
-        # Phase 2 : Traitement parallèle massif avec ProcessPoolExecutor
-        print(f"[INFO] Traitement parallèle MASSIF avec {MAX_WORKERS} processus...")
-        
-        all_deck_cards = []
-        file_chunks = list(chunked_files(files, CHUNK_SIZE))
-        
-        with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = [executor.submit(process_files_chunk, chunk) for chunk in file_chunks]
-            
-            processed_chunks = 0
-            for future in as_completed(futures):
-                deck_cards = future.result()
-                if deck_cards:
-                    all_deck_cards.extend(deck_cards)
-                
-                processed_chunks += 1
-                if processed_chunks % 5 == 0:
-                    print(f"[PARALLEL] {processed_chunks}/{len(file_chunks)} chunks | {len(all_deck_cards):,} associations")
-        
-        total_associations = len(all_deck_cards)
-        print(f"[INFO] {total_associations:,} associations collectées")
-        
-        if not all_deck_cards:
-            print("[INFO] Aucune association trouvée")
-            return
-        
-        # Phase 3 : Insertion massive ULTRA-RAPIDE avec COPY
-        print("[INFO] Insertion ULTRA-RAPIDE avec COPY...")
-        
-        inserted = 0
-        for i in range(0, len(all_deck_cards), BATCH_SIZE):
-            chunk = all_deck_cards[i:i + BATCH_SIZE]
-            try:
-                inserted_count = bulk_copy_insert(conn, chunk)
-                inserted += inserted_count
-                print(f"[COPY] {inserted:,}/{total_associations:,} associations insérées", end='\r')
-            except Exception as e:
-                print(f"\n[ERREUR COPY] {e}")
-                continue
-        
-        conn.commit()
-        print(f"\n[INFO] Insertion terminée")
-        
-        # Phase 4 : Création des index hors transaction pour éviter blocages
-        create_indexes_without_transaction(conn)
-        
-        elapsed = time.time() - start_time
-        rate = total_associations / elapsed if elapsed > 0 else 0
-        
-        print(f"[OK] ULTRA-RAPIDE terminé en {elapsed:.1f}s : {total_associations:,} associations")
-        print(f"[PERFORMANCE] {rate:,.0f} associations/sec | {total_files} fichiers")
-
-    except Exception as e:
-        print(f"[ERREUR CRITIQUE] {e}")
-
-if __name__ == '__main__':
-    main()
+# -*- coding: utf-8 -*-
+import sys
+import os
+
+# Forcer l'encodage UTF-8 dès le début pour éviter les problèmes d'encodage lors des sorties console
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+if hasattr(sys.stderr, 'reconfigure'):
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+import db
+from concurrent.futures import ProcessPoolExecutor
+import time
+import multiprocessing
+from tournament_cache import load_tournament
+import incremental
+import keys
+import loader
+import shadow
+
+# --- CONFIGURATION ULTRA-OPTIMISÉE ---
+
+json_folder = os.getenv("JSON_FOLDER", r"E:\DataCollection\output")  # Dossier contenant les fichiers JSON à traiter
+
+MAX_WORKERS = min(32, multiprocessing.cpu_count() * 2)  # Nombre de processus parallèles, adapté au CPU
+CHUNK_SIZE = 200      # Nombre de fichiers JSON par lot au départ (ajusté par loader.AdaptiveBatcher)
+
+# Clé entière de la carte attribuée à la fusion (voir keys.py)
+DECKLIST_SURROGATES = (
+    ('card_key', 'card', 'card_id'),
+)
+
+# --- FONCTIONS UTILITAIRES ---
+
+def get_conn():
+    """Connexion PostgreSQL (db.get_conn) avec paramètres de session pour meilleure perf."""
+    conn = db.get_conn()
+    try:
+        # Paramètres session pour améliorer les performances d'insertion et de gestion mémoire
+        with conn.cursor() as cur:
+            cur.execute("SET work_mem = '1GB'")
+            cur.execute("SET maintenance_work_mem = '2GB'")
+            cur.execute("SET synchronous_commit = off")  # Désactive l'attente de confirmation disque pour plus de vitesse
+            cur.execute("SET checkpoint_completion_target = 0.9")
+            cur.execute("SET wal_buffers = '64MB'")
+        conn.commit()
+    except Exception:
+        # En cas d'erreur, connexion sans réglages spécifiques
+        conn.rollback()
+    return conn
+
+def create_decklist_table_optimized(conn):
+    """Création de la table fantôme de decklist (autovacuum désactivé) ; la table en service reste lisible. Retourne son nom."""
+    return shadow.create_shadow(conn, 'decklist', """
+        decklist_hash BIGINT NOT NULL,
+        card_key INT,
+        card_id TEXT,
+        count INT
+    """, "WITH (fillfactor = 90, autovacuum_enabled = false)")
+
+def replace_legacy_deck_card(conn):
+    """
+    Ancien schéma : 'deck_card' était une table (une ligne par carte et par deck).
+    Elle est supprimée, avec ses versions conservées, pour laisser place à la vue.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('deck_card')")
+        row = cur.fetchone()
+        if not row or row[0] != 'r':
+            return
+        for version in ['deck_card'] + shadow.versions(conn, 'deck_card'):
+            cur.execute(f"DROP TABLE IF EXISTS {version} CASCADE")
+        cur.execute(f"DROP TABLE IF EXISTS {shadow.shadow_name('deck_card')}")
+    conn.commit()
+    print("[INFO] Ancienne table 'deck_card' remplacée par la vue sur 'decklist'")
+
+def create_deck_card_view(conn):
+    """
+    Vue 'deck_card' : une ligne par carte et par deck (forme de l'ancienne table),
+    reconstituée depuis deck (decklist_hash, renseigné par 08_deck.py) et decklist.
+    """
+    replace_legacy_deck_card(conn)
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE OR REPLACE VIEW deck_card AS
+            SELECT d.deck_key, dl.card_key, d.tournament_key,
+                   d.deck_id, d.tournament_id, dl.card_id,
+                   ''::text AS card_name, dl.count, d.decklist_hash, d.extension_epoch
+            FROM deck d
+            JOIN decklist dl ON dl.decklist_hash = d.decklist_hash
+        """)
+    conn.commit()
+
+def process_files_chunk(file_chunk):
+    """
+    Traitement parallèle d'un groupe de fichiers JSON : lignes (decklist_hash, card_id, count)
+    de chaque liste distincte du lot, les cartes d'une même liste étant consécutives.
+    """
+    seen = set()
+    rows = []
+
+    for filename in file_chunk:
+        try:
+            # Enregistrement normalisé issu du cache (textes déjà nettoyés)
+            record = load_tournament(os.path.join(json_folder, filename))
+
+            if not record:
+                continue
+
+            for _, _, _, _, decklist in record['players']:
+                if not decklist:
+                    continue
+
+                # Hash canonique : count maximal en cas de carte en double
+                decklist_hash, cards = keys.decklist_hash(decklist)
+                if decklist_hash is None or decklist_hash in seen:
+                    continue
+                seen.add(decklist_hash)
+                rows.extend((decklist_hash, card_id, count) for card_id, count in cards)
+
+        except Exception:
+            # Ignorer silencieusement les erreurs pour continuer le traitement massif
+            continue
+
+    return rows
+
+def unique_decklists(rows):
+    """
+    Lignes des listes distinctes, tous lots confondus : une liste déjà envoyée par un
+    lot précédent est ignorée (les cartes d'une liste arrivent consécutivement).
+    """
+    seen = set()
+    current = None
+    keep = False
+    for row in rows:
+        if row[0] != current:
+            current = row[0]
+            keep = current not in seen
+            seen.add(current)
+        if keep:
+            yield row
+
+def report_duplication(conn):
+    """Affiche le facteur de déduplication : decks par liste distincte."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(decklist_hash), count(DISTINCT decklist_hash) FROM deck")
+        nb_decks, nb_lists = cur.fetchone()
+    conn.commit()
+    if nb_lists:
+        print(f"[DEDUP] {nb_decks:,} decks -> {nb_lists:,} listes distinctes (facteur {nb_decks / nb_lists:.1f})")
+
+def create_indexes_and_swap(conn, table):
+    """
+    Création de la clé primaire et des index sur la table fantôme (personne ne la lit :
+    CONCURRENTLY est inutile), puis bascule atomique vers decklist.
+    """
+    with conn.cursor() as cur:
+        try:
+            print("[INFO] Création des index sur la table fantôme...")
+            cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (decklist_hash, card_key)")
+            cur.execute(f"CREATE INDEX idx_{table}_card_key ON {table}(card_key)")
+            conn.commit()
+            print("[OK] Index créés avec succès")
+
+            shadow.swap_in(conn, 'decklist')
+
+        except Exception as e:
+            conn.rollback()
+            print(f"[ERREUR INDEX] {e}")
+            raise
+
+def delete_orphan_decklists(conn):
+    """Mode incrémental : supprime les listes qui ne sont plus référencées par aucun deck."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM decklist dl
+            WHERE NOT EXISTS (SELECT 1 FROM deck d WHERE d.decklist_hash = dl.decklist_hash)
+        """)
+        print(f"[INCREMENTAL] {cur.rowcount:,} lignes de listes orphelines supprimées de 'decklist'")
+
+def main():
+    start_time = time.time()
+
+    try:
+        print("[INFO] Démarrage ULTRA-RAPIDE decklist...")
+
+        conn = get_conn()
+
+        # Phase 1 : Récupération des fichiers JSON à traiter (fichiers modifiés en incrémental)
+        is_incremental = incremental.is_incremental(conn, 'decklist', 'card_key')
+        if is_incremental:
+            target = 'decklist'
+            files, _ = incremental.get_changes(conn, json_folder)
+            delete_orphan_decklists(conn)
+        else:
+            target = create_decklist_table_optimized(conn)
+            try:
+                files = [f for f in os.listdir(json_folder) if f.endswith('.json')]
+            except:
+                files = []
+
+        total_files = len(files)
+        print(f"[INFO] {total_files} fichiers trouvés")
+
+        if not files:
+            conn.commit()
+            conn.close()
+            print("[INFO] Aucun fichier à traiter")
+            return
+
+        # Phase 2 et 3 : Traitement parallèle MASSIF en flux vers un COPY binaire unique
+        # (lots bornés : la mémoire ne dépend pas du nombre de tournois)
+        print(f"[INFO] Traitement parallèle MASSIF avec {MAX_WORKERS} processus...")
+
+        total_rows = 0
+        # Processus lancés par 'spawn' : un fork depuis le runner multi-threadé hériterait
+        # de verrous tenus par d'autres threads (pool de connexions, métriques)
+        with ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn")) as executor:
+            rows = loader.stream_batches(
+                executor, process_files_chunk, loader.AdaptiveBatcher(files, CHUNK_SIZE, label='decklist'),
+                label='fichiers'
+            )
+            try:
+                # Répartition par hash de liste sur PARALLEL_COPY_CONNECTIONS connexions ;
+                # en incrémental, les listes déjà présentes sont ignorées (ON CONFLICT)
+                total_rows = loader.parallel_load_rows(
+                    conn, get_conn, target, ('decklist_hash', 'card_id', 'count'),
+                    unique_decklists(rows), 'decklist_hash', fmt='binary',
+                    key=('decklist_hash', 'card_key') if is_incremental else None,
+                    surrogates=DECKLIST_SURROGATES
+                )
+            except Exception as e:
+                print(f"\n[ERREUR COPY] {e}")
+                raise
+
+        conn.commit()
+        print(f"[INFO] Insertion terminée")
+        report_duplication(conn)
+
+        # Phase 4 : Index sur la table fantôme puis bascule (déjà présents en incrémental)
+        if not is_incremental and not total_rows:
+            print("[SHADOW] Chargement vide ou en échec : la table 'decklist' en service est conservée")
+        elif not is_incremental:
+            create_indexes_and_swap(conn, target)
+        create_deck_card_view(conn)
+        conn.close()
+
+        elapsed = time.time() - start_time
+        rate = total_rows / elapsed if elapsed > 0 else 0
+
+        print(f"[OK] ULTRA-RAPIDE terminé en {elapsed:.1f}s : {total_rows:,} lignes de listes")
+        print(f"[PERFORMANCE] {rate:,.0f} lignes/sec | {total_files} fichiers")
+
+    except Exception as e:
+        print(f"[ERREUR CRITIQUE] {e}")
+        raise
+
+if __name__ == '__main__':
+    main()
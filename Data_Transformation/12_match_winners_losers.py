@@ -1,72 +1,259 @@
-import pandas as pd
-from sqlalchemy import create_engine, text
-import logging
-
-# Configuration du logger
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler("insertion.log"),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
-
-# Connexion à la base PostgreSQL
-engine = create_engine(
-    "postgresql+psycopg2://postgres:@localhost:5432/postgres"
-)
-
-# Suppression de la table si elle existe
-with engine.connect() as conn:
-    conn.execute(text("DROP TABLE IF EXISTS match_winners_losers;"))
-    conn.commit()
-logger.info("Ancienne table match_winners_losers supprimée (si existante).")
-
-# Création de la table cible avec IDs joueurs en TEXT
-create_table_sql = """
-CREATE TABLE IF NOT EXISTS match_winners_losers (
-    match_id INTEGER PRIMARY KEY,
-    winner_id TEXT,
-    looser_id TEXT,
-    winner_deck_name TEXT,
-    looser_deck_name TEXT
-);
-"""
-
-with engine.connect() as conn:
-    conn.execute(text(create_table_sql))
-    conn.commit()
-logger.info("Table match_winners_losers créée.")
-
-# Extraction des données
-query = """
-SELECT
-    m.match_id,
-    m.match_winner AS winner_id,
-    dm2.player_id AS looser_id,
-    d1.deck_nom AS winner_deck_name,
-    d2.deck_nom AS looser_deck_name
-FROM
-    match m
-JOIN deck_match dm1 ON dm1.match_id = m.match_id AND dm1.player_id = m.match_winner
-JOIN deck d1 ON d1.deck_id = dm1.deck_id
-JOIN deck_match dm2 ON dm2.match_id = m.match_id AND dm2.player_id != m.match_winner
-JOIN deck d2 ON d2.deck_id = dm2.deck_id
-;
-"""
-
-df = pd.read_sql(query, engine)
-logger.info(f"{len(df)} lignes extraites pour insertion.")
-
-# Insertion en batch avec pandas (bien plus rapide)
-df.to_sql('match_winners_losers', engine, if_exists='append', index=False, method='multi')
-logger.info("Toutes les lignes insérées en une seule opération.")
-
-# Affiche un aperçu des premières lignes insérées
-print("Aperçu des premières lignes insérées :")
-print(df.head())
-
-logger.info("Insertion terminée.")
-print("Insertion terminée.")
+import logging
+import os
+import sys
+import time
+import db
+import incremental
+import keys
+import shadow
+
+WORK_MEM = os.getenv("MWL_WORK_MEM", "256MB")  # Mémoire des jointures par hachage (INSERT ... SELECT)
+TO_SQL_CHUNKSIZE = 10000  # Lignes par INSERT multi-lignes de l'ancien chemin pandas (benchmark)
+MWL_COLUMNS = ('match_id', 'winner_id', 'looser_id', 'winner_deck_name', 'looser_deck_name', 'is_draw')
+
+# Vainqueur/perdant et decks de chaque match, calculés entièrement dans PostgreSQL.
+# Un nul (match_winner NULL) n'est plus perdu par la jointure : il est conservé avec
+# is_draw = TRUE, player1 en colonne winner_* et player2 en colonne looser_*.
+# Les jointures portent sur les colonnes player1_key / player2_key (équijointures bien
+# estimées, donc jointures par hachage) ; le côté vainqueur est choisi ensuite.
+SELECT_SQL = f"""
+    SELECT
+        m.match_id,
+        CASE WHEN m.winner_key = m.player2_key THEN dm2.player_id ELSE dm1.player_id END AS winner_id,
+        CASE WHEN m.winner_key = m.player2_key THEN dm1.player_id ELSE dm2.player_id END AS looser_id,
+        CASE WHEN m.winner_key = m.player2_key THEN d2.deck_nom ELSE d1.deck_nom END AS winner_deck_name,
+        CASE WHEN m.winner_key = m.player2_key THEN d1.deck_nom ELSE d2.deck_nom END AS looser_deck_name,
+        m.winner_key IS NULL AS is_draw
+    FROM
+        match m
+    JOIN deck_match dm1 ON dm1.match_id = m.match_id AND dm1.player_key = m.player1_key
+    JOIN deck d1 ON d1.deck_key = dm1.deck_key
+    JOIN deck_match dm2 ON dm2.match_id = m.match_id AND dm2.player_key = m.player2_key
+    JOIN deck d2 ON d2.deck_key = dm2.deck_key
+    WHERE CAST(%(ids)s AS text[]) IS NULL
+       OR m.tournament_key IN ({keys.key_subquery('tournament', '%(ids)s')})
+"""
+
+def create_mwl_shadow(conn):
+    """Table fantôme de match_winners_losers, sans clé primaire (créée après l'insertion). Retourne son nom."""
+    return shadow.create_shadow(conn, 'match_winners_losers', """
+        match_id INTEGER NOT NULL,
+        winner_id TEXT,
+        looser_id TEXT,
+        winner_deck_name TEXT,
+        looser_deck_name TEXT,
+        is_draw BOOLEAN NOT NULL DEFAULT FALSE
+    """)
+
+def insert_matches(conn, table, affected_ids=None):
+    """
+    INSERT ... SELECT ensembliste dans 'table' (tous les matchs, ou ceux des tournois touchés).
+    match_id et player_key étant corrélés, le planificateur estime une ligne par jointure
+    et choisit des boucles imbriquées : en reconstruction complète, elles sont désactivées
+    pour cette transaction (en incrémental, les quelques tournois touchés s'y prêtent).
+    """
+    with conn.cursor() as cur:
+        if affected_ids is None:
+            cur.execute("SET LOCAL enable_nestloop = off")
+            cur.execute(f"SET LOCAL work_mem = '{WORK_MEM}'")
+        cur.execute(f"INSERT INTO {table} ({', '.join(MWL_COLUMNS)}) {SELECT_SQL}", {'ids': affected_ids})
+        return cur.rowcount
+
+def create_indexes_and_swap(conn, table):
+    """Clé primaire créée après le chargement, puis bascule de la table fantôme."""
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (match_id)")
+    conn.commit()
+    shadow.swap_in(conn, 'match_winners_losers')
+
+# Ancienne requête pandas : jointure sur le vainqueur (les nuls sont perdus)
+PANDAS_SELECT_SQL = """
+    SELECT
+        m.match_id,
+        m.match_winner AS winner_id,
+        dm2.player_id AS looser_id,
+        d1.deck_nom AS winner_deck_name,
+        d2.deck_nom AS looser_deck_name
+    FROM
+        match m
+    JOIN deck_match dm1 ON dm1.match_id = m.match_id AND dm1.player_key = m.winner_key
+    JOIN deck d1 ON d1.deck_key = dm1.deck_key
+    JOIN deck_match dm2 ON dm2.match_id = m.match_id AND dm2.player_key != m.winner_key
+    JOIN deck d2 ON d2.deck_key = dm2.deck_key
+"""
+
+def benchmark(nb_matches=5000000):
+    """
+    Compare l'ancien chemin pandas (pd.read_sql de la jointure à quatre tables puis
+    df.to_sql(method='multi') dans une table à clé primaire) et l'INSERT ... SELECT
+    ensembliste sur nb_matches matchs synthétiques (schéma jetable mwl_benchmark).
+    to_sql reçoit un chunksize de TO_SQL_CHUNKSIZE lignes : en un seul INSERT, les
+    millions de lignes ne tiennent pas en mémoire côté client.
+    """
+    import pandas as pd
+    from sqlalchemy import create_engine
+
+    conn = db.get_conn()
+    with conn.cursor() as cur:
+        print(f"[BENCHMARK] Génération de {nb_matches:,} matchs synthétiques...")
+        cur.execute("DROP SCHEMA IF EXISTS mwl_benchmark CASCADE")
+        cur.execute("CREATE SCHEMA mwl_benchmark")
+        cur.execute("SET search_path TO mwl_benchmark, public")
+        cur.execute("""
+            CREATE UNLOGGED TABLE match AS
+            SELECT g AS match_id, g / 500 AS tournament_key, 2 * g AS player1_key, 2 * g + 1 AS player2_key,
+                   CASE WHEN g %% 5 = 0 THEN NULL WHEN g %% 2 = 0 THEN 2 * g ELSE 2 * g + 1 END AS winner_key
+            FROM generate_series(1, %s) g
+        """, (nb_matches,))
+        cur.execute("ALTER TABLE match ADD COLUMN match_winner TEXT")
+        cur.execute("UPDATE match SET match_winner = 'player' || winner_key")
+        cur.execute("""
+            CREATE UNLOGGED TABLE deck_match AS
+            SELECT m.match_id, p.player_key, 'player' || p.player_key AS player_id,
+                   (hashint4(p.player_key) & 262143) + 1 AS deck_key
+            FROM match m CROSS JOIN LATERAL (VALUES (m.player1_key), (m.player2_key)) AS p(player_key)
+        """)
+        cur.execute("""
+            CREATE UNLOGGED TABLE deck AS
+            SELECT g AS deck_key, 'Archetype' || (g % 300) AS deck_nom FROM generate_series(1, 262144) g
+        """)
+        cur.execute("ALTER TABLE match ADD PRIMARY KEY (match_id)")
+        cur.execute("ALTER TABLE deck ADD PRIMARY KEY (deck_key)")
+        cur.execute("CREATE INDEX ON deck_match(match_id)")
+        cur.execute("ANALYZE match; ANALYZE deck_match; ANALYZE deck")
+        # Ancienne table cible : clé primaire créée avant l'insertion
+        cur.execute("""
+            CREATE UNLOGGED TABLE mwl_round_trip (
+                match_id INTEGER PRIMARY KEY,
+                winner_id TEXT,
+                looser_id TEXT,
+                winner_deck_name TEXT,
+                looser_deck_name TEXT
+            )
+        """)
+        cur.execute("CREATE UNLOGGED TABLE mwl_set_based (LIKE public.match_winners_losers)")
+    conn.commit()
+
+    # Ancien chemin : DataFrame pandas puis INSERT multi-lignes de SQLAlchemy
+    engine = create_engine(db.sqlalchemy_url(), connect_args={
+        **db.CONNECT_ARGS, 'options': '-c search_path=mwl_benchmark,public'})
+    start_time = time.time()
+    df = pd.read_sql(PANDAS_SELECT_SQL, engine)
+    df.to_sql('mwl_round_trip', engine, if_exists='append', index=False, method='multi',
+              chunksize=TO_SQL_CHUNKSIZE)
+    round_trip = time.time() - start_time
+    round_trip_rows = len(df)
+    del df
+    engine.dispose()
+
+    # Nouveau chemin : INSERT ... SELECT puis clé primaire
+    start_time = time.time()
+    inserted = insert_matches(conn, 'mwl_set_based')
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE mwl_set_based ADD PRIMARY KEY (match_id)")
+    conn.commit()
+    set_based = time.time() - start_time
+
+    with conn.cursor() as cur:
+        cur.execute("DROP SCHEMA mwl_benchmark CASCADE")
+    conn.commit()
+    conn.close()
+
+    print(f"[BENCHMARK] {inserted:,} lignes ({round_trip_rows:,} par l'ancien chemin, nuls perdus)")
+    print(f"[BENCHMARK] pd.read_sql + to_sql(method='multi') : {round_trip:.2f}s")
+    print(f"[BENCHMARK] INSERT ... SELECT ensembliste        : {set_based:.2f}s | x{round_trip / set_based:.2f}")
+    return round_trip, set_based
+
+def main():
+    """Construit match_winners_losers (vainqueur/perdant, ou nul, et noms de decks de chaque match)."""
+    # Configuration du logger
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[
+            logging.FileHandler("insertion.log"),
+            logging.StreamHandler()
+        ],
+        force=True  # Reconfiguration à chaque exécution (runner en processus unique)
+    )
+    logger = logging.getLogger(__name__)
+    start_time = time.time()
+
+    # Mode incrémental : la table existante est conservée, seuls les tournois touchés sont recalculés
+    raw_conn = db.get_conn()
+    is_incremental = incremental.is_incremental(raw_conn, 'match_winners_losers', 'is_draw')
+    affected_ids = None
+
+    if is_incremental:
+        target = 'match_winners_losers'
+        _, affected_ids = incremental.get_changes(raw_conn, os.getenv("JSON_FOLDER"))
+        affected_ids = list(affected_ids)
+        with raw_conn.cursor() as cur:
+            # Les decks des lignes supprimées sont notés pour le recalcul de deck_counters (13)
+            cur.execute("CREATE TABLE IF NOT EXISTS deck_counters_touched (deck_name TEXT)")
+            cur.execute(f"""
+                WITH deleted AS (
+                    DELETE FROM match_winners_losers mwl
+                    WHERE NOT EXISTS (SELECT 1 FROM match m WHERE m.match_id = mwl.match_id)
+                       OR mwl.match_id IN (SELECT match_id FROM match
+                                           WHERE tournament_key IN ({keys.key_subquery('tournament')}))
+                    RETURNING winner_deck_name, looser_deck_name
+                )
+                INSERT INTO deck_counters_touched (deck_name)
+                SELECT winner_deck_name FROM deleted WHERE winner_deck_name IS NOT NULL
+                UNION
+                SELECT looser_deck_name FROM deleted WHERE looser_deck_name IS NOT NULL
+            """, (affected_ids,))
+            logger.info(f"{cur.rowcount} decks touchés par les lignes obsolètes de match_winners_losers.")
+        raw_conn.commit()
+    else:
+        # Reconstruction dans la table fantôme : la table en service reste lisible
+        target = create_mwl_shadow(raw_conn)
+
+    # Construction ensembliste (jointures sur les clés entières de match, deck_match et deck)
+    inserted = insert_matches(raw_conn, target, affected_ids)
+    raw_conn.commit()
+    logger.info(f"{inserted} lignes insérées par INSERT ... SELECT.")
+
+    if not is_incremental:
+        create_indexes_and_swap(raw_conn, target)
+
+    # En incrémental, les decks des nouvelles lignes sont également à recalculer
+    if is_incremental:
+        with raw_conn.cursor() as cur:
+            touched = keys.key_subquery('tournament', '%(ids)s')
+            cur.execute(f"""
+                INSERT INTO deck_counters_touched (deck_name)
+                SELECT mwl.winner_deck_name FROM match_winners_losers mwl
+                JOIN match m ON m.match_id = mwl.match_id
+                WHERE m.tournament_key IN ({touched}) AND mwl.winner_deck_name IS NOT NULL
+                UNION
+                SELECT mwl.looser_deck_name FROM match_winners_losers mwl
+                JOIN match m ON m.match_id = mwl.match_id
+                WHERE m.tournament_key IN ({touched}) AND mwl.looser_deck_name IS NOT NULL
+            """, {'ids': affected_ids})
+        raw_conn.commit()
+
+    # Affiche un aperçu des premières lignes insérées
+    with raw_conn.cursor() as cur:
+        cur.execute(f"SELECT {', '.join(MWL_COLUMNS)} FROM match_winners_losers ORDER BY match_id LIMIT 5")
+        preview = cur.fetchall()
+        cur.execute("SELECT count(*) FILTER (WHERE is_draw) FROM match_winners_losers")
+        nb_draws = cur.fetchone()[0]
+    raw_conn.close()
+    print("Aperçu des premières lignes insérées :")
+    for row in preview:
+        print(row)
+
+    elapsed = time.time() - start_time
+    rate = inserted / elapsed if elapsed > 0 else 0
+    print(f"[PERFORMANCE] {inserted:,} lignes en {elapsed:.1f}s ({rate:,.0f} lignes/sec) dont {nb_draws:,} nuls")
+    logger.info("Insertion terminée.")
+    print("Insertion terminée.")
+
+if __name__ == '__main__':
+    if '--benchmark' in sys.argv:
+        args = [arg for arg in sys.argv[1:] if arg.isdigit()]
+        benchmark(int(args[0]) if args else 5000000)
+    else:
+        main()
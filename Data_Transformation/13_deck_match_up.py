@@ -1,138 +1,319 @@
-import pandas as pd
-from sqlalchemy import create_engine, text
-import logging
-
-# Logger
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler("deck_counters_insertion.log"),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
-
-# Connexion à PostgreSQL
-engine = create_engine(
-    "postgresql+psycopg2://postgres:@localhost:5432/postgres"
-)
-
-# Suppression de la table si elle existe
-with engine.connect() as conn:
-    conn.execute(text("DROP TABLE IF EXISTS deck_counters;"))
-    conn.commit()
-logger.info("Ancienne table deck_counters supprimée (si existante).")
-
-# Création de la nouvelle table avec toutes les colonnes
-create_table_sql = """
-CREATE TABLE IF NOT EXISTS deck_counters (
-    deck_name TEXT PRIMARY KEY,
-    best_counter TEXT,
-    best_counter_winrate FLOAT,
-    nb_match INTEGER,
-    nb_victoire INTEGER,
-    nb_defaites INTEGER
-);
-"""
-with engine.connect() as conn:
-    conn.execute(text(create_table_sql))
-    conn.commit()
-logger.info("Table deck_counters créée.")
-
-# Lecture des données depuis match_winners_losers
-df = pd.read_sql("""
-    SELECT winner_deck_name, looser_deck_name
-    FROM match_winners_losers
-    WHERE winner_deck_name IS NOT NULL
-      AND looser_deck_name IS NOT NULL
-      AND winner_deck_name <> looser_deck_name
-""", engine)
-
-# Nombre de victoires pour chaque matchup (counter gagne contre deck_name)
-wins = df.groupby(['winner_deck_name', 'looser_deck_name']).size().reset_index(name='wins')
-
-# Nombre de défaites pour chaque matchup (counter perd contre deck_name)
-losses = df.groupby(['looser_deck_name', 'winner_deck_name']).size().reset_index(name='losses')
-
-# Nombre total de matchs entre chaque paire de decks (quel que soit le sens)
-total_matches_1 = df.groupby(['winner_deck_name', 'looser_deck_name']).size().reset_index(name='count1')
-total_matches_2 = df.groupby(['looser_deck_name', 'winner_deck_name']).size().reset_index(name='count2')
-
-# Fusion pour obtenir le total de matchs dans les deux sens
-merged_counts = pd.merge(
-    total_matches_1,
-    total_matches_2,
-    left_on=['winner_deck_name', 'looser_deck_name'],
-    right_on=['looser_deck_name', 'winner_deck_name'],
-    how='outer'
-).fillna(0)
-
-# Renommer les colonnes pour plus de clarté
-merged_counts = merged_counts.rename(columns={
-    'winner_deck_name_x': 'winner_deck_name',
-    'looser_deck_name_x': 'looser_deck_name',
-    'count1': 'count1',
-    'count2': 'count2'
-})
-
-# Calcul du total des matchs entre les deux decks
-merged_counts['total_matches'] = merged_counts['count1'] + merged_counts['count2']
-
-# Préparation du DataFrame des victoires et défaites
-wins = wins.rename(columns={'winner_deck_name': 'counter', 'looser_deck_name': 'deck_name'})
-losses = losses.rename(columns={'looser_deck_name': 'counter', 'winner_deck_name': 'deck_name'})
-
-# Fusion des victoires, défaites, et total des matchs
-matchups = pd.merge(
-    wins,
-    losses,
-    on=['counter', 'deck_name'],
-    how='outer'
-).fillna(0)
-
-matchups = pd.merge(
-    matchups,
-    merged_counts[["winner_deck_name", "looser_deck_name", "total_matches"]],
-    left_on=['counter', 'deck_name'],
-    right_on=['winner_deck_name', 'looser_deck_name'],
-    how='left'
-).fillna(0)
-
-matchups['wins'] = matchups['wins'].astype(int)
-matchups['losses'] = matchups['losses'].astype(int)
-matchups['total_matches'] = matchups['total_matches'].astype(int)
-
-# Laplace smoothing
-k = 5  # paramètre de lissage, ajustable
-matchups['winrate_lisse'] = (matchups['wins'] + k) / (matchups['total_matches'] + 2 * k)
-
-# On peut aussi filtrer les matchups avec peu de matchs
-min_match = 5  # seuil minimal de matchs pour qu'un matchup soit pris en compte
-matchups = matchups[matchups['total_matches'] >= min_match]
-
-# Pour chaque deck, trouver le meilleur counter selon le winrate lissé
-best_counters = (
-    matchups.sort_values(['deck_name', 'winrate_lisse', 'total_matches'], ascending=[True, False, False])
-    .groupby('deck_name')
-    .first()
-    .reset_index()
-    .rename(columns={
-        'counter': 'best_counter',
-        'winrate_lisse': 'best_counter_winrate',
-        'total_matches': 'nb_match',
-        'wins': 'nb_victoire',
-        'losses': 'nb_defaites'
-    })
-    [['deck_name', 'best_counter', 'best_counter_winrate', 'nb_match', 'nb_victoire', 'nb_defaites']]
-)
-
-# Insertion dans la table PostgreSQL
-best_counters.to_sql('deck_counters', engine, if_exists='append', index=False, method='multi')
-logger.info("Table deck_counters remplie avec succès.")
-
-print("Aperçu du résultat :")
-print(best_counters.head())
-
-logger.info("Insertion terminée.")
-print("Insertion terminée.")
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+import logging
+import db
+import incremental
+import loader
+
+# Matrice des confrontations : chaque nom de deck reçoit un indice entier, les résultats
+# sont cumulés dans des matrices deck x deck (W[a, b] = victoires de a contre b,
+# D[a, b] = nuls entre a et b) ; défaites et totaux s'en déduisent (W.T, W + W.T + D).
+# Au-delà de DENSE_MAX_DECKS decks, les paires observées sont cumulées sous forme creuse.
+# Chaque paire reçoit un intervalle à 95 % de son winrate : Wilson (formule fermée) et
+# bootstrap (rééchantillonnage des parties de la paire, toutes paires à la fois).
+
+K_SMOOTHING = 5      # Lissage de Laplace : (victoires + nuls / 2 + k) / (matchs + 2k)
+MIN_MATCH = 5        # Seuil minimal de matchs pour qu'un counter soit retenu
+DENSE_MAX_DECKS = int(os.getenv("MATCHUP_DENSE_MAX_DECKS", "4000"))  # Matrices denses jusqu'à n decks (n² cellules)
+Z_95 = 1.959964      # Quantile normal de l'intervalle à 95 %
+BOOTSTRAP_RESAMPLES = int(os.getenv("MATCHUP_BOOTSTRAP", "500"))     # Rééchantillonnages par paire (0 : désactivé)
+BOOTSTRAP_WORKERS = int(os.getenv("MATCHUP_BOOTSTRAP_WORKERS", str(multiprocessing.cpu_count())))
+BOOTSTRAP_CHUNK_CELLS = 5000000  # Tirages (paires x rééchantillonnages) par bloc : mémoire bornée
+BOOTSTRAP_SEED = 20240101        # Graine : intervalles reproductibles d'un run complet à l'autre
+RANK_BY = os.getenv("MATCHUP_RANK_BY", "winrate_lisse")  # Critère du meilleur counter : winrate_lisse, wilson_low ou bootstrap_low
+RANK_CRITERIA = ('winrate_lisse', 'wilson_low', 'bootstrap_low')
+
+def create_tables(conn):
+    """Tables deck_counters (meilleur counter par deck) et deck_matchup (toutes les paires)."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS deck_counters (
+            deck_name TEXT PRIMARY KEY,
+            best_counter TEXT,
+            best_counter_winrate FLOAT,
+            nb_match INTEGER,
+            nb_victoire INTEGER,
+            nb_defaites INTEGER,
+            best_counter_low FLOAT,
+            best_counter_high FLOAT
+        );
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS deck_matchup (
+            deck_name TEXT,
+            opponent_name TEXT,
+            wins INTEGER,
+            losses INTEGER,
+            draws INTEGER,
+            nb_match INTEGER,
+            winrate_lisse FLOAT,
+            wilson_low FLOAT,
+            wilson_high FLOAT,
+            bootstrap_low FLOAT,
+            bootstrap_high FLOAT,
+            PRIMARY KEY (deck_name, opponent_name)
+        );
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_deck_matchup_opponent ON deck_matchup(opponent_name);"))
+
+def encode_decks(winners, losers):
+    """Indices entiers des decks (dans l'ordre des noms) et tableau des noms."""
+    codes, names = pd.factorize(np.concatenate([winners, losers]), sort=True)
+    return codes[:len(winners)], codes[len(winners):], np.asarray(names, dtype=object)
+
+def matchup_pairs(first, second, nb_decks, is_draw=None):
+    """
+    Cumule les matchs (first gagne contre second, ou nul si is_draw) et retourne les
+    paires observées dans les deux sens : (deck, adversaire, victoires, défaites, nuls).
+    """
+    if is_draw is None:
+        is_draw = np.zeros(len(first), dtype=bool)
+    won = ~is_draw
+
+    if nb_decks <= DENSE_MAX_DECKS:
+        wins = np.zeros((nb_decks, nb_decks), dtype=np.int32)
+        draws = np.zeros((nb_decks, nb_decks), dtype=np.int32)
+        np.add.at(wins, (first[won], second[won]), 1)
+        np.add.at(draws, (first[is_draw], second[is_draw]), 1)
+        draws += draws.T
+        deck, opponent = np.nonzero(wins + wins.T + draws)
+        return deck, opponent, wins[deck, opponent], wins[opponent, deck], draws[deck, opponent]
+
+    # Forme creuse : une entrée par paire ordonnée observée (code = deck * n + adversaire)
+    forward = first.astype(np.int64) * nb_decks + second
+    backward = second.astype(np.int64) * nb_decks + first
+    pair_codes, inverse = np.unique(np.concatenate([forward, backward]), return_inverse=True)
+    size = len(pair_codes)
+    win_flags = np.concatenate([won, np.zeros(len(first), dtype=bool)])
+    loss_flags = np.concatenate([np.zeros(len(first), dtype=bool), won])
+    draw_flags = np.concatenate([is_draw, is_draw])
+    return (pair_codes // nb_decks, pair_codes % nb_decks,
+            np.bincount(inverse, weights=win_flags, minlength=size).astype(np.int32),
+            np.bincount(inverse, weights=loss_flags, minlength=size).astype(np.int32),
+            np.bincount(inverse, weights=draw_flags, minlength=size).astype(np.int32))
+
+def smoothed_winrate(wins, draws, nb_match):
+    """Winrate lissé (un nul compte pour une demi-victoire)."""
+    return (wins + draws / 2 + K_SMOOTHING) / (nb_match + 2 * K_SMOOTHING)
+
+def wilson_interval(wins, draws, nb_match, z=Z_95):
+    """Intervalle de Wilson du winrate (victoires + nuls / 2) / matchs, pour toutes les paires."""
+    n = np.maximum(nb_match, 1)
+    p = (wins + draws / 2) / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return center - half, center + half
+
+def bootstrap_chunk(args):
+    """
+    Worker : quantiles 2,5 % et 97,5 % du winrate d'un bloc de paires, chaque
+    rééchantillonnage retirant nb_match parties parmi celles observées (victoire,
+    nul, défaite) par deux tirages binomiaux.
+    """
+    seed, wins, draws, nb_match, resamples = args
+    rng = np.random.default_rng(seed)
+    n = np.maximum(nb_match, 1)
+    p_win = wins / n
+    p_draw = np.where(nb_match > wins, draws / np.maximum(nb_match - wins, 1), 0.0)
+    sampled_wins = rng.binomial(nb_match, p_win, size=(resamples, len(nb_match)))
+    sampled_draws = rng.binomial(nb_match - sampled_wins, p_draw)
+    rates = (sampled_wins + sampled_draws / 2) / n
+    low, high = np.percentile(rates, [2.5, 97.5], axis=0)
+    return low, high
+
+def bootstrap_interval(wins, draws, nb_match, resamples=BOOTSTRAP_RESAMPLES, workers=BOOTSTRAP_WORKERS):
+    """
+    Intervalle bootstrap de toutes les paires. La distribution ne dépend que du bilan
+    (victoires, nuls, matchs) : chaque bilan distinct est rééchantillonné une fois,
+    par blocs vectorisés répartis sur un pool de processus quand il y en a plusieurs.
+    Retourne (None, None) si le bootstrap est désactivé.
+    """
+    if resamples <= 0:
+        return None, None
+    base = int(nb_match.max()) + 1 if len(nb_match) else 1
+    records, inverse = np.unique((nb_match.astype(np.int64) * base + wins) * base + draws, return_inverse=True)
+    nb_match, wins, draws = records // (base * base), records // base % base, records % base
+
+    chunk = max(1, BOOTSTRAP_CHUNK_CELLS // resamples)
+    tasks = [
+        (np.random.SeedSequence([BOOTSTRAP_SEED, i]), wins[start:start + chunk],
+         draws[start:start + chunk], nb_match[start:start + chunk], resamples)
+        for i, start in enumerate(range(0, len(nb_match), chunk))
+    ]
+    if len(tasks) > 1 and workers > 1:
+        # 'spawn' plutôt que fork : le runner en processus unique est multi-threadé
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(bootstrap_chunk, tasks))
+    else:
+        results = [bootstrap_chunk(task) for task in tasks]
+    if not results:
+        return np.zeros(0), np.zeros(0)
+    low = np.concatenate([r[0] for r in results])
+    high = np.concatenate([r[1] for r in results])
+    return low[inverse], high[inverse]
+
+def best_counters(deck, opponent, nb_match, score):
+    """
+    Meilleur counter de chaque deck : l'adversaire au score le plus élevé contre lui
+    (winrate lissé ou borne basse d'intervalle, au moins MIN_MATCH matchs), puis le plus
+    de matchs, puis le premier par nom. Retourne les positions des paires (counter, deck) retenues.
+    """
+    eligible = np.flatnonzero(nb_match >= MIN_MATCH)
+    order = eligible[np.lexsort((deck[eligible], -nb_match[eligible], -score[eligible], opponent[eligible]))]
+    sorted_decks = opponent[order]
+    first = np.r_[True, sorted_decks[1:] != sorted_decks[:-1]] if len(order) else np.zeros(0, dtype=bool)
+    return order[first]
+
+def compute_matchups(winners, losers, is_draw=None, rank_by=RANK_BY):
+    """DataFrames deck_matchup et deck_counters à partir des noms des decks de chaque match."""
+    if rank_by not in RANK_CRITERIA or (rank_by == 'bootstrap_low' and BOOTSTRAP_RESAMPLES <= 0):
+        raise ValueError(f"Critère de classement des counters invalide : {rank_by}")
+    first, second, names = encode_decks(winners, losers)
+    deck, opponent, wins, losses, draws = matchup_pairs(first, second, len(names), is_draw)
+    nb_match = wins + losses + draws
+    winrate = smoothed_winrate(wins, draws, nb_match)
+    wilson_low, wilson_high = wilson_interval(wins, draws, nb_match)
+    bootstrap_low, bootstrap_high = bootstrap_interval(wins, draws, nb_match)
+
+    matchup = pd.DataFrame({
+        'deck_name': names[deck], 'opponent_name': names[opponent],
+        'wins': wins, 'losses': losses, 'draws': draws,
+        'nb_match': nb_match, 'winrate_lisse': winrate,
+        'wilson_low': wilson_low, 'wilson_high': wilson_high,
+        'bootstrap_low': bootstrap_low, 'bootstrap_high': bootstrap_high,
+    })
+    best = best_counters(deck, opponent, nb_match, matchup[rank_by].to_numpy())
+    counters = pd.DataFrame({
+        'deck_name': names[opponent[best]], 'best_counter': names[deck[best]],
+        'best_counter_winrate': winrate[best], 'nb_match': nb_match[best],
+        'nb_victoire': wins[best], 'nb_defaites': losses[best],
+        'best_counter_low': wilson_low[best], 'best_counter_high': wilson_high[best],
+    })
+    return matchup, counters
+
+def benchmark(nb_matches=2000000, nb_decks=2000):
+    """Temps de compute_matchups (intervalles compris) sur des matchs synthétiques (aucun accès à la base)."""
+    rng = np.random.default_rng(0)
+    names = np.array([f"Deck{i:05d}" for i in range(nb_decks)], dtype=object)
+    first = rng.zipf(1.3, nb_matches) % nb_decks
+    second = (first + 1 + rng.integers(0, nb_decks - 1, nb_matches)) % nb_decks
+    start_time = time.time()
+    matchup, counters = compute_matchups(names[first], names[second])
+    elapsed = time.time() - start_time
+    print(f"[BENCHMARK] {nb_matches:,} matchs, {nb_decks:,} decks : {len(matchup):,} paires, "
+          f"{len(counters):,} counters en {elapsed:.2f}s ({nb_matches / elapsed:,.0f} matchs/sec, "
+          f"bootstrap {BOOTSTRAP_RESAMPLES} x {BOOTSTRAP_WORKERS} processus)")
+    return elapsed
+
+def main():
+    """Calcule la matrice des confrontations : remplit deck_matchup et deck_counters."""
+    # Logger
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[
+            logging.FileHandler("deck_counters_insertion.log"),
+            logging.StreamHandler()
+        ],
+        force=True  # Reconfiguration à chaque exécution (runner en processus unique)
+    )
+    logger = logging.getLogger(__name__)
+    start_time = time.time()
+
+    # Connexion à PostgreSQL (paramètres partagés de db.py)
+    engine = create_engine(db.sqlalchemy_url(), connect_args=db.CONNECT_ARGS)
+
+    # Mode incrémental : seuls les decks impliqués dans les tournois touchés sont recalculés
+    raw_conn = db.get_conn()
+    is_incremental = (incremental.is_incremental(raw_conn, 'deck_counters', 'best_counter_low')
+                      and incremental.is_incremental(raw_conn, 'deck_matchup', 'bootstrap_low'))
+    touched_decks = None
+
+    if is_incremental:
+        # Decks notés par 12_match_winners_losers (lignes supprimées ou ajoutées)
+        with raw_conn.cursor() as cur:
+            cur.execute("CREATE TABLE IF NOT EXISTS deck_counters_touched (deck_name TEXT)")
+            cur.execute("SELECT DISTINCT deck_name FROM deck_counters_touched")
+            touched_decks = [row[0] for row in cur.fetchall()]
+            cur.execute("DELETE FROM deck_counters WHERE deck_name = ANY(%s)", (touched_decks,))
+            cur.execute("DELETE FROM deck_matchup WHERE deck_name = ANY(%s) OR opponent_name = ANY(%s)",
+                        (touched_decks, touched_decks))
+        raw_conn.commit()
+        logger.info(f"{len(touched_decks)} decks touchés à recalculer dans deck_counters et deck_matchup.")
+    else:
+        # Suppression des tables si elles existent
+        with engine.connect() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS deck_counters;"))
+            conn.execute(text("DROP TABLE IF EXISTS deck_matchup;"))
+            conn.execute(text("CREATE TABLE IF NOT EXISTS deck_counters_touched (deck_name TEXT);"))
+            conn.execute(text("TRUNCATE deck_counters_touched;"))
+            conn.commit()
+        logger.info("Anciennes tables deck_counters et deck_matchup supprimées (si existantes).")
+    raw_conn.close()
+
+    with engine.connect() as conn:
+        create_tables(conn)
+        conn.commit()
+    logger.info("Tables deck_counters et deck_matchup créées.")
+
+    # Lecture des données depuis match_winners_losers (matchs impliquant un deck touché en incrémental)
+    df = pd.read_sql("""
+        SELECT winner_deck_name, looser_deck_name, is_draw
+        FROM match_winners_losers
+        WHERE winner_deck_name IS NOT NULL
+          AND looser_deck_name IS NOT NULL
+          AND winner_deck_name <> looser_deck_name
+          AND (CAST(%(decks)s AS text[]) IS NULL
+               OR winner_deck_name = ANY(CAST(%(decks)s AS text[]))
+               OR looser_deck_name = ANY(CAST(%(decks)s AS text[])))
+    """, engine, params={'decks': touched_decks})
+
+    # Matrice des confrontations et winrates lissés de toutes les paires (nuls compris)
+    compute_start = time.time()
+    matchup, counters = compute_matchups(df['winner_deck_name'].to_numpy(dtype=object),
+                                         df['looser_deck_name'].to_numpy(dtype=object),
+                                         df['is_draw'].to_numpy(dtype=bool))
+    logger.info(f"{len(df):,} matchs -> {len(matchup):,} paires de decks en {time.time() - compute_start:.2f}s "
+                f"(bootstrap : {BOOTSTRAP_RESAMPLES} rééchantillonnages, counters classés par {RANK_BY})")
+
+    # En incrémental, seules les paires et les decks touchés sont réinsérés
+    if touched_decks is not None:
+        matchup = matchup[matchup['deck_name'].isin(touched_decks) | matchup['opponent_name'].isin(touched_decks)]
+        counters = counters[counters['deck_name'].isin(touched_decks)]
+
+    # Insertion dans les tables PostgreSQL
+    raw_conn = db.get_conn()
+    loader.load_rows(raw_conn, 'deck_matchup', list(matchup.columns), matchup.itertuples(index=False, name=None))
+    loader.load_rows(raw_conn, 'deck_counters', list(counters.columns), counters.itertuples(index=False, name=None))
+    raw_conn.commit()
+    raw_conn.close()
+    logger.info("Tables deck_matchup et deck_counters remplies avec succès.")
+
+    # Les decks touchés ont été recalculés
+    if is_incremental:
+        with engine.connect() as conn:
+            conn.execute(text("TRUNCATE deck_counters_touched;"))
+            conn.commit()
+
+    print("Aperçu du résultat :")
+    print(counters.head())
+
+    elapsed = time.time() - start_time
+    rate = len(df) / elapsed if elapsed > 0 else 0
+    print(f"[PERFORMANCE] {rate:,.0f} matchs/sec | {len(matchup):,} paires | {len(counters):,} counters")
+    logger.info("Insertion terminée.")
+    print("Insertion terminée.")
+
+if __name__ == '__main__':
+    if '--benchmark' in sys.argv:
+        args = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+        benchmark(*args)
+    else:
+        main()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import sys
+import os
+
+# Forcer l'encodage UTF-8 pour les sorties standard et d'erreur
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+if hasattr(sys.stderr, 'reconfigure'):
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+import time
+import itertools
+import numpy as np
+from db import get_conn
+import incremental
+import loader
+import shadow
+
+# Archétypes par similarité des listes : signatures MinHash des listes distinctes
+# (table decklist) et regroupement par LSH (bandes de la signature). Deux listes
+# d'un même seau dont la similarité de Jaccard estimée atteint SIMILARITY_THRESHOLD
+# sont réunies ; un archétype est une composante connexe de ces liens.
+# Les listes sont des multisets : une carte jouée en 2 exemplaires compte deux fois.
+
+NUM_PERM = int(os.getenv("ARCHETYPE_NUM_PERM", "64"))                # Fonctions de hachage par signature
+LSH_BANDS = int(os.getenv("ARCHETYPE_BANDS", "16"))                  # Bandes LSH (NUM_PERM / LSH_BANDS lignes par bande)
+SIMILARITY_THRESHOLD = float(os.getenv("ARCHETYPE_SIMILARITY", "0.5"))  # Jaccard minimal pour réunir deux listes
+MAX_COPIES = 4            # Exemplaires d'une carte pris en compte dans le multiset
+SIGNATURE_CHUNK = 2000    # Listes hachées par bloc numpy (mémoire bornée)
+PRIME = (1 << 31) - 1     # Module des hachages universels (a * x + b) mod PRIME
+SEED = 20240101           # Graine des hachages : signatures stables d'un run à l'autre
+
+_rng = np.random.default_rng(SEED)
+HASH_A = _rng.integers(1, PRIME, NUM_PERM, dtype=np.int64)
+HASH_B = _rng.integers(0, PRIME, NUM_PERM, dtype=np.int64)
+
+def create_archetype_shadow(conn):
+    """
+    Crée la table fantôme de 'deck_archetype' (la table en service reste lisible), sans
+    clé primaire (créée après le chargement) ; retourne son nom
+    """
+    return shadow.create_shadow(conn, 'deck_archetype', """
+        decklist_hash BIGINT NOT NULL,
+        archetype_id INT,
+        representative_hash BIGINT,
+        archetype_name TEXT,
+        similarity REAL,
+        nb_decks INT,
+        signature INT[]
+    """)
+
+def shingles(card_keys, counts):
+    """Éléments du multiset d'une liste : (carte, exemplaire) encodés en entier."""
+    return [
+        card_key * MAX_COPIES + copy
+        for card_key, count in zip(card_keys, counts) if card_key is not None
+        for copy in range(min(max(count or 1, 1), MAX_COPIES))
+    ]
+
+def compute_signatures(shingle_lists):
+    """Signatures MinHash (n x NUM_PERM), calculées par blocs de SIGNATURE_CHUNK listes."""
+    signatures = np.empty((len(shingle_lists), NUM_PERM), dtype=np.int64)
+    for start in range(0, len(shingle_lists), SIGNATURE_CHUNK):
+        chunk = shingle_lists[start:start + SIGNATURE_CHUNK]
+        lengths = np.fromiter(map(len, chunk), dtype=np.int64, count=len(chunk))
+        values = np.fromiter(itertools.chain.from_iterable(chunk), dtype=np.int64, count=int(lengths.sum()))
+        hashed = (values[:, None] * HASH_A + HASH_B) % PRIME
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        signatures[start:start + len(chunk)] = np.minimum.reduceat(hashed, offsets, axis=0)
+    return signatures
+
+def candidate_pairs(signatures):
+    """
+    Paires candidates par LSH : dans chaque bande, les listes de même sous-signature
+    tombent dans un seau et sont comparées au premier membre du seau.
+    Retourne les paires (i, j) dont la similarité estimée atteint le seuil.
+    """
+    rows = NUM_PERM // LSH_BANDS
+    pairs = []
+    for band in range(LSH_BANDS):
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        _, bucket = np.unique(block.view(np.dtype((np.void, block.dtype.itemsize * rows))).ravel(),
+                              return_inverse=True)
+        order = np.argsort(bucket.ravel(), kind='stable')
+        sorted_buckets = bucket.ravel()[order]
+        is_start = np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]]
+        leader = order[np.flatnonzero(is_start)[np.cumsum(is_start) - 1]]
+        members = order[leader != order]
+        leaders = leader[leader != order]
+        if len(members):
+            similarity = (signatures[leaders] == signatures[members]).mean(axis=1)
+            keep = similarity >= SIMILARITY_THRESHOLD
+            pairs.append(np.stack([leaders[keep], members[keep]], axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+def connected_components(n, pairs):
+    """Union-find : numéro de composante de chacune des n listes."""
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs.tolist():
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([find(i) for i in range(n)], dtype=np.int64)
+
+def assign_archetypes(components, known_ids, nb_decks):
+    """
+    Identifiants d'archétype : une liste déjà classée garde le sien ; une nouvelle liste
+    prend l'archétype majoritaire de sa composante, sinon un nouvel identifiant
+    (numérotés par nombre de decks décroissant).
+    """
+    archetypes = known_ids.copy()
+    next_id = int(known_ids.max()) + 1 if (known_ids > 0).any() else 1
+    new_components = {}
+    for component in np.unique(components[known_ids == 0]):
+        members = np.flatnonzero(components == component)
+        existing = known_ids[members][known_ids[members] > 0]
+        if len(existing):
+            values, counts = np.unique(existing, return_counts=True)
+            archetypes[members[known_ids[members] == 0]] = values[np.argmax(counts)]
+        else:
+            new_components[component] = members
+    for component, members in sorted(new_components.items(), key=lambda item: -nb_decks[item[1]].sum()):
+        archetypes[members] = next_id
+        next_id += 1
+    return archetypes
+
+def representatives(archetypes, signatures, nb_decks):
+    """
+    Représentant de chaque archétype (liste la plus jouée, tenant lieu de centroïde) et
+    similarité estimée de chaque liste à ce représentant.
+    """
+    order = np.lexsort((-nb_decks, archetypes))
+    sorted_archetypes = archetypes[order]
+    first = np.r_[True, sorted_archetypes[1:] != sorted_archetypes[:-1]]
+    representative_of = dict(zip(sorted_archetypes[first].tolist(), order[first].tolist()))
+    representative = np.array([representative_of[a] for a in archetypes.tolist()], dtype=np.int64)
+    similarity = (signatures == signatures[representative]).mean(axis=1)
+    return representative, similarity
+
+def load_known(conn):
+    """Mode incrémental : listes déjà classées encore présentes (hash, archétype, signature)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT a.decklist_hash, a.archetype_id, a.signature
+            FROM deck_archetype a
+            WHERE EXISTS (SELECT 1 FROM decklist dl WHERE dl.decklist_hash = a.decklist_hash)
+        """)
+        return cur.fetchall()
+
+def load_new_decklists(conn, is_incremental):
+    """Listes à signer (toutes, ou celles absentes de deck_archetype en incrémental)."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT dl.decklist_hash, array_agg(dl.card_key), array_agg(dl.count)
+            FROM decklist dl
+            {'WHERE NOT EXISTS (SELECT 1 FROM deck_archetype a WHERE a.decklist_hash = dl.decklist_hash)' if is_incremental else ''}
+            GROUP BY dl.decklist_hash
+        """)
+        return cur.fetchall()
+
+def load_deck_stats(conn):
+    """Nombre de decks et nom de deck (deck_nom) de chaque liste."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT decklist_hash, count(*), min(deck_nom)
+            FROM deck WHERE decklist_hash IS NOT NULL
+            GROUP BY decklist_hash
+        """)
+        return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+def main():
+    start_time = time.time()
+
+    try:
+        print("[INFO] Démarrage du calcul des archétypes (MinHash + LSH)...")
+        print(f"[INFO] {NUM_PERM} hachages, {LSH_BANDS} bandes, seuil de similarité {SIMILARITY_THRESHOLD}")
+
+        conn = get_conn()
+        is_incremental = incremental.is_incremental(conn, 'deck_archetype', 'signature')
+
+        # Phase 1 : signatures (reprises de la table en incrémental, calculées pour les nouvelles listes)
+        known = load_known(conn) if is_incremental else []
+        new_lists = [row for row in load_new_decklists(conn, is_incremental) if any(k is not None for k in row[1])]
+        signature_start = time.time()
+        new_signatures = compute_signatures([shingles(card_keys, counts) for _, card_keys, counts in new_lists])
+        print(f"[INFO] {len(new_lists):,} nouvelles signatures en {time.time() - signature_start:.2f}s "
+              f"({len(known):,} reprises)")
+
+        hashes = [row[0] for row in known] + [row[0] for row in new_lists]
+        if not hashes:
+            conn.close()
+            print("[INFO] Aucune liste à classer")
+            return
+        signatures = np.vstack([np.array([row[2] for row in known], dtype=np.int64).reshape(-1, NUM_PERM),
+                                new_signatures])
+        known_ids = np.array([row[1] for row in known] + [0] * len(new_lists), dtype=np.int64)
+        stats = load_deck_stats(conn)
+        nb_decks = np.array([stats.get(h, (0, None))[0] for h in hashes], dtype=np.int64)
+
+        # Phase 2 : LSH, composantes connexes et identifiants d'archétype
+        lsh_start = time.time()
+        pairs = candidate_pairs(signatures)
+        components = connected_components(len(hashes), pairs)
+        archetypes = assign_archetypes(components, known_ids, nb_decks)
+        representative, similarity = representatives(archetypes, signatures, nb_decks)
+        print(f"[INFO] {len(pairs):,} paires similaires, {len(np.unique(archetypes)):,} archétypes "
+              f"pour {len(hashes):,} listes en {time.time() - lsh_start:.2f}s")
+
+        # Phase 3 : réécriture complète de la table (fantôme puis bascule atomique)
+        rows = (
+            (hashes[i], int(archetypes[i]), hashes[representative[i]],
+             stats.get(hashes[representative[i]], (0, None))[1], float(similarity[i]), int(nb_decks[i]),
+             '{' + ','.join(map(str, signatures[i].tolist())) + '}')
+            for i in range(len(hashes))
+        )
+        target = create_archetype_shadow(conn)
+        loader.load_rows(
+            conn, target,
+            ('decklist_hash', 'archetype_id', 'representative_hash', 'archetype_name',
+             'similarity', 'nb_decks', 'signature'),
+            rows
+        )
+        # Clé primaire et index créés après le chargement
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE {target} ADD PRIMARY KEY (decklist_hash)")
+            cur.execute(f"CREATE INDEX idx_{target}_archetype ON {target}(archetype_id)")
+        conn.commit()
+        shadow.swap_in(conn, 'deck_archetype')
+        conn.close()
+
+        elapsed = time.time() - start_time
+        rate = len(hashes) / elapsed if elapsed > 0 else 0
+        print(f"[OK] Terminé en {elapsed:.1f}s : {len(np.unique(archetypes)):,} archétypes")
+        print(f"[PERFORMANCE] {rate:,.0f} listes/sec")
+
+    except Exception as e:
+        print(f"[ERREUR CRITIQUE] {e}")
+        raise
+
+if __name__ == '__main__':
+    main()
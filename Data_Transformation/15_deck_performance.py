@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import sys
+import os
+
+# Forcer l'encodage UTF-8 pour les sorties standard et d'erreur
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+if hasattr(sys.stderr, 'reconfigure'):
+    sys.stderr.reconfigure(encoding='utf-8', errors='replace')
+
+import time
+from db import get_conn
+import incremental
+import keys
+import shadow
+
+json_folder = os.getenv("JSON_FOLDER")  # Utilisé pour détecter les tournois touchés en mode incrémental
+
+# Bilan de chaque deck (un deck = un joueur dans un tournoi) agrégé directement depuis
+# match : chaque match compte une fois pour chacun de ses deux joueurs. Un nul compte
+# pour une demi-victoire dans win_pct, comme dans deck_matchup.
+PERFORMANCE_COLUMNS = ('deck_key', 'tournament_key', 'player_key', 'deck_id', 'tournament_id', 'deck_nom',
+                       'wins', 'losses', 'draws', 'games', 'win_pct')
+
+SELECT_SQL = f"""
+    SELECT d.deck_key, d.tournament_key, d.player_key, d.deck_id, d.tournament_id, d.deck_nom,
+           count(*) FILTER (WHERE m.winner_key = side.player_key) AS wins,
+           count(*) FILTER (WHERE m.winner_key <> side.player_key) AS losses,
+           count(*) FILTER (WHERE m.winner_key IS NULL) AS draws,
+           count(*) AS games,
+           round(100.0 * (count(*) FILTER (WHERE m.winner_key = side.player_key)
+                          + 0.5 * count(*) FILTER (WHERE m.winner_key IS NULL)) / count(*), 2) AS win_pct
+    FROM match m
+    CROSS JOIN LATERAL (VALUES (m.player1_key), (m.player2_key)) AS side(player_key)
+    JOIN deck d ON d.tournament_key = m.tournament_key AND d.player_key = side.player_key
+    WHERE CAST(%(ids)s AS text[]) IS NULL
+       OR m.tournament_key IN ({keys.key_subquery('tournament', '%(ids)s')})
+    GROUP BY d.deck_key, d.tournament_key, d.player_key, d.deck_id, d.tournament_id, d.deck_nom
+"""
+
+def create_performance_shadow(conn):
+    """Table fantôme de 'deck_performance' (la table en service reste lisible) ; retourne son nom."""
+    return shadow.create_shadow(conn, 'deck_performance', """
+        deck_key INT NOT NULL,
+        tournament_key INT,
+        player_key INT,
+        deck_id TEXT,
+        tournament_id TEXT,
+        deck_nom TEXT,
+        wins INT,
+        losses INT,
+        draws INT,
+        games INT,
+        win_pct NUMERIC(5, 2)
+    """)
+
+def create_archetype_view(conn):
+    """Vue 'archetype_performance' : bilan de chaque archétype (deck_nom) dans chaque tournoi."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE OR REPLACE VIEW archetype_performance AS
+            SELECT tournament_key, tournament_id, deck_nom,
+                   count(*) AS nb_decks,
+                   sum(wins) AS wins, sum(losses) AS losses, sum(draws) AS draws, sum(games) AS games,
+                   round(100.0 * (sum(wins) + 0.5 * sum(draws)) / NULLIF(sum(games), 0), 2) AS win_pct
+            FROM deck_performance
+            GROUP BY tournament_key, tournament_id, deck_nom
+        """)
+    conn.commit()
+
+def insert_performance(conn, table, tournament_ids=None):
+    """Agrège match dans 'table' (tous les tournois, ou ceux touchés en incrémental)."""
+    with conn.cursor() as cur:
+        cur.execute(f"INSERT INTO {table} ({', '.join(PERFORMANCE_COLUMNS)}) {SELECT_SQL}",
+                    {'ids': tournament_ids})
+        return cur.rowcount
+
+def create_indexes_and_swap(conn, table):
+    """Clé primaire et index créés après le chargement, puis bascule de la table fantôme."""
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (deck_key)")
+        cur.execute(f"CREATE INDEX idx_{table}_tournament_key ON {table}(tournament_key)")
+        cur.execute(f"CREATE INDEX idx_{table}_deck_nom ON {table}(deck_nom)")
+    conn.commit()
+    shadow.swap_in(conn, 'deck_performance')
+
+def verify(conn):
+    """
+    Test d'équivalence : recalcule tout depuis match et compare à 'deck_performance'
+    (lignes en trop ou manquantes), puis contrôle la cohérence des totaux avec match.
+    Retourne True si la table est identique au recalcul complet.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE deck_performance_check ON COMMIT DROP AS {SELECT_SQL}", {'ids': None})
+        columns = ', '.join(PERFORMANCE_COLUMNS)
+        cur.execute(f"""
+            SELECT
+                (SELECT count(*) FROM (SELECT {columns} FROM deck_performance
+                                       EXCEPT ALL SELECT {columns} FROM deck_performance_check) x),
+                (SELECT count(*) FROM (SELECT {columns} FROM deck_performance_check
+                                       EXCEPT ALL SELECT {columns} FROM deck_performance) x)
+        """)
+        extra, missing = cur.fetchone()
+        cur.execute("""
+            SELECT (SELECT sum(wins) FROM deck_performance), (SELECT sum(losses) FROM deck_performance),
+                   (SELECT sum(draws) FROM deck_performance),
+                   (SELECT count(*) FROM match WHERE winner_key IS NOT NULL),
+                   (SELECT count(*) FROM match WHERE winner_key IS NULL)
+        """)
+        wins, losses, draws, decided, drawn = cur.fetchone()
+    conn.rollback()
+
+    print(f"[VERIF] deck_performance : {extra:,} lignes en trop, {missing:,} manquantes par rapport au recalcul complet")
+    print(f"[VERIF] {wins or 0:,} victoires / {losses or 0:,} défaites pour {decided:,} matchs décidés ; "
+          f"{draws or 0:,} nuls de deck pour {drawn:,} matchs nuls (deux decks par match)")
+    if extra or missing:
+        print("[ERREUR] deck_performance diverge du recalcul complet")
+        return False
+    print("[OK] deck_performance identique au recalcul complet")
+    return True
+
+def main():
+    start_time = time.time()
+
+    try:
+        print("[INFO] Démarrage du calcul de deck_performance...")
+
+        conn = get_conn()
+
+        # Mode incrémental : seules les lignes des tournois touchés sont recalculées
+        if incremental.is_incremental(conn, 'deck_performance'):
+            _, affected_ids = incremental.get_changes(conn, json_folder)
+            incremental.delete_tournament_rows(conn, 'deck_performance', affected_ids, column='tournament_key')
+            inserted = insert_performance(conn, 'deck_performance', list(affected_ids)) if affected_ids else 0
+            conn.commit()
+        else:
+            target = create_performance_shadow(conn)
+            inserted = insert_performance(conn, target)
+            conn.commit()
+            create_indexes_and_swap(conn, target)
+        create_archetype_view(conn)
+        conn.close()
+
+        elapsed = time.time() - start_time
+        rate = inserted / elapsed if elapsed > 0 else 0
+        print(f"[OK] Terminé en {elapsed:.1f}s : {inserted:,} decks agrégés")
+        print(f"[PERFORMANCE] {rate:,.0f} decks/sec")
+
+    except Exception as e:
+        print(f"[ERREUR CRITIQUE] {e}")
+        raise
+
+if __name__ == '__main__':
+    if '--verify' in sys.argv:
+        connection = get_conn()
+        ok = verify(connection)
+        connection.close()
+        sys.exit(0 if ok else 1)
+    main()
@@ -1,120 +1,511 @@
-import subprocess
-import os
-import time
-
-scripts_to_run = [
-    "01_extension.py",
-    "02_tournament.py",
-    "03_player.py",
-    "04_participation.py",
-    "05_card.py",
-    "06_card_complement.py",
-    "07_card_evolve.py",
-    "08_deck.py",
-    "09_match.py",
-    "10_deck_match.py",
-    "11_deck_card.py",
-    "12_match_winners_losers.py",
-    "13_deck_match_up.py"
-]
-
-json_folder_path = r"E:\DataCollection\output"
-path_excel = r"E:\DataCollection\Table correpondance Extension pokémon.xlsx"
-
-def decode_output(output_bytes):
-    """Décodage ultra-robuste des sorties"""
-    if not output_bytes:
-        return ""
-    
-    # Essaie plusieurs encodages dans l'ordre
-    encodings = ['utf-8', 'cp1252', 'latin-1', 'iso-8859-1']
-    
-    for encoding in encodings:
-        try:
-            return output_bytes.decode(encoding)
-        except UnicodeDecodeError:
-            continue
-    
-    # Dernier recours : décodage avec remplacement des caractères problématiques
-    return output_bytes.decode('utf-8', errors='replace')
-
-def run_script(script_name):
-    start_time = time.perf_counter()
-    try:
-        env = os.environ.copy()
-        env["JSON_FOLDER"] = json_folder_path
-        env["PATH_EXCEL"] = path_excel
-        
-        # Configuration ultra-robuste pour éviter les problèmes d'encodage
-        env["PYTHONUTF8"] = "1"  # Force UTF-8 sur Windows
-        env["PYTHONIOENCODING"] = "utf-8:replace"  # Gestion des erreurs d'encodage
-
-        result = subprocess.run(
-            ["python", script_name],
-            capture_output=True,
-            env=env,
-            check=False,
-            # Ajout de timeout pour éviter les blocages
-            timeout=3600  # 1 heure max par script
-        )
-    except subprocess.TimeoutExpired:
-        return None, None, f"Timeout : {script_name} a dépassé 1 heure d'exécution"
-    except Exception as e:
-        return None, None, f"Exception lors de l'exécution : {e}"
-    
-    duration = time.perf_counter() - start_time
-    return result, duration, None
-
-def main():
-    print("Démarrage du pipeline de traitement des données...")
-    total_start_time = time.perf_counter()
-    
-    for i, script_name in enumerate(scripts_to_run, 1):
-        if not os.path.exists(script_name):
-            print(f"[ERREUR] Le script {script_name} est introuvable.\n")
-            continue
-
-        print(f"\n{'='*60}")
-        print(f"[{i}/{len(scripts_to_run)}] Exécution de {script_name}")
-        print('='*60)
-        
-        result, duration, error = run_script(script_name)
-
-        if error:
-            print(f"[ERREUR CRITIQUE] {error}")
-            print("Arrêt du processus.")
-            break
-
-        print(f"\n[TIMING] Temps d'exécution : {duration:.2f} secondes")
-
-        # Affichage sécurisé des sorties
-        if result.stdout:
-            try:
-                decoded_stdout = decode_output(result.stdout)
-                print("\n[SORTIE STANDARD]")
-                print(decoded_stdout.strip())
-            except Exception as e:
-                print(f"[ERREUR] Impossible de décoder la sortie standard : {e}")
-
-        if result.stderr:
-            try:
-                decoded_stderr = decode_output(result.stderr)
-                print("\n[ERREURS]")
-                print(decoded_stderr.strip())
-            except Exception as e:
-                print(f"[ERREUR] Impossible de décoder les erreurs : {e}")
-
-        if result.returncode != 0:
-            print(f"\n[ECHEC] Le script {script_name} a échoué avec le code {result.returncode}")
-            print("Arrêt du processus.")
-            break
-        else:
-            print(f"\n[SUCCES] {script_name} terminé avec succès")
-
-    total_duration = time.perf_counter() - total_start_time
-    print(f"\n{'='*60}")
-    print(f"[PIPELINE] Durée totale : {total_duration:.2f} secondes")
-    print('='*60)
-
-if __name__ == "__main__":
-    main()
+import subprocess
+import argparse
+import os
+import re
+import json
+import sys
+import io
+import time
+import threading
+import traceback
+import importlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import db
+import duckdb_backend
+import tournament_cache
+import incremental
+import keys
+import pipeline_state
+import metrics
+import run_report
+
+# Étapes du pipeline : chaque script déclare les tables qu'il lit (inputs) et celles
+# qu'il produit (outputs). Une étape dépend de l'étape qui produit chacune de ses
+# entrées ; les étapes indépendantes s'exécutent en parallèle. Les entrées "json"
+# (dossier des tournois) et "excel" (fichier des extensions) entrent seulement dans
+# l'empreinte de l'étape (pipeline_state.py).
+STEPS = [
+    {"script": "01_extension.py", "inputs": ["excel"], "outputs": ["extension"]},
+    {"script": "02_tournament.py", "inputs": ["json", "extension"], "outputs": ["tournament", "extension_epoch"]},
+    {"script": "03_player.py", "inputs": ["json"], "outputs": ["player"]},
+    {"script": "04_participation.py", "inputs": ["json", "player", "tournament", "extension_epoch"], "outputs": ["participation"]},
+    {"script": "05_card.py", "inputs": ["json"], "outputs": ["card"]},
+    {"script": "06_card_complement.py", "inputs": ["card"], "outputs": ["card_complement"]},
+    {"script": "07_card_evolve.py", "inputs": ["card"], "outputs": ["card_evolve"]},
+    {"script": "08_deck.py", "inputs": ["json", "card", "card_evolve", "extension_epoch"], "outputs": ["deck"]},
+    {"script": "09_match.py", "inputs": ["json", "tournament", "extension_epoch"], "outputs": ["match"]},
+    {"script": "10_deck_match.py", "inputs": ["match", "deck"], "outputs": ["deck_match"]},
+    {"script": "11_deck_card.py", "inputs": ["json", "deck"], "outputs": ["decklist", "deck_card"]},
+    {"script": "12_match_winners_losers.py", "inputs": ["match", "deck_match", "deck"],
+     "outputs": ["match_winners_losers", "deck_counters_touched"]},
+    {"script": "13_deck_match_up.py", "inputs": ["match_winners_losers", "deck_counters_touched"],
+     "outputs": ["deck_counters", "deck_matchup"]},
+    {"script": "14_deck_archetype.py", "inputs": ["decklist", "deck"], "outputs": ["deck_archetype"]},
+    {"script": "15_deck_performance.py", "inputs": ["match", "deck"],
+     "outputs": ["deck_performance", "archetype_performance"]},
+    # Export des colonnes vers le magasin NumPy local (fichiers, aucune table produite)
+    {"script": "array_store.py", "inputs": ["match", "deck", "card", "deck_card"], "outputs": []},
+]
+scripts_to_run = [step["script"] for step in STEPS]
+MAX_WORKERS = 4  # Étapes exécutées simultanément par défaut
+BACKEND = os.getenv("PIPELINE_BACKEND", "postgres")  # 'postgres' (étapes ci-dessus) ou 'duckdb' (duckdb_backend.py)
+OVERHEAD_PATTERN = re.compile(r"\[OVERHEAD\] démarrage ([\d.]+)s \| connexions (\d+) en ([\d.]+)s")
+METRICS_PATTERN = re.compile(r"^\[METRICS\] (\{.*\})\s*$", re.MULTILINE)
+
+json_folder_path = r"E:\DataCollection\output"
+path_excel = r"E:\DataCollection\Table correpondance Extension pokémon.xlsx"
+
+def decode_output(output_bytes):
+    """Décodage ultra-robuste des sorties"""
+    if not output_bytes:
+        return ""
+    
+    # Essaie plusieurs encodages dans l'ordre
+    encodings = ['utf-8', 'cp1252', 'latin-1', 'iso-8859-1']
+    
+    for encoding in encodings:
+        try:
+            return output_bytes.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    
+    # Dernier recours : décodage avec remplacement des caractères problématiques
+    return output_bytes.decode('utf-8', errors='replace')
+
+def pipeline_env(pipeline_mode):
+    """Variables d'environnement communes à toutes les étapes."""
+    return {
+        "JSON_FOLDER": json_folder_path,
+        "PATH_EXCEL": path_excel,
+        "PIPELINE_MODE": pipeline_mode,
+        # Configuration ultra-robuste pour éviter les problèmes d'encodage
+        "PYTHONUTF8": "1",  # Force UTF-8 sur Windows
+        "PYTHONIOENCODING": "utf-8:replace",  # Gestion des erreurs d'encodage
+    }
+
+def run_script(script_name, pipeline_mode="full", processes=None):
+    """Exécute une étape dans un sous-processus Python isolé (option --subprocess)."""
+    start_time = time.perf_counter()
+    process = None
+    try:
+        env = os.environ.copy()
+        env.update(pipeline_env(pipeline_mode))
+        # db.py rapporte le coût de démarrage et de connexion en fin de sous-processus
+        env["PIPELINE_LAUNCH_TIME"] = repr(time.time())
+
+        process = subprocess.Popen(
+            ["python", script_name],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env
+        )
+        # Processus enregistré pour pouvoir l'interrompre en cas d'échec d'une autre étape
+        if processes is not None:
+            processes[script_name] = process
+        # Ajout de timeout pour éviter les blocages
+        stdout, stderr = process.communicate(timeout=3600)  # 1 heure max par script
+        result = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        return None, None, f"Timeout : {script_name} a dépassé 1 heure d'exécution"
+    except Exception as e:
+        return None, None, f"Exception lors de l'exécution : {e}"
+    finally:
+        if processes is not None:
+            processes.pop(script_name, None)
+    
+    duration = time.perf_counter() - start_time
+    output = decode_output(result.stdout)
+    match = OVERHEAD_PATTERN.search(output)
+    if match:
+        result.overhead = (float(match.group(1)), int(match.group(2)), float(match.group(3)))
+    # Compteurs du rapport de run, affichés par metrics.py en fin de sous-processus
+    match = METRICS_PATTERN.search(output)
+    result.metrics = json.loads(match.group(1)) if match else {}
+    return result, duration, None
+
+class ThreadOutput(io.TextIOBase):
+    """
+    Remplace sys.stdout/sys.stderr dans le runner : chaque étape écrit dans son propre
+    tampon, les autres threads écrivent sur la sortie d'origine. Le tampon est choisi
+    par l'étape du thread (metrics.current_step) : les workers rattachés à l'étape
+    (metrics.bind, tâches de loader.stream_batches) écrivent dans le tampon de l'étape.
+    """
+
+    def __init__(self, original):
+        self.original = original
+        self.buffers = {}  # {étape: tampon}
+        self.lock = threading.Lock()
+
+    def _buffer(self):
+        step = metrics.current_step()
+        return self.buffers.get(step) if step is not None else None
+
+    def write(self, text):
+        buffer = self._buffer()
+        if buffer is None:
+            return self.original.write(text)
+        with self.lock:
+            return buffer.write(text)
+
+    def flush(self):
+        if self._buffer() is None:
+            self.original.flush()
+
+    def capture(self):
+        with self.lock:
+            self.buffers[metrics.current_step()] = io.StringIO()
+
+    def release(self):
+        with self.lock:
+            buffer = self.buffers.pop(metrics.current_step())
+        return buffer.getvalue()
+
+def install_output_capture():
+    """Installe la capture par thread des sorties (une seule fois par processus)."""
+    if not isinstance(sys.stdout, ThreadOutput):
+        sys.stdout = ThreadOutput(sys.stdout)
+        sys.stderr = ThreadOutput(sys.stderr)
+
+def run_step_inprocess(script_name, pipeline_mode="full", processes=None):
+    """
+    Exécute une étape dans le processus du runner : le module est importé une seule fois
+    (importlib), puis sa fonction main() est appelée. Les connexions viennent du pool
+    partagé de db.py. Retourne le même triplet que run_script.
+    """
+    start_time = time.perf_counter()
+    folder, file_name = os.path.split(os.path.abspath(script_name))
+    module_name = os.path.splitext(file_name)[0]
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+
+    db.set_current_step(script_name)
+    sys.stdout.capture()
+    sys.stderr.capture()
+    returncode = 0
+    import_time = 0.0
+    start_cpu = time.thread_time()
+    try:
+        import_start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        import_time = time.perf_counter() - import_start
+        module.main()
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+    finally:
+        leaked = db.release_step(script_name)
+        if leaked:
+            print(f"[POOL] {leaked} connexion(s) non fermée(s) restituée(s) au pool")
+        stdout = sys.stdout.release()
+        stderr = sys.stderr.release()
+        metrics.add('cpu_time', time.thread_time() - start_cpu)
+        metrics.add('peak_rss', metrics.peak_rss())
+        db.set_current_step(None)
+
+    duration = time.perf_counter() - start_time
+    connections, connect_time = db.connect_stats.get(script_name, (0, 0.0))
+    result = subprocess.CompletedProcess(["main", script_name], returncode,
+                                         stdout.encode('utf-8'), stderr.encode('utf-8'))
+    result.overhead = (import_time, connections, connect_time)
+    result.metrics = metrics.pop_step(script_name)
+    return result, duration, None
+
+def build_dependencies(steps):
+    """Associe à chaque script les scripts qui produisent ses tables d'entrée."""
+    producers = {}
+    dependencies = {}
+    for step in steps:
+        dependencies[step["script"]] = sorted({
+            producers[table] for table in step["inputs"] if table in producers
+        })
+        for table in step["outputs"]:
+            producers[table] = step["script"]
+    return dependencies
+
+def critical_path(dependencies, durations):
+    """Chemin le plus long (en durée) du DAG parmi les étapes exécutées."""
+    best = {}
+    for script in dependencies:
+        if script not in durations:
+            continue
+        previous = max(
+            (best[dep] for dep in dependencies[script] if dep in best),
+            key=lambda path: path[0], default=(0.0, [])
+        )
+        best[script] = (previous[0] + durations[script], previous[1] + [script])
+    return max(best.values(), key=lambda path: path[0], default=(0.0, []))
+
+def print_script_output(script_name, result, duration):
+    """Affiche les sorties d'une étape terminée (appelé depuis le thread principal)."""
+    print(f"\n{'='*60}")
+    print(f"[TERMINÉ] {script_name}")
+    print('='*60)
+    print(f"\n[TIMING] Temps d'exécution : {duration:.2f} secondes")
+    overhead = getattr(result, 'overhead', None)
+    if overhead:
+        print(f"[OVERHEAD] démarrage/import {overhead[0]:.2f}s | "
+              f"{overhead[1]} connexion(s) obtenue(s) en {overhead[2]:.2f}s")
+
+    # Affichage sécurisé des sorties
+    if result.stdout:
+        try:
+            decoded_stdout = decode_output(result.stdout)
+            print("\n[SORTIE STANDARD]")
+            print(decoded_stdout.strip())
+        except Exception as e:
+            print(f"[ERREUR] Impossible de décoder la sortie standard : {e}")
+
+    if result.stderr:
+        try:
+            decoded_stderr = decode_output(result.stderr)
+            print("\n[ERREURS]")
+            print(decoded_stderr.strip())
+        except Exception as e:
+            print(f"[ERREUR] Impossible de décoder les erreurs : {e}")
+
+def is_forced(script_name, forced):
+    """--force accepte 'all', le nom du script ou son préfixe numérique (ex. 13)."""
+    name = os.path.basename(script_name)
+    stem = os.path.splitext(name)[0]
+    return any(f in ('all', name, stem, stem.split('_')[0]) for f in forced)
+
+def run_pipeline(pipeline_mode, workers, runner=run_step_inprocess, state_conn=None, forced=(), run=None):
+    """
+    Exécute le DAG des étapes avec au plus 'workers' scripts simultanés, via 'runner'
+    (run_step_inprocess ou run_script). Arrêt immédiat au premier échec : plus aucune
+    étape n'est lancée et les sous-processus en cours sont interrompus (en processus
+    unique, les étapes déjà lancées vont à leur terme). Retourne (succès, durées par étape).
+    Avec state_conn, les étapes dont l'empreinte est inchangée sont sautées (sauf --force).
+    Avec run (run_report.new_run), les mesures de chaque étape exécutée y sont ajoutées.
+    """
+    dependencies = build_dependencies(STEPS)
+    order = {script: i for i, script in enumerate(scripts_to_run)}
+    pending = set(scripts_to_run)
+    done = set()
+    durations = {}
+    processes = {}
+    running = {}
+    overheads = {}
+    skipped = []
+    success = True
+
+    # Empreintes : versions connues des tables et état du dossier JSON
+    steps = {step["script"]: step for step in STEPS}
+    fingerprints = {}
+    state = {}
+    table_versions = {}
+    json_fingerprint = None
+    if state_conn is not None:
+        state = pipeline_state.load_state(state_conn)
+        for step in STEPS:
+            for table in step["outputs"]:
+                table_versions[table] = state.get(step["script"], (None, None))[1]
+        json_fingerprint = pipeline_state.json_folder_fingerprint(json_folder_path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while success and (pending or running):
+            # Lancement des étapes prêtes, dans l'ordre historique
+            ready = sorted(
+                (script for script in pending if all(dep in done for dep in dependencies[script])),
+                key=order.get
+            )
+            for script_name in ready:
+                if len(running) >= workers:
+                    break
+                pending.discard(script_name)
+                if not os.path.exists(script_name):
+                    print(f"[ERREUR] Le script {script_name} est introuvable.\n")
+                    done.add(script_name)
+                    continue
+                if state_conn is not None:
+                    fingerprint, components = pipeline_state.step_fingerprint(
+                        steps[script_name], table_versions, json_fingerprint, path_excel
+                    )
+                    fingerprints[script_name] = (fingerprint, components)
+                    if (not is_forced(script_name, forced)
+                            and state.get(script_name, (None, None))[0] == fingerprint
+                            and pipeline_state.outputs_exist(state_conn, steps[script_name]["outputs"])):
+                        print(f"[SKIP] {script_name} à jour (empreinte {fingerprint[:12]})")
+                        skipped.append(script_name)
+                        done.add(script_name)
+                        continue
+                deps = ', '.join(dependencies[script_name]) or 'aucune'
+                print(f"[DAG] Lancement de {script_name} (dépendances : {deps})")
+                running[executor.submit(runner, script_name, pipeline_mode, processes)] = script_name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                script_name = running.pop(future)
+                result, duration, error = future.result()
+
+                if error:
+                    print(f"[ERREUR CRITIQUE] {script_name} : {error}")
+                    success = False
+                    continue
+
+                print_script_output(script_name, result, duration)
+                if run is not None:
+                    run['steps'].append(run_report.step_report(
+                        script_name, 'ok' if result.returncode == 0 else 'failed',
+                        duration, getattr(result, 'metrics', {})
+                    ))
+                if result.returncode != 0:
+                    print(f"\n[ECHEC] Le script {script_name} a échoué avec le code {result.returncode}")
+                    success = False
+                else:
+                    print(f"\n[SUCCES] {script_name} terminé avec succès")
+                    durations[script_name] = duration
+                    overheads[script_name] = getattr(result, 'overhead', None)
+                    done.add(script_name)
+                    # Nouvelle version des tables produites : les étapes aval seront relancées
+                    if script_name in fingerprints:
+                        version = pipeline_state.save_step(state_conn, script_name, *fingerprints[script_name], duration)
+                        for table in steps[script_name]["outputs"]:
+                            table_versions[table] = version
+
+        if not success:
+            print("Arrêt du processus.")
+            for script_name, process in list(processes.items()):
+                print(f"[DAG] Interruption de {script_name}")
+                process.terminate()
+            if pending:
+                print(f"[DAG] Étapes non lancées : {', '.join(sorted(pending, key=order.get))}")
+
+    if skipped:
+        print(f"\n[SKIP] {len(skipped)} étape(s) à jour : {', '.join(skipped)}")
+
+    # Résumé : chemin critique et gain du parallélisme
+    path_duration, path = critical_path(dependencies, durations)
+    serial_duration = sum(durations.values())
+    print(f"\n[CHEMIN CRITIQUE] {' -> '.join(path) or 'aucun'} ({path_duration:.2f}s)")
+    for script_name in path:
+        print(f"    {script_name:32s} {durations[script_name]:8.2f}s")
+    print(f"[DAG] Somme des étapes : {serial_duration:.2f}s | {workers} workers")
+
+    # Coût fixe par étape : démarrage (interpréteur + imports, ou import du module) et connexions
+    print("\n[OVERHEAD] Étape                              démarrage   connexions")
+    for script_name in sorted(overheads, key=order.get):
+        if overheads[script_name]:
+            startup, connections, connect_time = overheads[script_name]
+            print(f"    {script_name:32s} {startup:8.2f}s   {connections:3d} en {connect_time:.2f}s")
+    return success, durations
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Lance le pipeline de transformation des données.")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="Vide le cache des tournois normalisés avant l'exécution")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Ne recharge que les tournois nouveaux ou modifiés depuis le dernier run")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="Isole chaque étape dans son propre processus Python (ancien mode)")
+    parser.add_argument("--force", action="append", default=[], metavar="STEP",
+                        help="Relance une étape même si son empreinte est inchangée "
+                             "(nom, préfixe numérique ou 'all' ; répétable)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="Nombre d'étapes exécutées simultanément (1 = exécution séquentielle)")
+    parser.add_argument("--backend", choices=("postgres", "duckdb"), default=BACKEND,
+                        help="Stockage : serveur PostgreSQL, ou fichier DuckDB embarqué (sans serveur, partiel)")
+    parser.add_argument("--allow-partial", action="store_true",
+                        help="Accepte le backend duckdb, qui ne construit qu'une partie des tables")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print("Démarrage du pipeline de traitement des données...")
+    total_start_time = time.perf_counter()
+
+    if args.rebuild_cache:
+        print("[CACHE] Reconstruction du cache des tournois demandée")
+        tournament_cache.clear_cache()
+
+    # Backend embarqué : une partie des tables est construite dans DuckDB, sans serveur ni
+    # étapes PostgreSQL ; les étapes non prises en charge sont listées et le run refusé sans --allow-partial
+    if args.backend == "duckdb":
+        print("[BACKEND] duckdb")
+        unsupported = duckdb_backend.unsupported_steps(STEPS)
+        for script_name, missing in unsupported:
+            detail = ', '.join(missing) if missing else 'export de fichiers, aucune table'
+            print(f"[BACKEND] Non pris en charge par duckdb : {script_name} ({detail})")
+        if not args.allow_partial:
+            print(f"[ERREUR] Backend duckdb partiel : {len(unsupported)} étapes sur {len(STEPS)} ne seraient pas "
+                  f"exécutées (relancer avec --allow-partial pour l'accepter)")
+            sys.exit(2)
+        duckdb_backend.run(json_folder_path)
+        print(f"[PIPELINE] Backend duckdb partiel : {len(unsupported)} étapes sur {len(STEPS)} non exécutées")
+        print(f"[PIPELINE] Durée totale : {time.perf_counter() - total_start_time:.2f} secondes")
+        return
+
+    pipeline_mode = "incremental" if args.incremental else "full"
+    print(f"[MODE] {pipeline_mode}")
+
+    # Configuration partagée : en processus unique, les étapes lisent l'environnement du runner
+    if args.subprocess:
+        runner = run_script
+    else:
+        os.environ.update(pipeline_env(pipeline_mode))
+        incremental.reset_changes()
+        install_output_capture()
+        db.init_pool()
+        runner = run_step_inprocess
+    print(f"[RUNNER] {'sous-processus' if args.subprocess else 'processus unique (pool de connexions partagé)'}")
+
+    # Table du manifeste créée avant les étapes parallèles (évite les CREATE concurrents)
+    if pipeline_mode == "incremental":
+        try:
+            conn = db.get_conn()
+            incremental.create_manifest_table(conn)
+            conn.close()
+        except Exception as e:
+            print(f"[ERREUR] Création du manifeste impossible : {e}")
+
+    # Tables de dimension (clés entières) créées avant les étapes parallèles, dans tous les modes
+    try:
+        conn = db.get_conn()
+        keys.create_dimension_tables(conn)
+        conn.close()
+    except Exception as e:
+        print(f"[ERREUR] Création des tables de dimension impossible : {e}")
+
+    state_conn = db.get_conn()
+    run = run_report.new_run(pipeline_mode, 'subprocess' if args.subprocess else 'inprocess', args.workers)
+    success, _ = run_pipeline(pipeline_mode, max(1, args.workers), runner, state_conn, args.force, run)
+
+    # Rapport de run : JSON, historique pipeline_runs et comparaison aux runs précédents
+    run_report.finish_run(run, success, time.perf_counter() - total_start_time)
+    run_report.print_report(run)
+    print(f"[RAPPORT] {run_report.write_json(run)}")
+    try:
+        run_report.save_run(state_conn, run)
+        run_report.compare_run(state_conn, run['run_id'])
+    except Exception as e:
+        print(f"[ERREUR] Enregistrement du rapport de run impossible : {e}")
+    state_conn.close()
+
+    # Le manifeste n'est enregistré qu'après un pipeline complet réussi : toutes les
+    # étapes lancées terminées sans erreur (échecs propagés par main(), cf. run_step_inprocess)
+    if success and all(step['status'] == 'ok' for step in run['steps']):
+        try:
+            conn = db.get_conn()
+            incremental.commit_manifest(conn, json_folder_path)
+            conn.close()
+        except Exception as e:
+            print(f"[ERREUR] Mise à jour du manifeste impossible : {e}")
+    db.close_pool()
+
+    # Application du budget disque du cache des tournois
+    tournament_cache.prune_cache()
+
+    total_duration = time.perf_counter() - total_start_time
+    print(f"\n{'='*60}")
+    print(f"[PIPELINE] Durée totale : {total_duration:.2f} secondes")
+    print('='*60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Magasin local de colonnes NumPy (tableaux .npy mappés en mémoire).
+
+L'export (main(), étape du pipeline) écrit les colonnes entières de match, deck et
+deck_card dans ARRAY_STORE_DIR, un fichier '<table>.<colonne>.npy' par colonne, plus
+un dictionnaire de chaînes (strings.json : archétypes et cartes, indexés par leur
+code) et un manifeste (manifest.json : date d'export, nombre de lignes). Les valeurs
+manquantes valent -1. Le magasin est remplacé d'un bloc (répertoire temporaire puis
+renommage) : un lecteur ouvert garde l'ancienne version.
+
+ArrayStore ouvre les colonnes avec np.load(mmap_mode='r'), sans copie ni connexion à
+la base, et répond aux agrégations courantes des notebooks et de la ligne de commande :
+part des archétypes, matrice des confrontations entre archétypes, taux d'inclusion des
+cartes.
+
+Utilisation en ligne de commande :
+    python array_store.py                      # exporte depuis PostgreSQL
+    python array_store.py --share [epoch]      # part des archétypes
+    python array_store.py --matchups [epoch]   # confrontations les plus jouées
+    python array_store.py --cards [archétype]  # cartes les plus incluses
+    python array_store.py --benchmark          # pd.read_sql contre le magasin local
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_DIR = os.getenv("ARRAY_STORE_DIR", os.path.join(BASE_DIR, "cache", "array_store"))
+FETCH_ROWS = 1000000  # Lignes lues par lot pendant l'export
+MISSING = -1          # Valeur des clés absentes (NULL)
+
+# Colonnes exportées : {table: (colonnes, requête)}. Les codes d'archétype et de carte
+# renvoient aux tables temporaires store_archetype et store_card (dictionnaire de chaînes).
+EXPORTS = {
+    'match': (('match_id', 'tournament_key', 'player1_key', 'player2_key', 'winner_key', 'epoch',
+               'deck1_key', 'deck2_key'), """
+        SELECT m.match_id, m.tournament_key, m.player1_key, m.player2_key, coalesce(m.winner_key, -1),
+               coalesce(m.extension_epoch, -1), coalesce(d1.deck_key, -1), coalesce(d2.deck_key, -1)
+        FROM match m
+        LEFT JOIN deck d1 ON d1.tournament_key = m.tournament_key AND d1.player_key = m.player1_key
+        LEFT JOIN deck d2 ON d2.tournament_key = m.tournament_key AND d2.player_key = m.player2_key
+    """),
+    'deck': (('deck_key', 'tournament_key', 'player_key', 'archetype', 'epoch'), """
+        SELECT d.deck_key, d.tournament_key, d.player_key, coalesce(a.code, -1), coalesce(d.extension_epoch, -1)
+        FROM deck d
+        LEFT JOIN store_archetype a ON a.deck_nom = d.deck_nom
+    """),
+    'deck_card': (('deck_key', 'card', 'count'), """
+        SELECT dc.deck_key, c.code, dc.count
+        FROM deck_card dc
+        JOIN store_card c ON c.card_key = dc.card_key
+    """),
+}
+
+# Dictionnaires de chaînes : {nom: (table temporaire, colonne texte, requête de création)}
+DICTIONARIES = {
+    'archetype': ('store_archetype', 'deck_nom', """
+        CREATE TEMP TABLE store_archetype ON COMMIT DROP AS
+        SELECT deck_nom, (row_number() OVER (ORDER BY deck_nom) - 1)::int AS code
+        FROM (SELECT DISTINCT deck_nom FROM deck WHERE deck_nom IS NOT NULL) n
+    """),
+    'card': ('store_card', 'card_id', """
+        CREATE TEMP TABLE store_card ON COMMIT DROP AS
+        SELECT card_key, card_id, (row_number() OVER (ORDER BY card_key) - 1)::int AS code
+        FROM card WHERE card_key IS NOT NULL
+    """),
+}
+
+def _fetch_columns(cur, query, nb_columns):
+    """Exécute 'query' et retourne ses colonnes en tableaux int32 (lecture par lots)."""
+    cur.execute(query)
+    chunks = []
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64).reshape(-1, nb_columns))
+    data = np.concatenate(chunks) if chunks else np.empty((0, nb_columns), dtype=np.int64)
+    return [np.ascontiguousarray(data[:, i], dtype=np.int32) for i in range(nb_columns)]
+
+def export(conn, store_dir=STORE_DIR):
+    """
+    Exporte les colonnes et le dictionnaire de chaînes dans 'store_dir' (remplacé d'un
+    bloc), en une transaction de lecture. Retourne {table: nombre de lignes}.
+    """
+    start_time = time.time()
+    tmp_dir = f"{store_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    counts = {}
+    strings = {}
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")  # Instantané cohérent
+        for name, (table, column, ddl) in DICTIONARIES.items():
+            cur.execute(ddl)
+            cur.execute(f"SELECT {column} FROM {table} ORDER BY code")
+            strings[name] = [row[0] for row in cur.fetchall()]
+        for table, (columns, query) in EXPORTS.items():
+            arrays = _fetch_columns(cur, query, len(columns))
+            for column, values in zip(columns, arrays):
+                np.save(os.path.join(tmp_dir, f"{table}.{column}.npy"), values)
+            counts[table] = len(arrays[0])
+    conn.rollback()
+
+    with open(os.path.join(tmp_dir, "strings.json"), 'w', encoding='utf-8') as f:
+        json.dump(strings, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump({'exported_at': datetime.datetime.now().isoformat(timespec='seconds'), 'rows': counts}, f)
+
+    # Remplacement d'un bloc : les lecteurs ouverts gardent leurs fichiers mappés
+    old_dir = f"{store_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    size = sum(os.path.getsize(os.path.join(store_dir, f)) for f in os.listdir(store_dir))
+    print(f"[STORE] {', '.join(f'{t} {n:,}' for t, n in counts.items())} lignes exportées dans '{store_dir}' "
+          f"({size / 1024 / 1024:.1f} Mo) en {time.time() - start_time:.1f}s")
+    return counts
+
+class ArrayStore:
+    """Colonnes du magasin ouvertes en mémoire mappée (lecture seule, chargement paresseux)."""
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "strings.json"), encoding='utf-8') as f:
+            self.strings = json.load(f)
+        with open(os.path.join(store_dir, "manifest.json"), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self._columns = {}
+        self._deck_rows = None
+
+    def column(self, table, column):
+        """Colonne 'table.column' (np.memmap, aucune copie)."""
+        key = (table, column)
+        if key not in self._columns:
+            self._columns[key] = np.load(os.path.join(self.store_dir, f"{table}.{column}.npy"), mmap_mode='r')
+        return self._columns[key]
+
+    @property
+    def archetypes(self):
+        return self.strings['archetype']
+
+    @property
+    def cards(self):
+        return self.strings['card']
+
+    def deck_rows(self):
+        """Table de correspondance deck_key -> rang dans les colonnes de deck (-1 si absent)."""
+        if self._deck_rows is None:
+            deck_keys = self.column('deck', 'deck_key')
+            rows = np.full(int(deck_keys.max(initial=0)) + 1, MISSING, dtype=np.int64)
+            rows[deck_keys] = np.arange(len(deck_keys))
+            self._deck_rows = rows
+        return self._deck_rows
+
+    def deck_archetypes(self, deck_keys):
+        """Code d'archétype de chaque deck_key (-1 pour un deck absent ou sans archétype)."""
+        deck_keys = np.asarray(deck_keys)
+        rows = self.deck_rows()
+        valid = (deck_keys >= 0) & (deck_keys < len(rows))
+        codes = np.full(len(deck_keys), MISSING, dtype=np.int64)
+        found = rows[deck_keys[valid]]
+        codes[valid] = np.where(found >= 0, np.asarray(self.column('deck', 'archetype'))[found], MISSING)
+        return codes
+
+    def _deck_mask(self, epoch=None):
+        epochs = self.column('deck', 'epoch')
+        return np.ones(len(epochs), dtype=bool) if epoch is None else np.asarray(epochs) == epoch
+
+    def archetype_share(self, epoch=None):
+        """Part des archétypes : [(archétype, nb_decks, part en %)], du plus joué au moins joué."""
+        codes = np.asarray(self.column('deck', 'archetype'))[self._deck_mask(epoch)]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.archetypes))
+        total = counts.sum()
+        order = np.argsort(-counts, kind='stable')
+        return [(self.archetypes[i], int(counts[i]), 100.0 * counts[i] / total if total else 0.0)
+                for i in order if counts[i]]
+
+    def matchup_counts(self, epoch=None):
+        """
+        Confrontations entre archétypes, du point de vue de chaque deck :
+        (wins, draws, games), matrices n x n où [i, j] compte les matchs de i contre j.
+        """
+        n = len(self.archetypes)
+        a1 = self.deck_archetypes(self.column('match', 'deck1_key'))
+        a2 = self.deck_archetypes(self.column('match', 'deck2_key'))
+        winner = np.asarray(self.column('match', 'winner_key'))
+        valid = (a1 >= 0) & (a2 >= 0)
+        if epoch is not None:
+            valid &= np.asarray(self.column('match', 'epoch')) == epoch
+        a1, a2, winner = a1[valid], a2[valid], winner[valid]
+        player1 = np.asarray(self.column('match', 'player1_key'))[valid]
+        player2 = np.asarray(self.column('match', 'player2_key'))[valid]
+        forward, backward = a1 * n + a2, a2 * n + a1
+        draw = winner == MISSING
+
+        def count(index):
+            return np.bincount(index, minlength=n * n).reshape(n, n)
+
+        wins = count(forward[winner == player1]) + count(backward[winner == player2])
+        draws = count(forward[draw]) + count(backward[draw])
+        games = count(forward) + count(backward)
+        return wins, draws, games
+
+    def card_inclusion(self, epoch=None, archetype=None):
+        """
+        Inclusion des cartes dans les decks sélectionnés (ère, archétype) :
+        [(card_id, nb_decks, part en %, nombre moyen d'exemplaires)], par inclusion décroissante.
+        """
+        selected = self._deck_mask(epoch)
+        if archetype is not None:
+            selected &= np.asarray(self.column('deck', 'archetype')) == self.archetypes.index(archetype)
+        nb_decks = int(selected.sum())
+        rows = self.deck_rows()[np.asarray(self.column('deck_card', 'deck_key'))]
+        keep = rows >= 0
+        keep[keep] = selected[rows[keep]]
+        cards = np.asarray(self.column('deck_card', 'card'))[keep]
+        copies = np.asarray(self.column('deck_card', 'count'))[keep]
+        decks = np.bincount(cards, minlength=len(self.cards))
+        total_copies = np.bincount(cards, weights=copies, minlength=len(self.cards))
+        order = np.argsort(-decks, kind='stable')
+        return [(self.cards[i], int(decks[i]), 100.0 * decks[i] / nb_decks, total_copies[i] / decks[i])
+                for i in order if decks[i]]
+
+def open_store(store_dir=STORE_DIR):
+    """Ouvre le magasin (erreur explicite s'il n'a jamais été exporté)."""
+    if not os.path.exists(os.path.join(store_dir, "manifest.json")):
+        raise FileNotFoundError(f"Magasin absent : lancer 'python array_store.py' (export) vers '{store_dir}'")
+    return ArrayStore(store_dir)
+
+def print_matchups(store, epoch=None, limit=20):
+    """Affiche les confrontations les plus jouées (archétypes différents) et leur taux de victoire."""
+    wins, draws, games = store.matchup_counts(epoch)
+    i, j = np.nonzero(np.triu(games, k=1))
+    order = np.argsort(-games[i, j], kind='stable')[:limit]
+    for a, b in zip(i[order], j[order]):
+        rate = 100.0 * (wins[a, b] + 0.5 * draws[a, b]) / games[a, b]
+        print(f"{store.archetypes[a][:40]:40s} vs {store.archetypes[b][:40]:40s} "
+              f"{games[a, b]:>8,} matchs  {rate:5.1f}%")
+
+def benchmark(store_dir=STORE_DIR):
+    """
+    Compare le chemin actuel des analyses (pd.read_sql de match_winners_losers puis
+    agrégation pandas) à l'ouverture du magasin local et aux mêmes agrégations NumPy.
+    """
+    import pandas as pd
+    from sqlalchemy import create_engine
+    import db
+
+    start_time = time.time()
+    engine = create_engine(db.sqlalchemy_url(), connect_args=db.CONNECT_ARGS)
+    df = pd.read_sql("SELECT winner_deck_name, looser_deck_name, is_draw FROM match_winners_losers", engine)
+    pd.concat([df['winner_deck_name'], df['looser_deck_name']]).value_counts()
+    df.groupby(['winner_deck_name', 'looser_deck_name']).size()
+    engine.dispose()
+    sql_time = time.time() - start_time
+
+    start_time = time.time()
+    store = open_store(store_dir)
+    store.archetype_share()
+    store.matchup_counts()
+    store_time = time.time() - start_time
+
+    print(f"[BENCHMARK] {len(df):,} matchs")
+    print(f"[BENCHMARK] pd.read_sql + pandas        : {sql_time:.3f}s")
+    print(f"[BENCHMARK] Magasin mappé + NumPy        : {store_time:.3f}s | x{sql_time / store_time:.1f}")
+    return sql_time, store_time
+
+def main():
+    from db import get_conn
+    try:
+        print("[INFO] Export du magasin de colonnes NumPy...")
+        conn = get_conn()
+        export(conn)
+        conn.close()
+    except Exception as e:
+        print(f"[ERREUR CRITIQUE] {e}")
+        raise
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['--share']:
+        for name, count, share in open_store().archetype_share(int(args[1]) if len(args) > 1 else None)[:30]:
+            print(f"{name[:60]:60s} {count:>8,}  {share:5.1f}%")
+    elif args[:1] == ['--matchups']:
+        print_matchups(open_store(), int(args[1]) if len(args) > 1 else None)
+    elif args[:1] == ['--cards']:
+        for card_id, decks, share, copies in open_store().card_inclusion(archetype=args[1] if len(args) > 1 else None)[:30]:
+            print(f"{card_id[:60]:60s} {decks:>8,}  {share:5.1f}%  x{copies:.2f}")
+    elif args[:1] == ['--benchmark']:
+        benchmark()
+    else:
+        main()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration PostgreSQL partagée et pool de connexions.
+
+Toutes les étapes obtiennent leurs connexions par get_conn(). Lancée seule (ou en
+sous-processus), une étape reçoit une connexion psycopg2 classique. Dans le runner
+en processus unique (Exe.py), init_pool() active un ThreadedConnectionPool : get_conn()
+renvoie alors une connexion empruntée au pool, dont close() la restitue (rollback et
+RESET ALL) au lieu de la fermer.
+
+Le temps passé à obtenir les connexions est comptabilisé par étape (connect_stats).
+Les connexions utilisent TimedCursor : temps SQL et lignes lues/écrites alimentent les
+compteurs de l'étape courante (metrics.py, rapport de run).
+Lancée en sous-processus par Exe.py (PIPELINE_LAUNCH_TIME défini), l'étape affiche en
+sortie son coût de démarrage (interpréteur + imports jusqu'à db) et de connexion.
+"""
+import os
+import atexit
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import metrics
+
+# Paramètres de connexion PostgreSQL
+host = 'localhost'
+port = 5432
+database = 'postgres'
+user = 'postgres'
+
+POOL_MIN_CONN = 1
+POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", "24"))  # Connexions simultanées au plus
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "120"))  # Attente max d'une connexion supplémentaire (s)
+
+_pool = None
+_pool_slots = None  # Sémaphore : get_conn attend une connexion libre au lieu d'échouer
+_pool_size = 0
+_lock = threading.Lock()
+connect_stats = {}  # {étape: [nb_connexions, secondes]}
+_borrowed = {}      # {étape: [connexions empruntées non restituées]}
+
+# Instructions dont le rowcount compte comme lignes lues / écrites
+READ_STATEMENTS = ('SELECT',)
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Curseur qui comptabilise le temps SQL et les lignes lues/écrites de l'étape courante."""
+
+    def _account(self, query, start_time):
+        metrics.add('db_time', time.perf_counter() - start_time)
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', errors='replace')
+        if not isinstance(query, str) or self.rowcount <= 0:
+            return
+        words = query.lstrip().split(None, 1)
+        statement = words[0].upper() if words else ''
+        if statement in READ_STATEMENTS:
+            metrics.add('rows_read', self.rowcount)
+        elif statement in WRITE_STATEMENTS:
+            metrics.add('rows_written', self.rowcount)
+
+    def execute(self, query, vars=None):
+        start_time = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._account(query, start_time)
+
+    def executemany(self, query, vars_list):
+        start_time = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._account(query, start_time)
+
+    def copy_expert(self, sql, file, size=8192):
+        # Lignes comptées par loader.py (le COPY vise le plus souvent un staging)
+        with metrics.timed('db_time'):
+            return super().copy_expert(sql, file, size)
+
+# Arguments de connexion communs (psycopg2.connect, pool et create_engine de SQLAlchemy)
+CONNECT_ARGS = {'cursor_factory': TimedCursor}
+
+def sqlalchemy_url():
+    """URL SQLAlchemy correspondant aux paramètres de connexion."""
+    return f"postgresql+psycopg2://{user}:@{host}:{port}/{database}"
+
+def _connect():
+    """Connexion psycopg2 avec encodage UTF-8 (repli sans réglage si l'encodage échoue)."""
+    try:
+        os.environ['PGCLIENTENCODING'] = 'UTF8'
+        conn = psycopg2.connect(host=host, port=port, dbname=database, user=user, **CONNECT_ARGS)
+        conn.set_client_encoding('UTF8')
+        return conn
+    except UnicodeDecodeError:
+        return psycopg2.connect(host=host, port=port, dbname=database, user=user, **CONNECT_ARGS)
+
+# L'étape du thread courant est tenue par metrics.py (connexions et compteurs de run)
+set_current_step = metrics.set_current_step
+current_step = metrics.current_step
+
+def _record(elapsed):
+    step = current_step()
+    with _lock:
+        stats = connect_stats.setdefault(step, [0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+
+class PooledConnection:
+    """Connexion empruntée au pool : délègue tout à psycopg2, close() la restitue."""
+
+    def __init__(self, conn, step):
+        self._conn = conn
+        self._step = step
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    @property
+    def closed(self):
+        return self._released or self._conn.closed
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        broken = bool(self._conn.closed)
+        if not broken:
+            try:
+                self._conn.rollback()
+                self._conn.autocommit = True
+                with self._conn.cursor() as cur:
+                    cur.execute("RESET ALL")
+                self._conn.autocommit = False
+            except psycopg2.Error:
+                broken = True
+        with _lock:
+            borrowed = _borrowed.get(self._step, [])
+            if self in borrowed:
+                borrowed.remove(self)
+        _pool.putconn(self._conn, close=broken)
+        _pool_slots.release()
+
+def init_pool(max_conn=POOL_MAX_CONN):
+    """Active le pool partagé pour le processus courant (runner en processus unique)."""
+    global _pool, _pool_slots, _pool_size
+    if _pool is None:
+        _pool_size = max_conn
+        _pool = psycopg2.pool.ThreadedConnectionPool(POOL_MIN_CONN, max_conn, host=host, port=port,
+                                                     dbname=database, user=user, **CONNECT_ARGS)
+        _pool_slots = threading.BoundedSemaphore(max_conn)
+    return _pool
+
+def close_pool():
+    """Ferme toutes les connexions du pool."""
+    global _pool, _pool_slots
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+        _pool_slots = None
+
+def get_conn():
+    """
+    Connexion PostgreSQL UTF-8 : empruntée au pool s'il est actif, sinon dédiée.
+    Une étape qui détient déjà une connexion du pool (connexions imbriquées : keys.ensure_keys,
+    parallel_load_rows) attend au plus POOL_ACQUIRE_TIMEOUT secondes puis lève PoolError :
+    des étapes qui s'attendraient mutuellement en gardant leurs connexions échouent au lieu
+    de bloquer le pipeline.
+    """
+    start_time = time.perf_counter()
+    if _pool is None:
+        conn = _connect()
+    else:
+        step = current_step()
+        with _lock:
+            nested = bool(_borrowed.get(step))
+        if not _pool_slots.acquire(timeout=POOL_ACQUIRE_TIMEOUT if nested else None):
+            raise psycopg2.pool.PoolError(
+                f"Aucune connexion libre après {POOL_ACQUIRE_TIMEOUT:.0f}s pour '{step}' qui en détient déjà "
+                f"(pool de {_pool_size} : augmenter DB_POOL_MAX_CONN ou réduire PARALLEL_COPY_CONNECTIONS)"
+            )
+        raw = _pool.getconn()
+        raw.set_client_encoding('UTF8')
+        conn = PooledConnection(raw, current_step())
+        with _lock:
+            _borrowed.setdefault(conn._step, []).append(conn)
+    _record(time.perf_counter() - start_time)
+    return conn
+
+def release_step(step):
+    """Restitue les connexions qu'une étape a oublié de fermer. Retourne leur nombre."""
+    with _lock:
+        leaked = list(_borrowed.pop(step, []))
+    for conn in leaked:
+        conn.close()
+    return len(leaked)
+
+def _report_subprocess_overhead(startup):
+    """Ligne [OVERHEAD] lue par Exe.py en mode sous-processus."""
+    connections = sum(stats[0] for stats in connect_stats.values())
+    connect_time = sum(stats[1] for stats in connect_stats.values())
+    print(f"[OVERHEAD] démarrage {startup:.2f}s | connexions {connections} en {connect_time:.2f}s")
+
+if os.getenv("PIPELINE_LAUNCH_TIME") and __name__ != '__main__':
+    atexit.register(_report_subprocess_overhead, time.time() - float(os.environ["PIPELINE_LAUNCH_TIME"]))
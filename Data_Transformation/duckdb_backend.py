@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Backend analytique embarqué (DuckDB) : le pipeline sans serveur PostgreSQL.
+
+Avec PIPELINE_BACKEND=duckdb (ou Exe.py --backend duckdb), les tables de faits sont
+construites dans un fichier DuckDB (DUCKDB_PATH) en lisant directement les tournois
+avec les lecteurs de DuckDB : read_json sur le dossier JSON_FOLDER, ou read_parquet si
+le dossier contient des fichiers .parquet (même structure, cf. --to-parquet).
+
+Les étapes reprennent la logique des scripts PostgreSQL, en SQL ensembliste :
+- normalisation de tournament_cache.py (caractères non ASCII remplacés, espaces retirés,
+  placement et scores entiers, matchs à deux joueurs seulement) ;
+- tournament, player (dernière occurrence gagnante, comme l'upsert de 03), participation,
+  match, deck (deck_comp), deck_match et deck_performance, mêmes colonnes et mêmes règles.
+Les tables sont indexées par leurs identifiants naturels : les clés de substitution
+(keys.py), les époques (extension, fichier Excel) et les tables de référence des cartes
+(card, card_evolve, issues du site) restent propres au backend PostgreSQL ; deck_nom
+n'est donc pas calculé ici.
+
+Ce backend est partiel : seules les tables de BUILD_STEPS sont construites. card,
+card_evolve, decklist/deck_card, match_winners_losers, deck_matchup, deck_archetype
+(et les autres sorties listées par unsupported_steps) n'existent qu'avec PostgreSQL :
+Exe.py --backend duckdb refuse de s'exécuter sans --allow-partial. Les requêtes sont
+une réécriture des règles des étapes PostgreSQL (tournament_cache.py, 02 à 10, 15) :
+toute modification d'une règle doit être reportée ici, --parity le vérifie.
+
+Utilisation en ligne de commande :
+    python duckdb_backend.py                         # construit DUCKDB_PATH depuis JSON_FOLDER
+    python duckdb_backend.py --parity                # compare les tables à celles de PostgreSQL
+    python duckdb_backend.py --benchmark             # durée DuckDB / étapes PostgreSQL équivalentes
+    python duckdb_backend.py --to-parquet out.parquet  # exporte les tournois JSON en Parquet
+"""
+import os
+import sys
+import time
+import tempfile
+from collections import Counter
+import db
+
+try:
+    import duckdb
+except ImportError:  # Dépendance optionnelle : seul le backend embarqué en a besoin
+    duckdb = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DUCKDB_PATH = os.getenv("DUCKDB_PATH", os.path.join(BASE_DIR, "pipeline.duckdb"))
+json_folder = os.getenv("JSON_FOLDER")
+
+# Schéma explicite des tournois : aucune inférence sur l'échantillon de fichiers, et
+# des champs numériques lus en texte puis convertis comme dans tournament_cache.py
+TOURNAMENT_COLUMNS = {
+    'id': 'VARCHAR',
+    'name': 'VARCHAR',
+    'date': 'VARCHAR',
+    'organizer': 'VARCHAR',
+    'format': 'VARCHAR',
+    'nb_players': 'VARCHAR',
+    'players': 'STRUCT("id" VARCHAR, "name" VARCHAR, "placing" VARCHAR, "country" VARCHAR, '
+               '"decklist" STRUCT("type" VARCHAR, "url" VARCHAR, "name" VARCHAR, "count" VARCHAR)[])[]',
+    'matches': 'STRUCT("match_results" STRUCT("player_id" VARCHAR, "score" VARCHAR)[])[]',
+}
+
+# remove_non_ascii : non ASCII -> espace, espaces de bord retirés, '' pour une valeur vide
+CLEAN_MACRO = r"""
+    CREATE OR REPLACE MACRO clean(x) AS
+    coalesce(regexp_replace(regexp_replace(CAST(x AS VARCHAR), '[^\x00-\x7F]', ' ', 'g'), '^\s+|\s+$', '', 'g'), '')
+"""
+
+# Étapes du backend, dans l'ordre de dépendance : (table, requête de construction)
+BUILD_STEPS = [
+    ('raw_player', """
+        SELECT tournament_id, source_key, pos, clean(p.id) AS player_id, clean(p.name) AS player_name,
+               clean(p.country) AS player_country,
+               CASE WHEN regexp_full_match(p.placing, '[0-9]+') THEN CAST(p.placing AS INT) END AS player_placing,
+               p.decklist
+        FROM (SELECT tournament_id, source_key, unnest(players) AS p, generate_subscripts(players, 1) AS pos
+              FROM raw_tournament)
+        WHERE clean(p.id) <> ''
+    """),
+    ('tournament', """
+        SELECT tournament_id, clean(name) AS tournament_name, TRY_CAST(date AS TIMESTAMP) AS tournament_date,
+               clean(organizer) AS tournament_organizer, clean(format) AS tournament_format,
+               coalesce(TRY_CAST(nb_players AS INT), 0) AS tournament_nb_player
+        FROM raw_tournament
+        QUALIFY row_number() OVER (PARTITION BY tournament_id ORDER BY source_key) = 1
+    """),
+    ('player', """
+        SELECT player_id, player_name, player_country
+        FROM raw_player
+        WHERE player_name <> ''
+        QUALIFY row_number() OVER (PARTITION BY player_id ORDER BY source_key DESC, pos DESC) = 1
+    """),
+    ('participation', """
+        SELECT DISTINCT player_id, tournament_id, player_placing AS participation_placing
+        FROM raw_player
+        WHERE player_placing > 0
+        QUALIFY row_number() OVER (PARTITION BY source_key, player_id, tournament_id ORDER BY pos) = 1
+    """),
+    ('match', """
+        SELECT row_number() OVER (ORDER BY source_key, pos) AS match_id, tournament_id,
+               player1_id, player1_score, player2_id, player2_score,
+               CASE WHEN player1_score > player2_score THEN player1_id
+                    WHEN player2_score > player1_score THEN player2_id END AS match_winner
+        FROM (
+            SELECT tournament_id, source_key, pos,
+                   clean(r[1].player_id) AS player1_id, TRY_CAST(r[1].score AS INT) AS player1_score,
+                   clean(r[2].player_id) AS player2_id, TRY_CAST(r[2].score AS INT) AS player2_score
+            FROM (SELECT tournament_id, source_key, unnest(matches).match_results AS r,
+                         generate_subscripts(matches, 1) AS pos
+                  FROM raw_tournament)
+            WHERE len(r) = 2 AND r[1].player_id IS NOT NULL AND r[2].player_id IS NOT NULL
+        )
+        WHERE player1_score IS NOT NULL AND player2_score IS NOT NULL
+    """),
+    ('deck', """
+        SELECT deck_id, player_id, tournament_id, array_to_string(list_sort(card_names), ', ') AS deck_comp
+        FROM (
+            SELECT player_id || '_' || tournament_id AS deck_id, player_id, tournament_id, source_key, pos,
+                   list_filter(list_transform(decklist, c -> clean(c.name)), n -> n <> '') AS card_names
+            FROM raw_player
+        )
+        WHERE len(card_names) > 0
+        QUALIFY row_number() OVER (PARTITION BY deck_id ORDER BY source_key DESC, pos DESC) = 1
+    """),
+    ('deck_match', """
+        SELECT match_id, player1_id AS player_id, player1_id || '_' || tournament_id AS deck_id,
+               CASE WHEN match_winner = player1_id THEN 1 ELSE 0 END AS wins,
+               CASE WHEN match_winner IS NULL THEN 1 ELSE 0 END AS draws,
+               CASE WHEN match_winner = player2_id THEN 1 ELSE 0 END AS losses
+        FROM match
+        UNION ALL
+        SELECT match_id, player2_id, player2_id || '_' || tournament_id,
+               CASE WHEN match_winner = player2_id THEN 1 ELSE 0 END,
+               CASE WHEN match_winner IS NULL THEN 1 ELSE 0 END,
+               CASE WHEN match_winner = player1_id THEN 1 ELSE 0 END
+        FROM match
+    """),
+    ('deck_performance', """
+        SELECT d.deck_id, d.tournament_id, d.player_id,
+               count(*) FILTER (WHERE m.match_winner = side.player_id) AS wins,
+               count(*) FILTER (WHERE m.match_winner <> side.player_id) AS losses,
+               count(*) FILTER (WHERE m.match_winner IS NULL) AS draws,
+               count(*) AS games,
+               CAST(round(100.0 * (count(*) FILTER (WHERE m.match_winner = side.player_id)
+                                   + 0.5 * count(*) FILTER (WHERE m.match_winner IS NULL)) / count(*), 2)
+                    AS DECIMAL(5, 2)) AS win_pct
+        FROM match m
+        CROSS JOIN LATERAL (VALUES (m.player1_id), (m.player2_id)) AS side(player_id)
+        JOIN deck d ON d.tournament_id = m.tournament_id AND d.player_id = side.player_id
+        GROUP BY d.deck_id, d.tournament_id, d.player_id
+    """),
+]
+
+# Comparaison aux tables PostgreSQL : colonnes naturelles communes aux deux backends.
+# Nom et pays d'un joueur viennent de sa dernière occurrence, dans l'ordre (arbitraire)
+# de os.listdir côté PostgreSQL : seuls les identifiants sont comparés.
+PARITY_COLUMNS = {
+    'tournament': ('tournament_id', 'tournament_name', 'tournament_date', 'tournament_organizer',
+                   'tournament_format', 'tournament_nb_player'),
+    'player': ('player_id',),
+    'participation': ('player_id', 'tournament_id', 'participation_placing'),
+    'match': ('tournament_id', 'player1_id', 'player1_score', 'player2_id', 'player2_score', 'match_winner'),
+    'deck': ('deck_id', 'player_id', 'tournament_id', 'deck_comp'),
+    'deck_match': ('player_id', 'deck_id', 'wins', 'draws', 'losses'),
+    'deck_performance': ('deck_id', 'tournament_id', 'wins', 'losses', 'draws', 'games', 'win_pct'),
+}
+
+# Étapes PostgreSQL produisant les mêmes tables (mesure comparative, --benchmark)
+POSTGRES_STEPS = ("02_tournament.py", "03_player.py", "04_participation.py", "08_deck.py",
+                  "09_match.py", "10_deck_match.py", "15_deck_performance.py")
+
+def unsupported_steps(steps):
+    """
+    Étapes du pipeline (liste STEPS d'Exe.py) que ce backend ne remplace pas entièrement.
+    Retourne [(script, tables non construites)] ; une étape sans table (export de
+    fichiers) est toujours non prise en charge.
+    """
+    built = {table for table, _ in BUILD_STEPS}
+    unsupported = []
+    for step in steps:
+        missing = [table for table in step["outputs"] if table not in built]
+        if missing or not step["outputs"]:
+            unsupported.append((step["script"], missing))
+    return unsupported
+
+def require_duckdb():
+    """Erreur explicite si le module duckdb n'est pas installé."""
+    if duckdb is None:
+        raise RuntimeError("Backend DuckDB indisponible : installer le paquet 'duckdb' (pip install duckdb)")
+
+def connect(path=DUCKDB_PATH):
+    """Connexion au fichier DuckDB du pipeline."""
+    require_duckdb()
+    return duckdb.connect(path)
+
+def source_relation(folder):
+    """
+    Lecteur DuckDB des tournois du dossier : Parquet s'il en contient, JSON sinon.
+    source_key (fichier, puis rang dans le fichier Parquet) ordonne les occurrences.
+    """
+    files = os.listdir(folder)
+    if any(name.endswith('.parquet') for name in files):
+        return (f"(SELECT *, filename || ':' || lpad(CAST(file_row_number AS VARCHAR), 12, '0') AS source_key "
+                f"FROM read_parquet('{os.path.join(folder, '*.parquet')}', filename = true, file_row_number = true))")
+    columns = ', '.join(f"'{name}': '{kind}'" for name, kind in TOURNAMENT_COLUMNS.items())
+    return (f"(SELECT *, filename AS source_key FROM read_json('{os.path.join(folder, '*.json')}', "
+            f"columns = {{{columns}}}, format = 'auto', filename = true, ignore_errors = true))")
+
+def build(conn, folder):
+    """
+    Construit toutes les tables du backend dans 'conn' (reconstruction complète,
+    chaque table remplacée en une instruction). Retourne {table: nombre de lignes}.
+    """
+    counts = {}
+    conn.execute(CLEAN_MACRO)
+    start_time = time.time()
+    conn.execute(f"""
+        CREATE OR REPLACE TEMP TABLE raw_tournament AS
+        SELECT clean(id) AS tournament_id, * EXCLUDE (id, filename)
+        FROM {source_relation(folder)}
+        WHERE clean(id) <> ''
+    """)
+    print(f"[DUCKDB] raw_tournament : {conn.execute('SELECT count(*) FROM raw_tournament').fetchone()[0]:,} "
+          f"tournois lus en {time.time() - start_time:.2f}s")
+    for table, query in BUILD_STEPS:
+        start_time = time.time()
+        kind = "TEMP TABLE" if table.startswith('raw_') else "TABLE"
+        conn.execute(f"CREATE OR REPLACE {kind} {table} AS {query}")
+        counts[table] = conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        print(f"[DUCKDB] {table} : {counts[table]:,} lignes en {time.time() - start_time:.2f}s")
+    return counts
+
+def run(folder=None, path=DUCKDB_PATH):
+    """Point d'entrée du backend : construit le fichier DuckDB. Retourne {table: lignes}."""
+    folder = folder or json_folder
+    start_time = time.time()
+    print(f"[DUCKDB] Construction de '{path}' depuis '{folder}'...")
+    conn = connect(path)
+    try:
+        counts = build(conn, folder)
+    finally:
+        conn.close()
+    elapsed = time.time() - start_time
+    total = sum(counts.values())
+    print(f"[OK] Backend DuckDB construit en {elapsed:.1f}s : {total:,} lignes dans {len(counts)} tables")
+    print(f"[PERFORMANCE] {total / elapsed if elapsed > 0 else 0:,.0f} lignes/sec")
+    return counts
+
+def parity(path=DUCKDB_PATH):
+    """
+    Test de parité : compare, table par table, les lignes DuckDB aux lignes PostgreSQL
+    (multiensembles sur PARITY_COLUMNS). Retourne True si toutes les tables sont identiques.
+    """
+    duck = connect(path)
+    pg = db.get_conn()
+    ok = True
+    for table, columns in PARITY_COLUMNS.items():
+        column_list = ', '.join(columns)
+        duck_rows = Counter(duck.execute(f"SELECT {column_list} FROM {table}").fetchall())
+        with pg.cursor() as cur:
+            cur.execute(f"SELECT {column_list} FROM {table}")
+            pg_rows = Counter(cur.fetchall())
+        extra = sum((duck_rows - pg_rows).values())
+        missing = sum((pg_rows - duck_rows).values())
+        ok &= not (extra or missing)
+        status = 'OK' if not (extra or missing) else 'ERREUR'
+        print(f"[{status}] {table} : {sum(duck_rows.values()):,} lignes DuckDB / {sum(pg_rows.values()):,} PostgreSQL "
+              f"({extra:,} en trop, {missing:,} manquantes)")
+        for row in list((duck_rows - pg_rows).elements())[:3]:
+            print(f"    DuckDB seul     : {row}")
+        for row in list((pg_rows - duck_rows).elements())[:3]:
+            print(f"    PostgreSQL seul : {row}")
+    pg.rollback()
+    pg.close()
+    duck.close()
+    return ok
+
+def benchmark(folder=None):
+    """
+    Durée de bout en bout : construction DuckDB (fichier temporaire) contre les étapes
+    PostgreSQL équivalentes (POSTGRES_STEPS, sous-processus comme Exe.py --subprocess).
+    """
+    import Exe  # Import local : Exe importe ce module pour --backend duckdb
+    folder = folder or json_folder
+    with tempfile.TemporaryDirectory() as tmp:
+        start_time = time.time()
+        run(folder, os.path.join(tmp, "benchmark.duckdb"))
+        duck_time = time.time() - start_time
+
+    Exe.json_folder_path = folder
+    start_time = time.time()
+    for script in POSTGRES_STEPS:
+        result, duration, error = Exe.run_script(os.path.join(BASE_DIR, script), "full")
+        if error or result.returncode != 0:
+            print(f"[ERREUR] {script} : {error or Exe.decode_output(result.stderr)[-500:]}")
+            return None
+        print(f"[BENCHMARK] {script} : {duration:.2f}s")
+    pg_time = time.time() - start_time
+
+    print(f"[BENCHMARK] DuckDB (embarqué)       : {duck_time:.2f}s")
+    print(f"[BENCHMARK] PostgreSQL ({len(POSTGRES_STEPS)} étapes) : {pg_time:.2f}s | x{pg_time / duck_time:.2f}")
+    return duck_time, pg_time
+
+def to_parquet(target, folder=None):
+    """Exporte les tournois JSON du dossier dans un fichier Parquet (même structure)."""
+    conn = duckdb.connect()
+    columns = ', '.join(f"'{name}': '{kind}'" for name, kind in TOURNAMENT_COLUMNS.items())
+    conn.execute(f"""
+        COPY (SELECT * FROM read_json('{os.path.join(folder or json_folder, '*.json')}',
+                                      columns = {{{columns}}}, format = 'auto', ignore_errors = true))
+        TO '{target}' (FORMAT parquet)
+    """)
+    conn.close()
+    print(f"[OK] Tournois exportés dans '{target}'")
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['--parity']:
+        sys.exit(0 if parity() else 1)
+    elif args[:1] == ['--benchmark']:
+        benchmark()
+    elif len(args) == 2 and args[0] == '--to-parquet':
+        require_duckdb()
+        to_parquet(args[1])
+    else:
+        run()
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Zone d'atterrissage ELT : tournois bruts en JSONB et transformations dans PostgreSQL.
+
+load_raw() charge chaque fichier JSON une seule fois (COPY + upsert) dans
+'raw_tournament' (tournament_id, payload JSONB, content_hash, file_name, loaded_at) :
+un fichier dont le nom et le hash n'ont pas changé n'est ni décodé ni renvoyé (un
+fichier renommé est rechargé pour mettre à jour file_name).
+
+derive() reconstruit ensuite, dans le schéma ELT_SCHEMA, les tables tournament,
+player, participation, card, deck, deck_card et match par des CREATE TABLE AS
+ensemblistes (jsonb_to_recordset, jointures LATERAL) appliquant les règles de
+tournament_cache.py et des étapes 02 à 11. Ces requêtes sont exécutées en parallèle
+par le serveur (workers parallèles de PostgreSQL) et ne lisent jamais le disque :
+après un changement de règle, une nouvelle dérivation suffit.
+
+Les tables dérivées portent les identifiants naturels ; les clés de substitution
+(keys.py), les époques et le partitionnement restent l'affaire des étapes du pipeline.
+decklist_hash (blake2b calculé en Python) n'est pas dérivé.
+
+Utilisation en ligne de commande :
+    python elt.py               # charge les fichiers nouveaux ou modifiés puis dérive
+    python elt.py --load        # chargement seul
+    python elt.py --derive      # dérivation seule (aucun accès aux fichiers)
+    python elt.py --verify      # compare les tables dérivées aux tables du pipeline
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from db import get_conn
+from tournament_cache import parse_json_bytes, remove_non_ascii
+import loader
+
+RAW_TABLE = "raw_tournament"
+ELT_SCHEMA = os.getenv("ELT_SCHEMA", "elt")
+PARALLEL_WORKERS = int(os.getenv("ELT_PARALLEL_WORKERS", "4"))  # Workers parallèles par requête
+MAX_WORKERS = 12  # Threads de lecture des fichiers
+READ_BATCH_FILES = 8  # Fichiers lus par tâche de lecture
+RAW_BATCH_BYTES = int(os.getenv("ELT_RAW_BATCH_MB", "64")) * 1024 * 1024  # Payloads JSON par chargement (octets)
+json_folder = os.getenv("JSON_FOLDER")
+
+# Fonctions SQL de normalisation (mêmes règles que tournament_cache.py), PARALLEL SAFE
+# pour rester utilisables par les workers parallèles
+FUNCTIONS_SQL = r"""
+    CREATE OR REPLACE FUNCTION {schema}.clean(value TEXT) RETURNS TEXT
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT coalesce(regexp_replace(regexp_replace(value, '[^\x01-\x7f]', ' ', 'g'), '^\s+|\s+$', '', 'g'), '')
+    $$;
+    CREATE OR REPLACE FUNCTION {schema}.to_int(value TEXT, fallback INT) RETURNS INT
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT CASE WHEN value ~ '^\s*[+-]?\d{{1,9}}\s*$' THEN value::int ELSE fallback END
+    $$;
+    CREATE OR REPLACE FUNCTION {schema}.objects(value JSONB) RETURNS JSONB
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+        SELECT CASE WHEN jsonb_typeof(value) = 'array'
+                    THEN jsonb_path_query_array(value, '$[*] ? (@.type() == "object")')
+                    ELSE '[]'::jsonb END
+    $$;
+"""
+
+# Tables dérivées, dans l'ordre de dépendance : (table, requête). {s} : schéma ELT.
+# raw_player : un joueur par ligne (identifiant non vide), avec sa position dans le fichier
+DERIVED_TABLES = [
+    ('raw_player', f"""
+        SELECT r.tournament_id, r.file_name, p.pos,
+               {{s}}.clean(p.id) AS player_id, {{s}}.clean(p.name) AS player_name,
+               {{s}}.clean(p.country) AS player_country,
+               CASE WHEN p.placing ~ '^[0-9]+$' THEN p.placing::int END AS player_placing,
+               {{s}}.objects(p.decklist) AS decklist
+        FROM {RAW_TABLE} r
+        CROSS JOIN LATERAL ROWS FROM (
+            jsonb_to_recordset({{s}}.objects(r.payload->'players'))
+                AS (id TEXT, name TEXT, "placing" TEXT, country TEXT, decklist JSONB)
+        ) WITH ORDINALITY AS p(id, name, "placing", country, decklist, pos)
+        WHERE {{s}}.clean(p.id) <> ''
+    """),
+    ('tournament', f"""
+        SELECT tournament_id, {{s}}.clean(payload->>'name') AS tournament_name,
+               NULLIF(payload->>'date', '')::timestamp AS tournament_date,
+               {{s}}.clean(payload->>'organizer') AS tournament_organizer,
+               {{s}}.clean(payload->>'format') AS tournament_format,
+               {{s}}.to_int(payload->>'nb_players', 0) AS tournament_nb_player
+        FROM {RAW_TABLE}
+    """),
+    ('player', """
+        SELECT DISTINCT ON (player_id) player_id, player_name, player_country
+        FROM {s}.raw_player
+        WHERE player_name <> ''
+        ORDER BY player_id, file_name DESC, pos DESC
+    """),
+    ('participation', """
+        SELECT DISTINCT player_id, tournament_id, player_placing AS participation_placing
+        FROM (SELECT DISTINCT ON (tournament_id, player_id) player_id, tournament_id, player_placing
+              FROM {s}.raw_player
+              WHERE player_placing > 0
+              ORDER BY tournament_id, player_id, pos) first_occurrence
+    """),
+    ('card', """
+        SELECT DISTINCT ON (card_id) card_id, card_name, card_type
+        FROM (SELECT regexp_replace({s}.clean(c.url), '[^A-Za-z0-9_./:?=&-]', '', 'g') AS card_id,
+                     {s}.clean(c.name) AS card_name, {s}.clean(c.type) AS card_type
+              FROM {s}.raw_player rp
+              CROSS JOIN LATERAL jsonb_to_recordset(rp.decklist) AS c(url TEXT, name TEXT, type TEXT)) cards
+        WHERE card_id <> '' AND card_name <> '' AND card_type <> ''
+        ORDER BY card_id, card_name, card_type
+    """),
+    ('deck', """
+        SELECT DISTINCT ON (deck_id) rp.player_id || '_' || rp.tournament_id AS deck_id,
+               rp.player_id, rp.tournament_id, names.deck_comp, names.deck_nom
+        FROM {s}.raw_player rp
+        CROSS JOIN LATERAL (
+            SELECT string_agg(n.name, ', ' ORDER BY n.name COLLATE "C") AS deck_comp,
+                   string_agg(DISTINCT n.name, ', ' ORDER BY n.name) FILTER (WHERE n.final) AS deck_nom
+            FROM (SELECT {s}.clean(c.name) COLLATE "C" AS name,
+                         {s}.clean(c.name) IN (SELECT card_name FROM {s}.final_card_name) AS final
+                  FROM jsonb_to_recordset(rp.decklist) AS c(name TEXT)) n
+            WHERE n.name <> ''
+        ) names
+        WHERE names.deck_comp IS NOT NULL
+        ORDER BY deck_id, rp.file_name DESC, rp.pos DESC
+    """),
+    ('deck_card', """
+        SELECT d.deck_id, d.tournament_id, c.card_id, max(c.count) AS count
+        FROM (SELECT DISTINCT ON (player_id, tournament_id) player_id || '_' || tournament_id AS deck_id,
+                     tournament_id, decklist
+              FROM {s}.raw_player
+              WHERE jsonb_array_length(decklist) > 0
+              ORDER BY player_id, tournament_id, file_name DESC, pos DESC) d
+        CROSS JOIN LATERAL (
+            SELECT {s}.clean(c.url) AS card_id,
+                   {s}.to_int(c.count, 1) AS count
+            FROM jsonb_to_recordset(d.decklist) AS c(url TEXT, count TEXT)
+        ) c
+        WHERE c.card_id <> ''
+        GROUP BY d.deck_id, d.tournament_id, c.card_id
+    """),
+    ('match', f"""
+        SELECT tournament_id, player1_id, player1_score, player2_id, player2_score,
+               CASE WHEN player1_score > player2_score THEN player1_id
+                    WHEN player2_score > player1_score THEN player2_id END AS match_winner
+        FROM (
+            SELECT r.tournament_id,
+                   {{s}}.clean(m.match_results->0->>'player_id') AS player1_id,
+                   {{s}}.to_int(m.match_results->0->>'score', NULL) AS player1_score,
+                   {{s}}.clean(m.match_results->1->>'player_id') AS player2_id,
+                   {{s}}.to_int(m.match_results->1->>'score', NULL) AS player2_score
+            FROM {RAW_TABLE} r
+            CROSS JOIN LATERAL jsonb_to_recordset({{s}}.objects(r.payload->'matches')) AS m(match_results JSONB)
+            WHERE jsonb_typeof(m.match_results) = 'array' AND jsonb_array_length(m.match_results) = 2
+              AND m.match_results->0 ? 'player_id' AND m.match_results->1 ? 'player_id'
+        ) matches
+        WHERE player1_score IS NOT NULL AND player2_score IS NOT NULL
+    """),
+]
+
+# Comparaison aux tables du pipeline (colonnes naturelles). Nom/pays d'un joueur et
+# nom/type d'une carte dépendent de l'ordre de lecture des fichiers côté Python.
+VERIFY_COLUMNS = {
+    'tournament': ('tournament_id', 'tournament_name', 'tournament_date', 'tournament_organizer',
+                   'tournament_format', 'tournament_nb_player'),
+    'player': ('player_id',),
+    'participation': ('player_id', 'tournament_id', 'participation_placing'),
+    'card': ('card_id',),
+    'deck': ('deck_id', 'player_id', 'tournament_id', 'deck_comp', 'deck_nom'),
+    'deck_card': ('deck_id', 'tournament_id', 'card_id', 'count'),
+    'match': ('tournament_id', 'player1_id', 'player1_score', 'player2_id', 'player2_score', 'match_winner'),
+}
+
+def create_raw_table(conn):
+    """Crée la table d'atterrissage si elle n'existe pas."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {RAW_TABLE} (
+                tournament_id TEXT PRIMARY KEY,
+                payload JSONB NOT NULL,
+                content_hash TEXT NOT NULL,
+                file_name TEXT,
+                loaded_at TIMESTAMP DEFAULT now()
+            )
+        """)
+    conn.commit()
+
+def read_raw_file(filename, known_files):
+    """
+    Lit un fichier JSON et retourne (tournament_id, payload, hash, fichier), ou None si
+    le fichier est invalide ou déjà chargé sous ce nom avec le même contenu
+    (known_files : ensemble de couples (fichier, hash)).
+    """
+    try:
+        with open(os.path.join(json_folder, filename), 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        print(f"[ERREUR] Impossible de lire {filename}: {e}")
+        return None
+    content_hash = hashlib.sha1(content).hexdigest()
+    if (filename, content_hash) in known_files:
+        return None
+    data = parse_json_bytes(content)
+    tournament_id = remove_non_ascii(data.get('id')) if isinstance(data, dict) else ''
+    if not tournament_id:
+        return None
+    # JSONB refuse le caractère nul
+    payload = json.dumps(data, ensure_ascii=False).replace('\\u0000', '')
+    return tournament_id, payload, content_hash, filename
+
+def read_raw_files(filenames, known_files):
+    """Lignes (voir read_raw_file) d'un lot de fichiers, sans les fichiers ignorés."""
+    return [row for row in (read_raw_file(filename, known_files) for filename in filenames) if row]
+
+def byte_batches(rows, max_bytes=RAW_BATCH_BYTES):
+    """
+    Regroupe les lignes en lots dont la taille cumulée des payloads ne dépasse pas
+    max_bytes (une ligne plus grande forme un lot à elle seule).
+    """
+    batch, size = [], 0
+    for row in rows:
+        row_bytes = len(row[1])
+        if batch and size + row_bytes > max_bytes:
+            yield batch
+            batch, size = [], 0
+        batch.append(row)
+        size += row_bytes
+    if batch:
+        yield batch
+
+def load_raw(conn, folder=None):
+    """
+    Charge dans 'raw_tournament' les fichiers nouveaux ou modifiés (COPY puis upsert sur
+    tournament_id) et supprime les tournois dont le fichier a disparu. Retourne le
+    nombre de fichiers chargés.
+    Les fichiers sont lus en flux par les threads de lecture (lots en vol bornés) et
+    chargés par lots d'au plus RAW_BATCH_BYTES de payloads : la mémoire ne dépend pas
+    du nombre de fichiers modifiés.
+    """
+    global json_folder
+    json_folder = folder or json_folder
+    start_time = time.time()
+    create_raw_table(conn)
+    with conn.cursor() as cur:
+        # Couples (fichier, hash) : un fichier renommé sans modification est rechargé, sinon
+        # la suppression finale retirerait son tournoi (file_name resté sur l'ancien nom)
+        cur.execute(f"SELECT file_name, content_hash FROM {RAW_TABLE}")
+        known_files = set(cur.fetchall())
+
+    files = sorted(f for f in os.listdir(json_folder) if f.endswith('.json'))
+    read_batches = [files[i:i + READ_BATCH_FILES] for i in range(0, len(files), READ_BATCH_FILES)]
+    loaded = 0
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        rows = loader.stream_batches(executor, lambda batch: read_raw_files(batch, known_files),
+                                     read_batches, max_pending=MAX_WORKERS, label='lots de fichiers')
+        # Un upsert par lot : l'ordre des fichiers est conservé, le dernier fichier d'un tournoi l'emporte
+        for batch in byte_batches(rows):
+            loaded += loader.load_rows(conn, RAW_TABLE, ('tournament_id', 'payload', 'content_hash', 'file_name'),
+                                       batch, policy='upsert', key=('tournament_id',))
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {RAW_TABLE} WHERE file_name <> ALL(%s)", (files,))
+        removed = cur.rowcount
+        cur.execute(f"ANALYZE {RAW_TABLE}")
+    conn.commit()
+    print(f"[ELT] {loaded:,} fichiers chargés, {len(files) - loaded:,} inchangés ou invalides, "
+          f"{removed:,} tournois retirés en {time.time() - start_time:.1f}s")
+    return loaded
+
+def derive(conn, schema=ELT_SCHEMA, workers=PARALLEL_WORKERS):
+    """
+    (Re)construit les tables dérivées dans 'schema' depuis 'raw_tournament' uniquement,
+    en une transaction, requêtes parallélisées par le serveur. Retourne {table: lignes}.
+    """
+    start_time = time.time()
+    counts = {}
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        cur.execute(FUNCTIONS_SQL.format(schema=schema))
+        # Plans parallèles même sur une petite table d'atterrissage
+        cur.execute(f"ALTER TABLE {RAW_TABLE} SET (parallel_workers = {int(workers)})")
+        cur.execute(f"SET LOCAL max_parallel_workers_per_gather = {int(workers)}")
+        cur.execute("SET LOCAL parallel_setup_cost = 0")
+        cur.execute("SET LOCAL parallel_tuple_cost = 0")
+        cur.execute("SET LOCAL min_parallel_table_scan_size = 0")
+        # Noms des cartes d'évolution finale (deck_nom), comme 08_deck.py
+        cur.execute(f"DROP TABLE IF EXISTS {schema}.final_card_name")
+        cur.execute(f"CREATE TABLE {schema}.final_card_name (card_name TEXT PRIMARY KEY)")
+        cur.execute("SELECT to_regclass('card') IS NOT NULL AND to_regclass('card_evolve') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute(f"""
+                INSERT INTO {schema}.final_card_name
+                SELECT DISTINCT c.card_name FROM card c JOIN card_evolve e ON e.card_id = c.card_id
+                WHERE e.card_poke_finale = 1 AND c.card_name IS NOT NULL
+            """)
+        for table, query in DERIVED_TABLES:
+            table_start = time.time()
+            cur.execute(f"DROP TABLE IF EXISTS {schema}.{table}")
+            cur.execute(f"CREATE TABLE {schema}.{table} AS {query.format(s=schema)}")
+            counts[table] = cur.rowcount
+            if table == 'raw_player':
+                cur.execute(f"ANALYZE {schema}.{table}")
+            print(f"[ELT] {schema}.{table} : {counts[table]:,} lignes en {time.time() - table_start:.2f}s")
+    conn.commit()
+    print(f"[OK] Dérivation terminée en {time.time() - start_time:.1f}s (workers parallèles : {workers})")
+    return counts
+
+def verify(conn, schema=ELT_SCHEMA):
+    """
+    Compare chaque table dérivée à la table du pipeline (EXCEPT ALL sur VERIFY_COLUMNS).
+    Retourne True si toutes sont identiques.
+    """
+    ok = True
+    with conn.cursor() as cur:
+        for table, columns in VERIFY_COLUMNS.items():
+            column_list = ', '.join(columns)
+            cur.execute(f"""
+                SELECT
+                    (SELECT count(*) FROM (SELECT {column_list} FROM {schema}.{table}
+                                           EXCEPT ALL SELECT {column_list} FROM public.{table}) x),
+                    (SELECT count(*) FROM (SELECT {column_list} FROM public.{table}
+                                           EXCEPT ALL SELECT {column_list} FROM {schema}.{table}) x)
+            """)
+            extra, missing = cur.fetchone()
+            ok &= not (extra or missing)
+            print(f"[{'OK' if not (extra or missing) else 'ERREUR'}] {table} : "
+                  f"{extra:,} lignes en trop, {missing:,} manquantes")
+    conn.rollback()
+    return ok
+
+def main():
+    start_time = time.time()
+    conn = get_conn()
+    try:
+        load_raw(conn)
+        derive(conn)
+    finally:
+        conn.close()
+    print(f"[PERFORMANCE] ELT terminé en {time.time() - start_time:.1f}s")
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['--verify']:
+        connection = get_conn()
+        result = verify(connection)
+        connection.close()
+        sys.exit(0 if result else 1)
+    elif args[:1] in (['--load'], ['--derive']):
+        connection = get_conn()
+        load_raw(connection) if args[0] == '--load' else derive(connection)
+        connection.close()
+    else:
+        main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Époques d'extension (ères de format).
+
+La table 'extension_epoch' matérialise la période de validité de chaque extension :
+[date de sortie, date de sortie de l'extension suivante), la première époque couvrant
+aussi tout ce qui précède (comme l'ancien calcul de last_extension). Un index GiST
+(contrainte d'exclusion : périodes disjointes) permet d'affecter l'époque de tous les
+tournois par une seule jointure de plages (validity @> date).
+
+epoch_id numérote les extensions par date de sortie : il est stable tant que les
+extensions ajoutées sont plus récentes que les précédentes. deck et match reçoivent
+l'époque au chargement (epoch_of, recherche dichotomique sur les bornes chargées une
+fois par load_epochs) : les analyses de méta filtrent par ère sans joindre tournament.
+"""
+import bisect
+import datetime
+
+EPOCH_TABLE = "extension_epoch"
+EXCLUDED_EXTENSIONS = ('P-A',)  # Promos : sortie continue, pas une ère de format
+
+def build_epochs(conn):
+    """
+    (Re)construit 'extension_epoch' depuis 'extension' en une transaction.
+    Retourne le nombre d'époques (0 si aucune extension).
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {EPOCH_TABLE} (
+                epoch_id INT PRIMARY KEY,
+                extension_code TEXT NOT NULL,
+                validity DATERANGE NOT NULL,
+                EXCLUDE USING gist (validity WITH &&)
+            )
+        """)
+        cur.execute(f"TRUNCATE {EPOCH_TABLE}")
+        cur.execute(f"""
+            INSERT INTO {EPOCH_TABLE} (epoch_id, extension_code, validity)
+            SELECT epoch_id, extension_code,
+                   daterange(CASE WHEN epoch_id > 1 THEN extension_date_sortie END, next_date, '[)')
+            FROM (
+                SELECT extension_code, extension_date_sortie,
+                       row_number() OVER w AS epoch_id,
+                       lead(extension_date_sortie) OVER w AS next_date
+                FROM extension
+                WHERE extension_code <> ALL(%s) AND extension_date_sortie IS NOT NULL
+                WINDOW w AS (ORDER BY extension_date_sortie, extension_code)
+            ) e
+        """, (list(EXCLUDED_EXTENSIONS),))
+        count = cur.rowcount
+    conn.commit()
+    print(f"[EPOCH] {count} époques d'extension matérialisées dans '{EPOCH_TABLE}'")
+    return count
+
+def load_epochs(conn):
+    """
+    Bornes des époques non vides : (dates de début, epoch_id), triées. La première
+    borne est date.min (époque ouverte vers le passé). Listes vides si la table manque.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT lower(validity), epoch_id FROM {EPOCH_TABLE}
+                WHERE NOT isempty(validity)
+                ORDER BY lower(validity) NULLS FIRST
+            """)
+            rows = cur.fetchall()
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[INFO] Époques d'extension non disponibles, extension_epoch laissé vide : {e}")
+        return [], []
+    return [lower or datetime.date.min for lower, _ in rows], [epoch_id for _, epoch_id in rows]
+
+def epoch_of(date_text, epochs):
+    """
+    Époque d'une date de tournoi (texte ISO du JSON ou date), même règle que la jointure
+    de plages : une date absente tombe dans la première époque.
+    """
+    starts, epoch_ids = epochs
+    if not epoch_ids:
+        return None
+    if not date_text:
+        return epoch_ids[0]
+    try:
+        if isinstance(date_text, datetime.datetime):
+            day = date_text.date()
+        elif isinstance(date_text, datetime.date):
+            day = date_text
+        else:
+            day = datetime.date.fromisoformat(str(date_text)[:10])
+    except ValueError:
+        return None
+    return epoch_ids[max(bisect.bisect_right(starts, day) - 1, 0)]
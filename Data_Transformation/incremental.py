@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Mode incrémental du pipeline.
+
+Le manifeste 'tournament_manifest' mémorise, pour chaque tournoi chargé, le fichier
+source et le hash de son contenu. En mode incrémental (PIPELINE_MODE=incremental),
+chaque étape ne traite que les fichiers nouveaux ou modifiés et ne supprime/réinsère
+que les lignes des tournament_id concernés. Le manifeste n'est mis à jour qu'à la fin
+d'un pipeline réussi (Exe.py), toutes les étapes voient donc le même ensemble de
+tournois touchés.
+"""
+import os
+import time
+import threading
+import psycopg2.extensions
+import psycopg2.extras
+from tournament_cache import load_entry
+import keys
+import partitions
+
+MANIFEST_TABLE = "tournament_manifest"
+
+_changes = None  # Calcul mis en cache pour la durée du processus (ou du run, cf. reset_changes)
+_changes_lock = threading.Lock()
+
+def pipeline_mode():
+    """Mode courant ('full' ou 'incremental'), lu dans PIPELINE_MODE à chaque appel."""
+    return os.getenv("PIPELINE_MODE", "full")
+
+def reset_changes():
+    """Oublie les changements calculés (début d'un nouveau run dans le même processus)."""
+    global _changes
+    _changes = None
+
+def create_manifest_table(conn):
+    """Crée la table du manifeste si elle n'existe pas."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                tournament_id TEXT PRIMARY KEY,
+                file_name TEXT,
+                content_hash TEXT,
+                loaded_at TIMESTAMP DEFAULT now()
+            );
+        """)
+    conn.commit()
+
+def table_exists(conn, table):
+    """Vérifie l'existence d'une table dans le schéma courant."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        return cur.fetchone()[0]
+
+def column_exists(conn, table, column):
+    """Vérifie qu'une table possède une colonne."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attname = %s AND attnum > 0 AND NOT attisdropped
+        """, (table, column))
+        return cur.fetchone() is not None
+
+def is_incremental(conn, table, required_column=None, partitioned=False):
+    """
+    Indique si l'étape doit travailler en incrémental sur 'table'.
+    Une table absente, ou d'un schéma antérieur (required_column absente, ou table non
+    partitionnée alors que partitioned est demandé), impose une reconstruction complète.
+    """
+    if pipeline_mode() != "incremental":
+        return False
+    if not table_exists(conn, table):
+        print(f"[INCREMENTAL] Table '{table}' absente : reconstruction complète")
+        return False
+    if required_column and not column_exists(conn, table, required_column):
+        print(f"[INCREMENTAL] Colonne '{table}.{required_column}' absente : reconstruction complète")
+        return False
+    if partitioned and not partitions.is_partitioned(conn, table):
+        print(f"[INCREMENTAL] Table '{table}' non partitionnée : reconstruction complète")
+        return False
+    return True
+
+def scan_json_folder(json_folder):
+    """Retourne {tournament_id: (nom_fichier, hash)} pour tous les fichiers JSON valides."""
+    try:
+        files = [f for f in os.listdir(json_folder) if f.endswith('.json')]
+    except OSError:
+        files = []
+
+    current = {}
+    for filename in files:
+        try:
+            entry = load_entry(os.path.join(json_folder, filename))
+        except OSError:
+            continue
+        if entry['record']:
+            current[entry['record']['id']] = (filename, entry['hash'])
+    return current
+
+def get_changes(conn, json_folder):
+    """
+    Compare le dossier JSON au manifeste.
+    Retourne (fichiers_modifiés, tournament_ids_touchés) ; les tournois dont le
+    fichier a disparu font partie des identifiants touchés.
+    """
+    global _changes
+    with _changes_lock:
+        if _changes is None:
+            _changes = _compute_changes(conn, json_folder)
+    return _changes
+
+def _compute_changes(conn, json_folder):
+    """Calcul effectif de get_changes."""
+    start_time = time.time()
+    create_manifest_table(conn)
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT tournament_id, content_hash FROM {MANIFEST_TABLE}")
+        manifest = dict(cur.fetchall())
+
+    current = scan_json_folder(json_folder)
+    changed_files = []
+    affected_ids = set()
+    for tournament_id, (filename, content_hash) in current.items():
+        if manifest.get(tournament_id) != content_hash:
+            changed_files.append(filename)
+            affected_ids.add(tournament_id)
+
+    removed_ids = set(manifest) - set(current)
+    affected_ids |= removed_ids
+
+    elapsed = time.time() - start_time
+    print(f"[INCREMENTAL] {len(changed_files):,} fichiers nouveaux/modifiés, "
+          f"{len(removed_ids):,} tournois supprimés ({elapsed:.1f}s)")
+
+    return changed_files, affected_ids
+
+def commit_changes(conn):
+    """
+    Valide les modifications incrémentales d'une étape. PostgreSQL transforme
+    silencieusement le COMMIT d'une transaction en échec en ROLLBACK : l'étape lève
+    alors une erreur au lieu de se terminer comme si ses lignes étaient chargées.
+    """
+    if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        conn.rollback()
+        raise RuntimeError("Transaction en échec : modifications incrémentales annulées")
+    conn.commit()
+
+def delete_tournament_rows(conn, table, tournament_ids, column="tournament_id"):
+    """
+    Supprime les lignes de 'table' appartenant aux tournois touchés. Avec
+    column='tournament_key', les identifiants sont traduits via dim_tournament.
+    """
+    if not tournament_ids:
+        return 0
+    if column == 'tournament_key':
+        condition = f"{column} IN ({keys.key_subquery('tournament')})"
+    else:
+        condition = f"{column} = ANY(%s)"
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {table} WHERE {condition}", (list(tournament_ids),))
+        deleted = cur.rowcount
+    print(f"[INCREMENTAL] {deleted:,} lignes supprimées de '{table}'")
+    return deleted
+
+def commit_manifest(conn, json_folder):
+    """
+    Enregistre l'état courant du dossier JSON dans le manifeste (fin de pipeline réussi)
+    et retire les tournois dont le fichier source a disparu.
+    """
+    create_manifest_table(conn)
+    current = scan_json_folder(json_folder)
+
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT tournament_id FROM {MANIFEST_TABLE}")
+        removed_ids = {row[0] for row in cur.fetchall()} - set(current)
+
+        cur.execute("""
+            CREATE TEMP TABLE manifest_stage (
+                tournament_id TEXT, file_name TEXT, content_hash TEXT
+            ) ON COMMIT DROP
+        """)
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO manifest_stage VALUES %s",
+            [(tid, filename, content_hash) for tid, (filename, content_hash) in current.items()],
+            page_size=10000
+        )
+        cur.execute(f"""
+            INSERT INTO {MANIFEST_TABLE} (tournament_id, file_name, content_hash, loaded_at)
+            SELECT tournament_id, file_name, content_hash, now() FROM manifest_stage
+            ON CONFLICT (tournament_id) DO UPDATE SET
+                file_name = EXCLUDED.file_name,
+                content_hash = EXCLUDED.content_hash,
+                loaded_at = EXCLUDED.loaded_at
+            WHERE {MANIFEST_TABLE}.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+        """)
+        updated = cur.rowcount
+
+        if removed_ids:
+            cur.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE tournament_id = ANY(%s)", (list(removed_ids),))
+            # Les étapes de faits ont déjà retiré leurs lignes ; reste la dimension tournoi
+            if table_exists(conn, "tournament"):
+                cur.execute("DELETE FROM tournament WHERE tournament_id = ANY(%s)", (list(removed_ids),))
+    conn.commit()
+    print(f"[MANIFEST] {updated:,} tournois enregistrés, {len(removed_ids):,} retirés")
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Clés de substitution entières (dictionnaire des identifiants naturels).
+
+Chaque identifiant naturel TEXT (slug de joueur, de tournoi, URL de carte, deck_id)
+reçoit une fois pour toutes une clé INTEGER dans une table de dimension persistante
+(dim_player, dim_tournament, dim_card, dim_deck), jamais supprimée par les
+reconstructions : les clés restent stables entre runs complets et incrémentaux.
+
+Les clés sont attribuées à l'ingestion : loader.load_rows(..., surrogates=...) relève
+les identifiants inconnus de son staging, les enregistre par ensure_keys() puis joint
+les dimensions lors de la fusion. Les tables de faits sont indexées et jointes sur
+ces entiers (index plus petits, jointures par hachage plus rapides).
+
+decklist_hash() fournit la clé de contenu d'une decklist (table 'decklist', voir
+11_deck_card.py) : deux decks aux listes identiques partagent la même clé.
+
+ensure_keys() travaille sur sa propre connexion, en transaction courte et dans l'ordre
+des identifiants : les étapes parallèles ne se bloquent pas mutuellement jusqu'à la
+fin de leur chargement et ne peuvent pas s'interbloquer.
+"""
+import hashlib
+import threading
+from db import get_conn
+
+# Dimension -> (table, colonne clé, colonne de l'identifiant naturel)
+DIMENSIONS = {
+    'player': ('dim_player', 'player_key', 'player_id'),
+    'tournament': ('dim_tournament', 'tournament_key', 'tournament_id'),
+    'card': ('dim_card', 'card_key', 'card_id'),
+    'deck': ('dim_deck', 'deck_key', 'deck_id'),
+}
+
+_created = False
+_lock = threading.Lock()
+
+def _create_tables(conn):
+    """CREATE TABLE IF NOT EXISTS des dimensions, validé sur conn."""
+    with conn.cursor() as cur:
+        for table, key_column, natural_column in DIMENSIONS.values():
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {key_column} SERIAL PRIMARY KEY,
+                    {natural_column} TEXT NOT NULL UNIQUE
+                )
+            """)
+    conn.commit()
+
+def create_dimension_tables(conn=None):
+    """
+    Crée les tables de dimension si besoin (une fois par processus). Sans conn, une
+    connexion dédiée est utilisée : la transaction de l'appelant n'est jamais validée.
+    """
+    global _created
+    with _lock:
+        if _created:
+            return
+        if conn is None:
+            own_conn = get_conn()
+            try:
+                _create_tables(own_conn)
+            finally:
+                own_conn.close()
+        else:
+            _create_tables(conn)
+        _created = True
+
+def ensure_keys(dimension, values):
+    """
+    Attribue une clé aux identifiants naturels absents de la dimension (transaction
+    courte sur une connexion dédiée). Retourne le nombre de clés créées.
+    """
+    values = sorted({value for value in values if value is not None})
+    if not values:
+        return 0
+    table, _, natural_column = DIMENSIONS[dimension]
+    create_dimension_tables()
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO {table} ({natural_column})
+                SELECT value FROM unnest(%s::text[]) AS value ORDER BY value
+                ON CONFLICT ({natural_column}) DO NOTHING
+            """, (values,))
+            created = cur.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    if created:
+        print(f"[KEYS] {created:,} clés créées dans '{table}'")
+    return created
+
+def ensure_from_query(conn, dimension, query, params=None):
+    """
+    Attribue les clés manquantes aux identifiants renvoyés par 'query' (une colonne),
+    exécutée sur conn. Seuls les identifiants inconnus transitent par le client.
+    """
+    table, _, natural_column = DIMENSIONS[dimension]
+    create_dimension_tables()
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT DISTINCT q.value FROM ({query}) AS q(value)
+            WHERE q.value IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM {table} d WHERE d.{natural_column} = q.value)
+        """, params)
+        missing = [row[0] for row in cur.fetchall()]
+    return ensure_keys(dimension, missing)
+
+def keyed_source(source, surrogates):
+    """
+    Sous-requête ajoutant à 'source' (table ou sous-requête de staging) les clés
+    demandées : surrogates = ((colonne_clé, dimension, colonne_naturelle), ...).
+    """
+    select = ['s.*']
+    joins = []
+    for i, (key_column, dimension, natural_column) in enumerate(surrogates):
+        table, dim_key, dim_natural = DIMENSIONS[dimension]
+        select.append(f"k{i}.{dim_key} AS {key_column}")
+        joins.append(f"LEFT JOIN {table} k{i} ON k{i}.{dim_natural} = s.{natural_column}")
+    return f"(SELECT {', '.join(select)} FROM {source} s {' '.join(joins)}) AS keyed"
+
+def ensure_for_stage(conn, source, surrogates):
+    """Attribue les clés manquantes pour toutes les colonnes naturelles d'un staging."""
+    for _, dimension, natural_column in surrogates:
+        ensure_from_query(conn, dimension, f"SELECT {natural_column} FROM {source} s")
+
+def key_subquery(dimension, placeholder='%s'):
+    """Sous-requête des clés correspondant à une liste d'identifiants naturels (paramètre placeholder)."""
+    table, key_column, natural_column = DIMENSIONS[dimension]
+    return f"SELECT {key_column} FROM {table} WHERE {natural_column} = ANY({placeholder}::text[])"
+
+def decklist_hash(decklist):
+    """
+    Clé de contenu d'une decklist (tuples du cache des tournois) : hash canonique
+    BIGINT signé du multiset trié (card_id, count), le count maximal étant retenu pour
+    une carte répétée. Retourne (hash, [(card_id, count), ...]), ou (None, []) si vide.
+    """
+    counts = {}
+    for card_id, _, _, count in decklist:
+        if card_id:
+            counts[card_id] = max(counts.get(card_id, count), count)
+    if not counts:
+        return None, []
+    cards = sorted(counts.items())
+    canonical = '\n'.join(f"{card_id}\t{count}" for card_id, count in cards)
+    digest = hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True), cards
@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+"""
+Chargeur générique COPY + MERGE partagé par toutes les étapes de Data_Transformation.
+
+Les lignes (tuples) sont envoyées en flux par COPY FROM STDIN, au format texte ou
+binaire, puis fusionnées dans la table cible selon une politique :
+- 'insert'     : insertion seule (COPY direct, ou ON CONFLICT DO NOTHING si une clé est donnée) ;
+- 'upsert'     : la dernière occurrence d'une clé l'emporte ;
+- 'upsert_max' : la plus grande valeur des colonnes max_columns est conservée.
+Les politiques avec clé passent par une table temporaire de staging et une seule
+instruction INSERT ... SELECT ... ON CONFLICT.
+
+parallel_load_rows répartit les lignes par hash d'une colonne entre plusieurs
+connexions, chacune exécutant son propre COPY dans sa table de staging, puis fusionne
+le tout en une instruction. Banc d'essai :
+    python loader.py --benchmark-parallel [nb_lignes]
+
+AdaptiveBatcher découpe les fichiers à traiter en lots dont la taille est ajustée à
+l'exécution (taille des lignes et débit mesurés) pour respecter un plafond mémoire
+(LOADER_MEMORY_MB) et une latence cible par lot (LOADER_BATCH_SECONDS).
+
+Avec surrogates=((colonne_clé, dimension, colonne_naturelle), ...), les clés entières
+(voir keys.py) sont attribuées aux identifiants inconnus du staging puis ajoutées aux
+lignes lors de la fusion : les lignes envoyées ne contiennent que les identifiants naturels.
+"""
+import sys
+import os
+import datetime
+import math
+import struct
+import time
+import zlib
+import queue
+import threading
+from collections import deque
+from db import get_conn
+import metrics
+import keys
+
+MERGE_POLICIES = ('insert', 'upsert', 'upsert_max')
+COPY_CHUNK_ROWS = 10000  # Nombre de lignes encodées à chaque lecture du flux COPY
+COPY_READ_SIZE = 1024 * 1024  # Taille des lectures de copy_expert dans le flux (octets ou caractères)
+MAX_PENDING_BATCHES = 8  # Lots de fichiers en vol au plus entre les workers et le flux COPY
+PARALLEL_COPY_CONNECTIONS = int(os.getenv("PARALLEL_COPY_CONNECTIONS", "1"))  # Connexions COPY parallèles (1 = désactivé)
+PARALLEL_QUEUE_CHUNKS = 4  # Morceaux en attente au plus par connexion (contre-pression)
+MEMORY_BUDGET_MB = int(os.getenv("LOADER_MEMORY_MB", "512"))  # Plafond mémoire des lots en vol
+TARGET_BATCH_SECONDS = float(os.getenv("LOADER_BATCH_SECONDS", "2.0"))  # Latence cible par lot
+BATCH_GROWTH_LIMIT = 4  # Facteur de variation maximal de la taille de lot d'une mesure à l'autre
+ROW_SIZE_SAMPLE = 50  # Lignes échantillonnées pour estimer la taille mémoire d'une ligne
+
+# Types PostgreSQL pris en charge par le format binaire
+_PG_EPOCH_DATE = datetime.date(2000, 1, 1)
+_PG_EPOCH = datetime.datetime(2000, 1, 1)
+_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_BINARY_TRAILER = struct.pack('!h', -1)
+
+class IteratorFile:
+    """
+    Objet fichier minimal (read) alimenté par un itérateur de morceaux str/bytes, lu par
+    copy_expert. Le morceau courant est lu par décalage : chaque lecture ne copie que
+    les données rendues, quelle que soit la taille des morceaux.
+    """
+
+    def __init__(self, chunks, empty):
+        self._chunks = iter(chunks)
+        self._chunk = empty
+        self._offset = 0
+        self._empty = empty
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self._offset >= len(self._chunk):
+                try:
+                    self._chunk, self._offset = next(self._chunks), 0
+                except StopIteration:
+                    break
+                continue
+            end = len(self._chunk) if size < 0 else self._offset + remaining
+            part = self._chunk[self._offset:end]
+            self._offset += len(part)
+            remaining -= len(part)
+            parts.append(part)
+        return self._empty.join(parts)
+
+def _is_null(value):
+    """None ou NaN (valeurs manquantes pandas), comme le fait DataFrame.to_sql."""
+    return value is None or (isinstance(value, float) and value != value)
+
+def _text_value(value):
+    """Encode une valeur pour le format texte de COPY."""
+    if _is_null(value):
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+def encode_text(rows, counter):
+    """Génère le flux COPY texte par morceaux de COPY_CHUNK_ROWS lignes."""
+    lines = []
+    for row in rows:
+        lines.append('\t'.join(map(_text_value, row)))
+        counter[0] += 1
+        if len(lines) >= COPY_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def _binary_encoder(pg_type):
+    """Retourne la fonction d'encodage binaire d'un type PostgreSQL (None si non supporté)."""
+    if pg_type == 'smallint':
+        return lambda v: struct.pack('!h', int(v))
+    if pg_type == 'integer':
+        return lambda v: struct.pack('!i', int(v))
+    if pg_type == 'bigint':
+        return lambda v: struct.pack('!q', int(v))
+    if pg_type == 'double precision':
+        return lambda v: struct.pack('!d', float(v))
+    if pg_type == 'boolean':
+        return lambda v: b'\x01' if v else b'\x00'
+    if pg_type in ('text', 'character varying') or pg_type.startswith('character varying('):
+        return lambda v: str(v).encode('utf-8')
+    if pg_type == 'date':
+        return lambda v: struct.pack('!i', (v - _PG_EPOCH_DATE).days)
+    if pg_type == 'timestamp without time zone':
+        def encode_timestamp(v):
+            delta = v - _PG_EPOCH
+            return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+        return encode_timestamp
+    return None
+
+def encode_binary(rows, encoders, counter):
+    """Génère le flux COPY binaire (en-tête, lignes, terminateur)."""
+    ncols = struct.pack('!h', len(encoders))
+    null = struct.pack('!i', -1)
+    parts = [_BINARY_HEADER]
+    for row in rows:
+        parts.append(ncols)
+        for encode, value in zip(encoders, row):
+            if _is_null(value):
+                parts.append(null)
+            else:
+                data = encode(value)
+                parts.append(struct.pack('!i', len(data)))
+                parts.append(data)
+        counter[0] += 1
+        if counter[0] % COPY_CHUNK_ROWS == 0:
+            yield b''.join(parts)
+            parts = []
+    parts.append(_BINARY_TRAILER)
+    yield b''.join(parts)
+
+def row_size(rows):
+    """Taille mémoire moyenne (octets) d'une ligne, estimée sur un échantillon."""
+    sample = rows[:ROW_SIZE_SAMPLE]
+    if not sample:
+        return 0
+    total = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample)
+    return total / len(sample)
+
+class AdaptiveBatcher:
+    """
+    Découpe 'items' (ex. noms de fichiers) en lots dont la taille est recalculée après
+    chaque lot consommé, à partir du coût mesuré d'un élément :
+    - latence : taille telle qu'un lot (traitement + insertion) dure target_seconds ;
+    - mémoire : les lots en vol (in_flight) tiennent dans memory_mb.
+    La plus petite des deux l'emporte ; chaque changement notable est journalisé.
+    """
+
+    def __init__(self, items, initial_size, label='lots', memory_mb=MEMORY_BUDGET_MB,
+                 target_seconds=TARGET_BATCH_SECONDS, in_flight=MAX_PENDING_BATCHES):
+        self.items = list(items)
+        self.size = max(1, int(initial_size))
+        self.label = label
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.target_seconds = target_seconds
+        self.in_flight = in_flight + 1  # Lots en attente + lot en cours d'insertion
+        self.position = 0
+        self.done = 0
+        self.sizes = []
+        self.seconds_per_item = None  # Moyennes lissées
+        self.bytes_per_item = None
+        self.limit = None
+
+    def __iter__(self):
+        """Génère les lots à la taille courante (relue à chaque lot)."""
+        while self.position < len(self.items):
+            batch = self.items[self.position:self.position + self.size]
+            self.position += len(batch)
+            self.sizes.append(len(batch))
+            yield batch
+
+    def _smooth(self, previous, value):
+        return value if previous is None else (previous + value) / 2
+
+    def record(self, nb_items, rows, seconds):
+        """Enregistre la mesure d'un lot (éléments, lignes produites, durée) et ajuste la taille."""
+        self.done += nb_items
+        if nb_items <= 0 or seconds <= 0:
+            return
+        nb_rows = len(rows) if rows else 0
+        self.seconds_per_item = self._smooth(self.seconds_per_item, seconds / nb_items)
+        self.bytes_per_item = self._smooth(self.bytes_per_item, nb_rows * row_size(rows or []) / nb_items)
+
+        by_latency = self.target_seconds / self.seconds_per_item
+        by_memory = self.memory_bytes / (self.in_flight * self.bytes_per_item) if self.bytes_per_item else math.inf
+        limit = 'latence' if by_latency <= by_memory else 'mémoire'
+        size = min(by_latency, by_memory, self.size * BATCH_GROWTH_LIMIT)
+        size = int(max(1, self.size / BATCH_GROWTH_LIMIT, size))
+
+        if abs(size - self.size) >= max(1, self.size * 0.2) or limit != self.limit:
+            print(f"[BATCH] {self.label} : {self.size} -> {size} par lot (limite {limit} ; "
+                  f"{self.seconds_per_item * 1000:.1f} ms et {self.bytes_per_item / 1024:.0f} Ko par élément, "
+                  f"{nb_rows / nb_items:.0f} lignes/élément)")
+            self.size = size
+            self.limit = limit
+
+    def summary(self):
+        if self.sizes:
+            print(f"[BATCH] {self.label} : {len(self.sizes)} lots, taille {min(self.sizes)} à "
+                  f"{max(self.sizes)} (finale {self.size}, plafond {self.memory_bytes // (1024 * 1024)} Mo, "
+                  f"cible {self.target_seconds:.1f}s)")
+
+def stream_batches(executor, func, batches, max_pending=MAX_PENDING_BATCHES, label='lots'):
+    """
+    Soumet func(lot) à l'exécuteur et génère les lignes produites, lot par lot, au fil
+    de la lecture du flux COPY. Au plus max_pending lots sont en vol : un nouveau lot
+    n'est soumis que lorsque le plus ancien a été consommé (contre-pression), la
+    mémoire reste donc bornée quel que soit le nombre de tournois.
+    Les compteurs des workers (temps CPU, JSON lus...) sont rattachés à l'étape courante.
+    Avec un AdaptiveBatcher, la durée de chaque lot (traitement dans le worker + insertion
+    de ses lignes) lui est transmise pour ajuster la taille des lots suivants.
+    """
+    batcher = batches if isinstance(batches, AdaptiveBatcher) else None
+    step = metrics.current_step()  # Sorties des workers capturées avec celles de l'étape
+    if batcher is None:
+        batches = list(batches)
+        total = len(batches)
+    else:
+        total = len(batcher.items)
+    source = iter(batches)
+    pending = deque()
+    exhausted = False
+    done = 0
+
+    while not exhausted or pending:
+        while not exhausted and len(pending) < max_pending:
+            batch = next(source, None)
+            if batch is None:
+                exhausted = True
+                break
+            pending.append((len(batch), executor.submit(metrics.measured, func, batch, step=step)))
+        if not pending:
+            break
+        nb_items, future = pending.popleft()
+        rows, counters = future.result()
+        metrics.merge(counters)
+        consume_start = time.perf_counter()
+        if rows:
+            yield from rows
+        if batcher is None:
+            done += 1
+        else:
+            batcher.record(nb_items, rows, counters.get('batch_time', 0.0) + time.perf_counter() - consume_start)
+            done = batcher.done
+        print(f"[STREAM] {done}/{total} {label} traités", end='\r')
+    print()
+    if batcher is not None:
+        batcher.summary()
+
+def column_types(conn, table, columns):
+    """Types PostgreSQL (format_type) des colonnes demandées d'une table."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+            FROM pg_attribute a
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        """, (table,))
+        types = dict(cur.fetchall())
+    return [types[column] for column in columns]
+
+def copy_rows(conn, table, columns, rows, fmt='text'):
+    """
+    Envoie les lignes dans 'table' par COPY FROM STDIN sans les matérialiser.
+    Retourne le nombre de lignes copiées.
+    """
+    counter = [0]
+    column_list = ', '.join(columns)
+
+    if fmt == 'binary':
+        encoders = [_binary_encoder(pg_type) for pg_type in column_types(conn, table, columns)]
+        if all(encoders):
+            stream = IteratorFile(encode_binary(rows, encoders, counter), b'')
+            sql = f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT binary)"
+        else:
+            print(f"[LOADER] Type non supporté en binaire pour '{table}', repli sur le format texte")
+            fmt = 'text'
+
+    if fmt == 'text':
+        stream = IteratorFile(encode_text(rows, counter), '')
+        sql = f"COPY {table} ({column_list}) FROM STDIN"
+
+    with conn.cursor() as cur:
+        cur.copy_expert(sql, stream, size=COPY_READ_SIZE)
+    return counter[0]
+
+def merge_sql(table, stage, columns, policy, key, max_columns=()):
+    """Construit l'instruction ensembliste de fusion staging -> table cible."""
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key or ())
+
+    if policy == 'insert' and not key:
+        return f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {stage}"
+    if policy == 'insert':
+        return (f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {stage} "
+                f"ON CONFLICT ({key_list}) DO NOTHING")
+
+    # Déduplication dans le staging : dernière occurrence ou valeur maximale
+    if policy == 'upsert_max':
+        order = ', '.join(f"{column} DESC NULLS LAST" for column in max_columns)
+    else:
+        order = '_ord DESC'
+
+    updates = []
+    for column in columns:
+        if column in key:
+            continue
+        if column in max_columns:
+            updates.append(f"{column} = GREATEST({table}.{column}, EXCLUDED.{column})")
+        else:
+            updates.append(f"{column} = EXCLUDED.{column}")
+    conflict = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+
+    return (f"INSERT INTO {table} ({column_list}) "
+            f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {stage} "
+            f"ORDER BY {key_list}, {order} "
+            f"ON CONFLICT ({key_list}) {conflict}")
+
+def keyed_merge_sql(conn, table, source, columns, policy, key, max_columns, surrogates):
+    """
+    Fusion staging -> cible ; avec des clés de substitution, attribue d'abord les clés
+    manquantes puis fusionne depuis le staging joint aux tables de dimension.
+    """
+    if not surrogates:
+        return merge_sql(table, source, columns, policy, key, max_columns)
+    keys.ensure_for_stage(conn, source, surrogates)
+    key_columns = [key_column for key_column, _, _ in surrogates]
+    return merge_sql(table, keys.keyed_source(source, surrogates), columns + key_columns,
+                     policy, key, max_columns)
+
+def load_rows(conn, table, columns, rows, policy='insert', key=None, max_columns=(), fmt='text',
+              surrogates=()):
+    """
+    Charge un itérable de tuples dans 'table' selon la politique de fusion demandée.
+    La transaction n'est pas validée : le commit reste à la charge de l'appelant.
+    Retourne le nombre de lignes envoyées et affiche le débit de la table.
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f"Politique de fusion inconnue : {policy}")
+    if policy != 'insert' and not key:
+        raise ValueError(f"La politique '{policy}' nécessite une clé")
+
+    start_time = time.time()
+    columns = list(columns)
+
+    if policy == 'insert' and not key and not surrogates:
+        # Insertion seule sans clé : COPY directement dans la cible
+        copied = copy_rows(conn, table, columns, rows, fmt)
+        merged = copied
+        metrics.add('rows_written', copied)
+    else:
+        stage = f"stage_{table.rsplit('.', 1)[-1]}"  # Table temporaire : nom sans schéma
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {stage}")
+            cur.execute(f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS "
+                        f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA")
+            cur.execute(f"ALTER TABLE {stage} ADD COLUMN _ord BIGSERIAL")
+        copied = copy_rows(conn, stage, columns, rows, fmt)
+        with conn.cursor() as cur:
+            cur.execute(keyed_merge_sql(conn, table, stage, columns, policy, key, max_columns, surrogates))
+            merged = cur.rowcount
+            cur.execute(f"DROP TABLE {stage}")
+
+    elapsed = time.time() - start_time
+    rate = copied / elapsed if elapsed > 0 else 0
+    print(f"[PERFORMANCE] {table} : {copied:,} lignes chargées ({merged:,} fusionnées) "
+          f"en {elapsed:.1f}s ({rate:,.0f} lignes/sec)")
+    return copied
+
+def _queue_chunks(chunk_queue):
+    """Vide une file de morceaux de lignes jusqu'au marqueur de fin (None)."""
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is None:
+            return
+        yield from chunk
+
+def _copy_worker(connect, stage, columns, chunk_queue, fmt, results, index):
+    """Thread COPY : une connexion dédiée alimente sa table de staging depuis sa file."""
+    try:
+        conn = connect()
+        try:
+            results[index] = copy_rows(conn, stage, columns, _queue_chunks(chunk_queue), fmt)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        results[index] = e
+        # Draine la file pour ne jamais bloquer le répartiteur
+        for _ in _queue_chunks(chunk_queue):
+            pass
+
+def _drop_stages(connect, stages):
+    """Supprime les tables de staging sur une connexion à part (chemins d'erreur de parallel_load_rows)."""
+    try:
+        drop_conn = connect()
+        try:
+            with drop_conn.cursor() as cur:
+                for stage in stages:
+                    cur.execute(f"DROP TABLE IF EXISTS {stage}")
+            drop_conn.commit()
+        finally:
+            drop_conn.close()
+    except Exception as e:
+        print(f"[LOADER] Suppression des tables de staging impossible : {e}")
+
+def parallel_load_rows(conn, connect, table, columns, rows, partition_column,
+                       workers=PARALLEL_COPY_CONNECTIONS, policy='insert', key=None,
+                       max_columns=(), fmt='text', surrogates=()):
+    """
+    Variante de load_rows sur plusieurs connexions : chaque ligne est routée par
+    crc32(partition_column) % workers vers une file bornée ; chaque worker ouvre sa
+    connexion (connect()) et exécute son COPY dans sa propre table UNLOGGED de staging.
+    Les stagings sont ensuite fusionnés dans 'table' en une instruction sur 'conn',
+    sans commit (à la charge de l'appelant, comme load_rows).
+    Avec une clé, partition_column doit en faire partie pour que l'ordre d'arrivée
+    d'une même clé soit conservé dans un seul staging.
+    Sur tous les chemins (erreur du producteur, d'un worker ou de la fusion), les
+    workers sont arrêtés et attendus, et les tables de staging supprimées.
+    """
+    if workers <= 1:
+        return load_rows(conn, table, columns, rows, policy, key, max_columns, fmt, surrogates)
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f"Politique de fusion inconnue : {policy}")
+    if policy != 'insert' and not key:
+        raise ValueError(f"La politique '{policy}' nécessite une clé")
+
+    start_time = time.time()
+    columns = list(columns)
+    column_list = ', '.join(columns)
+    partition_index = columns.index(partition_column)
+    stages = [f"{table}_copy_stage_{i}" for i in range(workers)]
+
+    # Les stagings sont créés et validés sur une connexion à part : la transaction de
+    # l'appelant (ex. DELETE du mode incrémental) reste ouverte jusqu'à la fusion
+    setup_conn = connect()
+    try:
+        with setup_conn.cursor() as cur:
+            for stage in stages:
+                cur.execute(f"DROP TABLE IF EXISTS {stage}")
+                cur.execute(f"CREATE UNLOGGED TABLE {stage} AS "
+                            f"SELECT {column_list} FROM {table} WITH NO DATA")
+                cur.execute(f"ALTER TABLE {stage} ADD COLUMN _ord BIGSERIAL")
+        setup_conn.commit()
+    finally:
+        setup_conn.close()
+
+    dropped = False
+    try:
+        queues = [queue.Queue(maxsize=PARALLEL_QUEUE_CHUNKS) for _ in range(workers)]
+        results = [0] * workers
+        threads = []
+        try:
+            for i in range(workers):
+                thread = threading.Thread(target=metrics.bind(_copy_worker),
+                                          args=(connect, stages[i], columns, queues[i], fmt, results, i))
+                thread.start()
+                threads.append(thread)
+
+            # Répartition : put() bloque quand la file d'un worker est pleine
+            # (un worker en échec draine sa file, le répartiteur n'est jamais bloqué)
+            buffers = [[] for _ in range(workers)]
+            for row in rows:
+                value = row[partition_index]
+                target = zlib.crc32(str(value).encode('utf-8')) % workers
+                buffers[target].append(row)
+                if len(buffers[target]) >= COPY_CHUNK_ROWS:
+                    queues[target].put(buffers[target])
+                    buffers[target] = []
+            for i in range(workers):
+                if buffers[i]:
+                    queues[i].put(buffers[i])
+        finally:
+            # Marqueur de fin pour chaque worker démarré, même si le producteur a échoué
+            for i in range(len(threads)):
+                queues[i].put(None)
+            for thread in threads:
+                thread.join()
+
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+        copy_elapsed = time.time() - start_time
+
+        # Fusion dans un point de sauvegarde : en cas d'échec, les verrous pris sur les
+        # stagings sont relâchés et leur suppression (autre connexion) n'attend pas
+        with conn.cursor() as cur:
+            union = ' UNION ALL '.join(f"SELECT {column_list}, _ord FROM {stage}" for stage in stages)
+            source = f"({union})" if surrogates else f"({union}) AS parallel_stage"
+            cur.execute("SAVEPOINT parallel_merge")
+            try:
+                cur.execute(keyed_merge_sql(conn, table, source, columns, policy, key, max_columns, surrogates))
+            except Exception:
+                cur.execute("ROLLBACK TO SAVEPOINT parallel_merge")
+                raise
+            merged = cur.rowcount
+            cur.execute("RELEASE SAVEPOINT parallel_merge")
+            for stage in stages:
+                cur.execute(f"DROP TABLE IF EXISTS {stage}")
+        dropped = True
+    finally:
+        if not dropped:
+            _drop_stages(connect, stages)
+
+    copied = sum(results)
+    elapsed = time.time() - start_time
+    rate = copied / elapsed if elapsed > 0 else 0
+    print(f"[PERFORMANCE] {table} : {copied:,} lignes chargées sur {workers} connexions "
+          f"({merged:,} fusionnées) en {elapsed:.1f}s dont COPY {copy_elapsed:.1f}s ({rate:,.0f} lignes/sec)")
+    return copied
+
+def benchmark_parallel(nb_rows=2000000, connection_counts=(1, 2, 4, 8)):
+    """
+    Compare load_rows (1 connexion) et parallel_load_rows (2, 4, 8 connexions) sur des
+    lignes synthétiques au format deck_card, dans une table jetable.
+    """
+    def synthetic_rows():
+        for i in range(nb_rows):
+            deck_id = f"player{i // 20}_tour{i // 400:05d}"
+            yield (deck_id, f"tour{i // 400:05d}", f"https://pocket.limitlesstcg.com/cards/A1/{i % 286}", '', 1 + i % 2)
+
+    columns = ('deck_id', 'tournament_id', 'card_id', 'card_name', 'count')
+    conn = get_conn()
+    timings = {}
+    for workers in connection_counts:
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS loader_benchmark")
+            cur.execute("CREATE UNLOGGED TABLE loader_benchmark "
+                        "(deck_id TEXT, tournament_id TEXT, card_id TEXT, card_name TEXT, count INT)")
+        conn.commit()
+
+        start_time = time.time()
+        parallel_load_rows(conn, get_conn, 'loader_benchmark', columns, synthetic_rows(), 'deck_id', workers=workers)
+        conn.commit()
+        timings[workers] = time.time() - start_time
+
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS loader_benchmark")
+    conn.commit()
+    conn.close()
+
+    print(f"\n[BENCHMARK] {nb_rows:,} lignes")
+    for workers, elapsed in timings.items():
+        speedup = timings[connection_counts[0]] / elapsed if elapsed > 0 else 0
+        print(f"[BENCHMARK] {workers} connexion(s) : {elapsed:.2f}s | "
+              f"{nb_rows / elapsed:,.0f} lignes/sec | x{speedup:.2f}")
+    return timings
+
+if __name__ == '__main__':
+    if '--benchmark-parallel' in sys.argv:
+        args = [arg for arg in sys.argv[1:] if arg.isdigit()]
+        benchmark_parallel(int(args[0]) if args else 2000000)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Compteurs de performance par étape du pipeline (rapport de run, voir run_report.py).
+
+Chaque thread est associé à une étape (set_current_step) ; add() cumule un compteur
+pour l'étape du thread courant : temps SQL et lignes lues/écrites (curseur de db.py),
+fichiers JSON lus et temps de décodage (tournament_cache.py), temps CPU des workers.
+
+Les tâches confiées à un pool de threads passent par bind() pour rester rattachées à
+l'étape ; celles confiées à un pool de processus passent par measured(), qui renvoie
+les compteurs du worker avec le résultat (fusionnés ensuite par merge()).
+
+Lancée en sous-processus par Exe.py (PIPELINE_LAUNCH_TIME défini), l'étape affiche en
+sortie une ligne [METRICS] (JSON) avec ses compteurs, son temps CPU et sa mémoire pic.
+"""
+import os
+import sys
+import json
+import atexit
+import threading
+import time
+import functools
+import multiprocessing
+from contextlib import contextmanager
+
+try:
+    import resource  # Absent sous Windows : la mémoire pic n'est alors pas mesurée
+except ImportError:
+    resource = None
+
+# Compteurs dont on garde le maximum (et non la somme) lors des fusions
+MAX_COUNTERS = ('peak_rss',)
+
+_lock = threading.Lock()
+_local = threading.local()
+step_metrics = {}  # {étape: {compteur: valeur}}
+
+def set_current_step(step):
+    """Associe le thread courant à une étape."""
+    _local.step = step
+
+def current_step():
+    return getattr(_local, 'step', None)
+
+def _accumulate(counters, key, value):
+    if key in MAX_COUNTERS:
+        counters[key] = max(counters.get(key) or 0, value or 0)
+    else:
+        counters[key] = counters.get(key, 0) + value
+
+def add(key, value=1):
+    """Ajoute value au compteur key de l'étape courante (ou du worker en cours de mesure)."""
+    capture = getattr(_local, 'capture', None)
+    if capture is not None:
+        _accumulate(capture, key, value)
+        return
+    with _lock:
+        _accumulate(step_metrics.setdefault(current_step(), {}), key, value)
+
+def merge(counters):
+    """Fusionne les compteurs renvoyés par un worker dans l'étape courante."""
+    for key, value in (counters or {}).items():
+        add(key, value)
+
+def pop_step(step):
+    """Retire et retourne les compteurs d'une étape."""
+    with _lock:
+        return step_metrics.pop(step, {})
+
+@contextmanager
+def timed(key):
+    """Cumule la durée du bloc dans le compteur key."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(key, time.perf_counter() - start_time)
+
+def peak_rss():
+    """Mémoire résidente pic du processus courant, en octets (None sans module resource)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _run_in_step(step, func, *args, **kwargs):
+    """Exécute func dans un thread de pool, rattaché à l'étape step (temps CPU compris)."""
+    previous = current_step()
+    set_current_step(step)
+    start_cpu = time.thread_time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        add('cpu_time', time.thread_time() - start_cpu)
+        set_current_step(previous)
+
+def bind(func):
+    """Retourne func rattachée à l'étape courante, pour un ThreadPoolExecutor ou un Thread."""
+    return functools.partial(_run_in_step, current_step(), func)
+
+def measured(func, *args, step=None):
+    """
+    Exécute func(*args) en capturant ses compteurs (temps CPU, durée et mémoire pic compris).
+    Retourne (résultat, compteurs) : utilisable dans un worker de ProcessPoolExecutor.
+    Avec step, le worker est rattaché à l'étape le temps de l'appel (sorties capturées
+    par le runner en processus unique).
+    """
+    previous = current_step()
+    if step is not None:
+        set_current_step(step)
+    _local.capture = {}
+    start_time = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+        result = func(*args)
+    finally:
+        counters, _local.capture = _local.capture, None
+        set_current_step(previous)
+    _accumulate(counters, 'batch_time', time.perf_counter() - start_time)
+    _accumulate(counters, 'cpu_time', time.thread_time() - start_cpu)
+    _accumulate(counters, 'peak_rss', peak_rss())
+    return result, counters
+
+def process_metrics():
+    """Compteurs cumulés du processus : temps CPU (enfants compris) et mémoire pic."""
+    with _lock:
+        totals = {}
+        for counters in step_metrics.values():
+            for key, value in counters.items():
+                _accumulate(totals, key, value)
+    times = os.times()
+    totals['cpu_time'] = times.user + times.system + times.children_user + times.children_system
+    peak = peak_rss()
+    if peak is not None and resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak = max(peak, children if sys.platform == 'darwin' else children * 1024)
+    _accumulate(totals, 'peak_rss', peak)
+    return totals
+
+def _report_subprocess_metrics():
+    """Ligne [METRICS] lue par Exe.py en mode sous-processus."""
+    print(f"[METRICS] {json.dumps(process_metrics())}")
+
+if (os.getenv("PIPELINE_LAUNCH_TIME") and __name__ != '__main__'
+        and multiprocessing.parent_process() is None):
+    atexit.register(_report_subprocess_metrics)
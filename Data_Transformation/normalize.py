@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Normalisation de texte partagée (identifiants, URLs de cartes, noms).
+
+Les mêmes quelques milliers d'identifiants de joueurs, d'URLs et de noms de cartes
+reviennent des millions de fois : chaque fonction est mémoïsée par un cache LRU borné
+(NORMALIZE_CACHE_SIZE entrées) et ses regex sont compilées une fois. Les résultats sont
+internés (sys.intern) : une même valeur nettoyée est un seul objet en mémoire, partagé
+par toutes les lignes (et stocké une seule fois par pickle dans le cache des tournois).
+
+Le résultat de chaque fonction est identique à celui de l'implémentation qu'elle
+remplace dans les étapes.
+
+Utilisation en ligne de commande :
+    python normalize.py --benchmark   # implémentations d'origine contre version mémoïsée
+"""
+import os
+import re
+import sys
+import time
+import functools
+
+CACHE_SIZE = int(os.getenv("NORMALIZE_CACHE_SIZE", "65536"))  # Entrées par fonction
+
+# Regex compilées une fois
+NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7F]')
+NON_ASCII_RUN_PATTERN = re.compile(r'[^\x00-\x7F]+')
+URL_INVALID_PATTERN = re.compile(r'[^\w\-\./:?=&]')
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _remove_non_ascii(text):
+    return sys.intern(NON_ASCII_PATTERN.sub(' ', text).strip())
+
+def remove_non_ascii(text):
+    """Remplace chaque caractère non-ASCII par un espace. Retourne '' pour une valeur vide."""
+    if not text:
+        return ''
+    return _remove_non_ascii(str(text))
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _clean_url(url):
+    return sys.intern(URL_INVALID_PATTERN.sub('', url).strip())
+
+def clean_url(url):
+    """Nettoie une URL en conservant uniquement les caractères valides. Retourne '' pour une valeur vide."""
+    if not url:
+        return ''
+    try:
+        return _clean_url(str(url))
+    except Exception:
+        return ''
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _clean_text(text):
+    return sys.intern(NON_ASCII_RUN_PATTERN.sub(' ', text).strip())
+
+def clean_text(text):
+    """Remplace chaque suite de caractères non-ASCII par un espace. Retourne None pour une valeur vide."""
+    if not text:
+        return None
+    return _clean_text(text)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _strip_non_ascii(text):
+    return sys.intern(text.encode('ascii', 'ignore').decode('ascii').strip())
+
+def strip_non_ascii(text):
+    """Supprime les caractères non-ASCII. Retourne None pour une valeur vide."""
+    return _strip_non_ascii(text) if text else None
+
+def cache_info():
+    """Statistiques des caches LRU : {fonction: (succès, échecs, taille)}."""
+    caches = {
+        'remove_non_ascii': _remove_non_ascii,
+        'clean_url': _clean_url,
+        'clean_text': _clean_text,
+        'strip_non_ascii': _strip_non_ascii,
+    }
+    return {name: (f.cache_info().hits, f.cache_info().misses, f.cache_info().currsize) for name, f in caches.items()}
+
+def cache_clear():
+    """Vide les caches LRU (les chaînes internées restent partagées tant qu'elles sont référencées)."""
+    for f in (_remove_non_ascii, _clean_url, _clean_text, _strip_non_ascii):
+        f.cache_clear()
+
+def _sample_values(json_folder, max_files):
+    """Valeurs textuelles brutes des tournois (ids, URLs, noms), dans l'ordre de lecture des étapes."""
+    import json
+    from tournament_cache import parse_json_bytes
+
+    values = []
+    for filename in sorted(os.listdir(json_folder))[:max_files]:
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(json_folder, filename), 'rb') as f:
+            data = parse_json_bytes(f.read())
+        if not isinstance(data, dict):
+            continue
+        for player in data.get('players') or []:
+            values.extend((player.get('id'), player.get('name'), player.get('country')))
+            for card in player.get('decklist') or []:
+                values.extend((card.get('url'), card.get('name'), card.get('type')))
+        for match in data.get('matches') or []:
+            for result in match.get('match_results') or []:
+                values.append(result.get('player_id'))
+    return values
+
+def benchmark(json_folder=None, max_files=1000, repeat=3):
+    """
+    Compare les implémentations d'origine des étapes (regex recompilée à chaque appel,
+    nouvelle chaîne par ligne) à la version mémoïsée et internée, sur les valeurs des
+    fichiers JSON : temps CPU, mémoire des résultats conservés et identité des sorties.
+    """
+    import tracemalloc
+
+    json_folder = json_folder or os.getenv("JSON_FOLDER")
+    values = _sample_values(json_folder, max_files)
+
+    # Implémentations d'origine (03/04 et cache des tournois, 05, 07, 06)
+    def legacy_remove_non_ascii(text):
+        return re.sub(r'[^\x00-\x7F]', ' ', str(text)).strip() if text else ''
+
+    def legacy_clean_url(url):
+        return re.sub(r'[^\w\-\./:?=&]', '', str(url)).strip() if url else ''
+
+    def legacy_clean_text(text):
+        return re.sub(r'[^\x00-\x7F]+', ' ', text).strip() if text else None
+
+    def legacy_strip_non_ascii(text):
+        return text.encode('ascii', 'ignore').decode('ascii').strip() if text else None
+
+    pairs = (
+        ('remove_non_ascii', legacy_remove_non_ascii, remove_non_ascii, values),
+        ('clean_url', legacy_clean_url, clean_url, values),
+        ('clean_text', legacy_clean_text, clean_text, [v for v in values if isinstance(v, str)]),
+        ('strip_non_ascii', legacy_strip_non_ascii, strip_non_ascii, [v for v in values if isinstance(v, str)]),
+    )
+    print(f"[BENCHMARK] {len(values):,} valeurs ({len(set(map(str, values))):,} distinctes), "
+          f"cache LRU {CACHE_SIZE:,} entrées")
+    identical = True
+    for name, legacy, cached, inputs in pairs:
+        timings = []
+        for function in (legacy, cached):
+            cache_clear()
+            best = float('inf')
+            for _ in range(repeat):
+                start_time = time.process_time()
+                for value in inputs:
+                    function(value)
+                best = min(best, time.process_time() - start_time)
+            # Mémoire des résultats conservés (une ligne par valeur, cache déjà chaud)
+            tracemalloc.start()
+            kept = [function(value) for value in inputs]
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            timings.append((best, memory, kept))
+        (legacy_time, legacy_memory, legacy_out), (cached_time, cached_memory, cached_out) = timings
+        same = legacy_out == cached_out
+        identical &= same
+        print(f"[BENCHMARK] {name:17s} CPU {legacy_time:.3f}s -> {cached_time:.3f}s "
+              f"(x{legacy_time / max(cached_time, 1e-9):.1f}) | mémoire {legacy_memory / 1024:,.0f} Ko -> "
+              f"{cached_memory / 1024:,.0f} Ko | {'sorties identiques' if same else 'SORTIES DIFFÉRENTES'}")
+    return identical
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--benchmark']:
+        sys.exit(0 if benchmark() else 1)
+    print("Usage : python normalize.py --benchmark")
+    sys.exit(1)
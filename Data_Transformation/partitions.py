@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Partitionnement déclaratif des tables de faits par époque d'extension.
+
+participation, deck, match et deck_match sont partitionnées par liste sur
+extension_epoch (epochs.py) : une partition '<table>_e<epoch_id>' par ère de format,
+plus '<table>_default' pour les lignes sans époque. ensure_partitions() crée les
+partitions manquantes avant chaque chargement (nouvelle extension comprise) ; les
+index créés sur la table parente le sont sur chaque partition.
+
+Les requêtes filtrées sur extension_epoch (ère courante, ères récentes) ne lisent que
+les partitions concernées. deck_card, vue sur deck et decklist, en profite par deck.
+
+Une contrainte unique d'une table partitionnée inclut la clé de partition : les clés
+primaires deviennent des index uniques (clé, extension_epoch). Les tables fantômes
+(shadow.py) sont partitionnées de la même façon et basculées avec leurs partitions.
+
+Utilisation en ligne de commande :
+    python partitions.py --list deck            # partitions et nombre de lignes
+    python partitions.py --detach deck 1        # sort une ère de la table (table autonome)
+    python partitions.py --attach deck 1        # la réintègre
+    python partitions.py --check-pruning        # plans : élagage sur les filtres courants
+"""
+import json
+import sys
+from db import get_conn
+from shadow import SHADOW_SUFFIX
+
+PARTITION_KEY = "extension_epoch"
+PARTITIONED_TABLES = ("participation", "deck", "match", "deck_match")
+PARTITION_CLAUSE = f"PARTITION BY LIST ({PARTITION_KEY})"
+
+def partition_name(table, epoch_id=None):
+    """Nom de la partition d'une époque (partition par défaut si epoch_id est None)."""
+    return f"{table}_default" if epoch_id is None else f"{table}_e{epoch_id}"
+
+def is_partitioned(conn, table):
+    """Indique si 'table' est une table partitionnée."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = cur.fetchone()
+    return bool(row and row[0])
+
+def list_partitions(conn, table):
+    """Partitions attachées : [(nom, bornes)], triées par nom."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            ORDER BY c.relname
+        """, (table,))
+        return cur.fetchall()
+
+def _epoch_ids(cur):
+    """Époques connues (table extension_epoch), liste vide si elle n'existe pas encore."""
+    cur.execute("SELECT to_regclass('extension_epoch') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return []
+    cur.execute("SELECT epoch_id FROM extension_epoch ORDER BY epoch_id")
+    return [row[0] for row in cur.fetchall()]
+
+def ensure_partitions(conn, table):
+    """
+    Crée les partitions manquantes de 'table' : une par époque de extension_epoch et la
+    partition par défaut. Une partition détachée (--detach) n'est pas recréée tant que
+    sa table existe, ni dans la table fantôme : les lignes de cette ère vont alors dans
+    la partition par défaut. Retourne le nombre de partitions créées.
+    """
+    base = table[:-len(SHADOW_SUFFIX)] if table.endswith(SHADOW_SUFFIX) else table
+    created = 0
+    with conn.cursor() as cur:
+        existing = {name for name, _ in list_partitions(conn, table)}
+        for epoch_id in _epoch_ids(cur):
+            name = partition_name(table, epoch_id)
+            cur.execute("""
+                SELECT EXISTS (SELECT 1 FROM pg_class
+                               WHERE oid IN (to_regclass(%s), to_regclass(%s)) AND NOT relispartition)
+            """, (name, partition_name(base, epoch_id)))
+            if name not in existing and not cur.fetchone()[0]:
+                cur.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES IN ({int(epoch_id)})")
+                created += 1
+        default = partition_name(table)
+        if default not in existing:
+            cur.execute(f"CREATE TABLE {default} PARTITION OF {table} DEFAULT")
+            created += 1
+    conn.commit()
+    if created:
+        print(f"[PARTITION] {created} partition(s) créée(s) pour '{table}'")
+    return created
+
+def detach_partition(conn, table, epoch_id):
+    """Détache la partition d'une époque : elle devient une table autonome, ignorée des requêtes sur 'table'."""
+    name = partition_name(table, epoch_id)
+    with conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+    conn.commit()
+    print(f"[PARTITION] '{name}' détachée de '{table}'")
+    return name
+
+def attach_partition(conn, table, epoch_id, source=None):
+    """
+    Attache 'source' (par défaut la partition détachée de l'époque) comme partition
+    de l'époque : une ère rechargée à part est mise en service sans réécrire le reste.
+    """
+    name = partition_name(table, epoch_id)
+    source = source or name
+    with conn.cursor() as cur:
+        if source != name:
+            cur.execute(f"ALTER TABLE {source} RENAME TO {name}")
+        cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES IN ({int(epoch_id)})")
+    conn.commit()
+    print(f"[PARTITION] '{name}' attachée à '{table}'")
+    return name
+
+def _scanned_relations(plan):
+    """Relations réellement lues dans un plan EXPLAIN ANALYZE (format JSON)."""
+    scanned = set()
+    if plan.get('Relation Name') and plan.get('Actual Loops', 0) > 0:
+        scanned.add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        scanned |= _scanned_relations(child)
+    return scanned
+
+def check_pruning(conn):
+    """
+    Vérifie l'élagage des partitions sur les filtres courants des tableaux de bord
+    (ère courante, ère fixée, ères des 30 derniers jours) : seules les partitions des
+    époques visées doivent être lues (plus la partition par défaut pour un filtre
+    d'intervalle, qui peut viser des époques sans partition). Retourne True si tous les
+    plans sont élagués.
+    """
+    ok = True
+    with conn.cursor() as cur:
+        epoch_ids = _epoch_ids(cur)
+        if not epoch_ids:
+            print("[ATTENTION] Aucune époque d'extension : élagage non vérifiable")
+            return False
+        # {key} : colonne filtrée (extension_epoch de la table, ou epoch_id pour les époques attendues)
+        # et lecture attendue de la partition par défaut
+        filters = {
+            "ère courante": ("{key} = (SELECT max(epoch_id) FROM extension_epoch)", False),
+            "ère fixée": (f"{{key}} = {int(epoch_ids[-1])}", False),
+            "30 derniers jours": ("{key} >= (SELECT epoch_id FROM extension_epoch "
+                                  "WHERE validity @> (current_date - 30))", True),
+        }
+        for table in PARTITIONED_TABLES + ('deck_card',):
+            parent = 'deck' if table == 'deck_card' else table
+            partitions = {name for name, _ in list_partitions(conn, parent)}
+            for label, (condition, with_default) in filters.items():
+                cur.execute(f"SELECT epoch_id FROM extension_epoch x WHERE {condition.format(key='x.epoch_id')}")
+                expected = {partition_name(parent, row[0]) for row in cur.fetchall()}
+                if with_default:
+                    expected.add(partition_name(parent))
+                cur.execute(f"EXPLAIN (ANALYZE, TIMING OFF, FORMAT JSON) "
+                            f"SELECT count(*) FROM {table} WHERE {condition.format(key=PARTITION_KEY)}")
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scanned = _scanned_relations(plan[0]['Plan']) & partitions
+                pruned = scanned <= expected
+                ok &= pruned
+                print(f"[{'OK' if pruned else 'ERREUR'}] {table} / {label} : "
+                      f"{len(scanned)}/{len(partitions)} partition(s) lue(s) {sorted(scanned)}")
+    conn.rollback()
+    return ok
+
+if __name__ == '__main__':
+    connection = get_conn()
+    args = sys.argv[1:]
+    if args[:1] == ['--check-pruning']:
+        result = check_pruning(connection)
+        connection.close()
+        sys.exit(0 if result else 1)
+    elif len(args) == 2 and args[0] == '--list':
+        with connection.cursor() as cursor:
+            for partition, bound in list_partitions(connection, args[1]):
+                cursor.execute(f"SELECT count(*) FROM {partition}")
+                print(f"{partition:40s} {bound:30s} {cursor.fetchone()[0]:>12,}")
+    elif len(args) == 3 and args[0] in ('--detach', '--attach'):
+        action = detach_partition if args[0] == '--detach' else attach_partition
+        action(connection, args[1], int(args[2]))
+    else:
+        print("Usage : python partitions.py --list|--detach|--attach <table> [epoch_id] | --check-pruning")
+        connection.close()
+        sys.exit(1)
+    connection.close()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Empreintes des étapes du pipeline (à la manière de make).
+
+L'empreinte d'une étape combine le hash de son script (et des modules partagés), l'état
+du dossier JSON (nom, mtime, taille de chaque fichier), le mtime du fichier Excel et la
+version des tables amont. Elle est enregistrée dans 'pipeline_state' après chaque
+exécution réussie, avec une nouvelle version pour les tables produites : une étape
+dont l'empreinte n'a pas changé et dont les tables existent est sautée ; une étape
+relancée (même forcée) invalide donc toutes ses étapes aval.
+"""
+import os
+import json
+import hashlib
+import time
+
+STATE_TABLE = "pipeline_state"
+# Modules partagés dont une modification invalide toutes les étapes
+COMMON_SOURCES = ("db.py", "loader.py", "tournament_cache.py", "incremental.py", "keys.py", "epochs.py",
+                  "partitions.py", "normalize.py", "shadow.py", "metrics.py")
+JSON_INPUT = "json"    # Pseudo-table : dossier des fichiers JSON de tournois
+EXCEL_INPUT = "excel"  # Pseudo-table : fichier Excel des extensions
+
+_source_hashes = {}
+
+def create_state_table(conn):
+    """Crée la table d'état si elle n'existe pas."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                step TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                version TEXT,
+                components TEXT,
+                duration DOUBLE PRECISION,
+                updated_at TIMESTAMP DEFAULT now()
+            );
+        """)
+    conn.commit()
+
+def load_state(conn):
+    """Retourne {étape: (empreinte, version)}."""
+    create_state_table(conn)
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT step, fingerprint, version FROM {STATE_TABLE}")
+        return {step: (fingerprint, version) for step, fingerprint, version in cur.fetchall()}
+
+def save_step(conn, step, fingerprint, components, duration):
+    """Enregistre l'exécution réussie d'une étape ; retourne la nouvelle version de ses tables."""
+    version = hashlib.sha1(f"{fingerprint}:{time.time()!r}".encode('utf-8')).hexdigest()
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {STATE_TABLE} (step, fingerprint, version, components, duration, updated_at)
+            VALUES (%s, %s, %s, %s, %s, now())
+            ON CONFLICT (step) DO UPDATE SET
+                fingerprint = EXCLUDED.fingerprint,
+                version = EXCLUDED.version,
+                components = EXCLUDED.components,
+                duration = EXCLUDED.duration,
+                updated_at = EXCLUDED.updated_at
+        """, (step, fingerprint, version, json.dumps(components, sort_keys=True), duration))
+    conn.commit()
+    return version
+
+def file_hash(path):
+    """SHA-1 du contenu d'un fichier (mis en cache pour la durée du processus)."""
+    if path not in _source_hashes:
+        try:
+            with open(path, 'rb') as f:
+                _source_hashes[path] = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            _source_hashes[path] = None
+    return _source_hashes[path]
+
+def json_folder_fingerprint(json_folder):
+    """Empreinte du dossier JSON à partir du nom, du mtime et de la taille de chaque fichier."""
+    digest = hashlib.sha1()
+    try:
+        entries = sorted(
+            (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+            for entry in os.scandir(json_folder) if entry.name.endswith('.json')
+        )
+    except OSError:
+        entries = []
+    for name, mtime_ns, size in entries:
+        digest.update(f"{name}:{mtime_ns}:{size}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def file_stamp(path):
+    """mtime et taille d'un fichier (None s'il est absent)."""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+def step_fingerprint(step, table_versions, json_fingerprint, path_excel):
+    """
+    Calcule l'empreinte d'une étape déclarée dans Exe.STEPS.
+    table_versions : {table: version} des tables produites par les étapes amont.
+    Retourne (empreinte, composantes).
+    """
+    base = os.path.dirname(os.path.abspath(step["script"]))
+    components = {
+        "source": file_hash(os.path.abspath(step["script"])),
+        "common": [file_hash(os.path.join(base, name)) for name in COMMON_SOURCES],
+    }
+    for table in step["inputs"]:
+        if table == JSON_INPUT:
+            components[table] = json_fingerprint
+        elif table == EXCEL_INPUT:
+            components[table] = file_stamp(path_excel)
+        else:
+            components[table] = table_versions.get(table)
+    fingerprint = hashlib.sha1(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+    return fingerprint, components
+
+def outputs_exist(conn, tables):
+    """Vérifie que toutes les tables produites par une étape existent encore."""
+    with conn.cursor() as cur:
+        for table in tables:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+            if not cur.fetchone()[0]:
+                return False
+    return True
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Rapport de run du pipeline et historique des performances.
+
+Pour chaque étape exécutée : durée, temps CPU, mémoire pic, lignes lues et écrites,
+temps SQL, fichiers JSON lus et temps de décodage (compteurs de metrics.py). Le rapport
+est écrit en JSON dans REPORT_DIR et enregistré dans la table 'pipeline_runs' (une ligne
+par étape, plus une ligne TOTAL_STEP pour le pipeline complet).
+
+La comparaison signale les étapes dont une mesure dépasse de plus de X % la médiane
+des N derniers runs réussis du même mode (full / incremental) et du même runner :
+    python run_report.py --compare [--threshold 20] [--last 5] [--run-id ID]
+
+En mode processus unique, la mémoire pic est celle du processus du runner (partagée par
+les étapes simultanées) ou de ses workers ; elle n'est pas mesurée sous Windows.
+"""
+import os
+import sys
+import json
+import argparse
+import datetime
+import statistics
+import db
+
+RUNS_TABLE = "pipeline_runs"
+REPORT_DIR = os.getenv(
+    "PIPELINE_REPORT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports")
+)
+TOTAL_STEP = "TOTAL"
+METRICS = ('wall_time', 'cpu_time', 'peak_rss_mb', 'rows_read', 'rows_written',
+           'db_time', 'json_parse_time', 'json_files')
+# Mesures comparées et écart absolu minimal pour signaler une régression (bruit)
+COMPARED_METRICS = {'wall_time': 0.5, 'cpu_time': 0.5, 'db_time': 0.5, 'peak_rss_mb': 50}
+REGRESSION_THRESHOLD = float(os.getenv("PIPELINE_REGRESSION_THRESHOLD", "20"))  # En %
+HISTORY_RUNS = int(os.getenv("PIPELINE_HISTORY_RUNS", "5"))  # Runs de référence
+
+def step_report(step, status, wall_time, counters):
+    """Construit la ligne de rapport d'une étape à partir de ses compteurs."""
+    peak = counters.get('peak_rss')
+    return {
+        'step': step,
+        'status': status,
+        'wall_time': round(wall_time, 3),
+        'cpu_time': round(counters.get('cpu_time', 0.0), 3),
+        'peak_rss_mb': round(peak / (1024 * 1024), 1) if peak else None,
+        'rows_read': int(counters.get('rows_read', 0)),
+        'rows_written': int(counters.get('rows_written', 0)),
+        'db_time': round(counters.get('db_time', 0.0), 3),
+        'json_parse_time': round(counters.get('json_parse_time', 0.0), 3),
+        'json_files': int(counters.get('json_files', 0)),
+        'cache_hits': int(counters.get('cache_hits', 0)),
+    }
+
+def new_run(mode, runner, workers):
+    """En-tête d'un run (les étapes sont ajoutées au fil de l'exécution)."""
+    started_at = datetime.datetime.now()
+    return {
+        'run_id': started_at.strftime("%Y%m%d_%H%M%S_%f"),
+        'started_at': started_at.isoformat(),
+        'mode': mode,
+        'runner': runner,
+        'workers': workers,
+        'success': None,
+        'steps': [],
+    }
+
+def finish_run(run, success, total_duration):
+    """Complète le run avec son statut et une ligne TOTAL (sommes et maxima des étapes)."""
+    run['success'] = success
+    steps = [step for step in run['steps'] if step['status'] == 'ok']
+    total = {'step': TOTAL_STEP, 'status': 'ok' if success else 'failed',
+             'wall_time': round(total_duration, 3)}
+    for metric in METRICS[1:]:
+        values = [step[metric] for step in steps if step[metric] is not None]
+        if metric == 'peak_rss_mb':
+            total[metric] = max(values, default=None)
+        else:
+            total[metric] = round(sum(values), 3) if values else 0
+    total['cache_hits'] = sum(step.get('cache_hits', 0) for step in steps)
+    run['total'] = total
+    return run
+
+def print_report(run):
+    """Tableau récapitulatif des étapes (débit = lignes écrites par seconde)."""
+    print(f"\n[RAPPORT] Run {run['run_id']} ({run['mode']}, {run['runner']})")
+    print(f"    {'Étape':32s} {'durée':>8s} {'CPU':>8s} {'RSS Mo':>8s} {'SQL':>8s} {'JSON':>8s} "
+          f"{'lues':>10s} {'écrites':>10s} {'lignes/s':>10s}")
+    for step in run['steps'] + [run['total']]:
+        rate = step['rows_written'] / step['wall_time'] if step['wall_time'] else 0
+        rss = f"{step['peak_rss_mb']:.0f}" if step['peak_rss_mb'] is not None else '-'
+        print(f"    {step['step']:32s} {step['wall_time']:7.2f}s {step['cpu_time']:7.2f}s {rss:>8s} "
+              f"{step['db_time']:7.2f}s {step['json_parse_time']:7.2f}s {step['rows_read']:>10,} "
+              f"{step['rows_written']:>10,} {rate:>10,.0f}"
+              + ("" if step['status'] == 'ok' else f"  [{step['status'].upper()}]"))
+
+def write_json(run, report_dir=REPORT_DIR):
+    """Écrit le rapport JSON du run ; retourne son chemin."""
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, f"run_{run['run_id']}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2, ensure_ascii=False)
+    return path
+
+def create_runs_table(conn):
+    """Crée la table d'historique si elle n'existe pas."""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {RUNS_TABLE} (
+                run_id TEXT,
+                started_at TIMESTAMP,
+                mode TEXT,
+                runner TEXT,
+                workers INT,
+                step TEXT,
+                status TEXT,
+                wall_time DOUBLE PRECISION,
+                cpu_time DOUBLE PRECISION,
+                peak_rss_mb DOUBLE PRECISION,
+                rows_read BIGINT,
+                rows_written BIGINT,
+                db_time DOUBLE PRECISION,
+                json_parse_time DOUBLE PRECISION,
+                json_files INT,
+                PRIMARY KEY (run_id, step)
+            );
+            CREATE INDEX IF NOT EXISTS idx_{RUNS_TABLE}_step ON {RUNS_TABLE}(step, mode, started_at);
+        """)
+    conn.commit()
+
+def save_run(conn, run):
+    """Enregistre les étapes du run (et la ligne TOTAL) dans pipeline_runs."""
+    create_runs_table(conn)
+    rows = [
+        (run['run_id'], run['started_at'], run['mode'], run['runner'], run['workers'],
+         step['step'], step['status'], *(step[metric] for metric in METRICS))
+        for step in run['steps'] + [run['total']]
+    ]
+    with conn.cursor() as cur:
+        cur.executemany(f"""
+            INSERT INTO {RUNS_TABLE} (run_id, started_at, mode, runner, workers, step, status,
+                                      {', '.join(METRICS)})
+            VALUES ({', '.join(['%s'] * (7 + len(METRICS)))})
+            ON CONFLICT (run_id, step) DO NOTHING
+        """, rows)
+    conn.commit()
+
+def compare_run(conn, run_id=None, threshold=REGRESSION_THRESHOLD, last=HISTORY_RUNS):
+    """
+    Compare un run (le dernier par défaut) à la médiane des 'last' runs réussis précédents
+    du même mode et du même runner. Retourne la liste des régressions (étape, mesure, valeur, référence, %).
+    """
+    create_runs_table(conn)
+    with conn.cursor() as cur:
+        if run_id is None:
+            cur.execute(f"SELECT run_id FROM {RUNS_TABLE} ORDER BY started_at DESC, run_id DESC LIMIT 1")
+            row = cur.fetchone()
+            if not row:
+                print("[COMPARE] Aucun run enregistré")
+                return []
+            run_id = row[0]
+
+        cur.execute(f"""
+            SELECT step, mode, runner, started_at, {', '.join(COMPARED_METRICS)}
+            FROM {RUNS_TABLE} WHERE run_id = %s AND status = 'ok'
+        """, (run_id,))
+        current = cur.fetchall()
+
+        regressions = []
+        compared = 0
+        for step, mode, runner, started_at, *values in current:
+            # Runs de référence : même étape, même mode, même runner, réussis, antérieurs
+            cur.execute(f"""
+                SELECT {', '.join(COMPARED_METRICS)} FROM {RUNS_TABLE} r
+                WHERE step = %s AND mode = %s AND runner = %s AND status = 'ok' AND started_at < %s
+                  AND EXISTS (SELECT 1 FROM {RUNS_TABLE} t
+                              WHERE t.run_id = r.run_id AND t.step = %s AND t.status = 'ok')
+                ORDER BY started_at DESC LIMIT %s
+            """, (step, mode, runner, started_at, TOTAL_STEP, last))
+            history = cur.fetchall()
+            if not history:
+                continue
+            compared += 1
+            for i, (metric, noise) in enumerate(COMPARED_METRICS.items()):
+                past = [row[i] for row in history if row[i] is not None]
+                if values[i] is None or not past:
+                    continue
+                baseline = statistics.median(past)
+                if values[i] - baseline <= noise or baseline <= 0:
+                    continue
+                change = (values[i] - baseline) / baseline * 100
+                if change > threshold:
+                    regressions.append((step, metric, values[i], baseline, change))
+
+    print(f"\n[COMPARE] Run {run_id} : {compared} étape(s) comparée(s) à la médiane des "
+          f"{last} derniers runs (seuil {threshold:.0f} %)")
+    for step, metric, value, baseline, change in regressions:
+        print(f"[REGRESSION] {step} : {metric} {value:.2f} contre {baseline:.2f} (+{change:.0f} %)")
+    if not regressions:
+        print("[OK] Aucune régression détectée")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Historique des runs du pipeline.")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare un run aux runs précédents et signale les régressions")
+    parser.add_argument("--run-id", help="Run à comparer (par défaut le dernier)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Écart en %% au-delà duquel une mesure est signalée")
+    parser.add_argument("--last", type=int, default=HISTORY_RUNS,
+                        help="Nombre de runs précédents servant de référence")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not args.compare:
+        print("Usage : python run_report.py --compare [--threshold X] [--last N] [--run-id ID]")
+        sys.exit(0)
+    conn = db.get_conn()
+    regressions = compare_run(conn, args.run_id, args.threshold, args.last)
+    conn.close()
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Chargement par table fantôme et bascule atomique.
+
+En reconstruction complète, une étape ne supprime plus sa table : elle remplit une
+table fantôme '<table>__shadow' (journalisée dès sa création, donc écrite une seule
+fois, sans ALTER TABLE ... SET LOGGED), y crée ses index après le chargement, puis
+swap_in() la met en service en une transaction :
+- la table en service est renommée '<table>__vAAAAMMJJHHMMSS' (version conservée) ;
+- la table fantôme prend son nom ;
+- index, clés et séquences sont renommés en conséquence, ainsi que les partitions
+  d'une table partitionnée (partitions.py) et leurs index ;
+- les vues qui lisaient l'ancienne table sont recréées sur la nouvelle.
+Les lecteurs (Power BI, API) voient l'ancienne version jusqu'au commit, jamais une
+table absente. Les SHADOW_RETENTION dernières versions sont conservées.
+
+Nommage : les index créés sur la table fantôme contiennent son nom
+(ex. idx_deck__shadow_player) et retrouvent leur nom usuel (idx_deck_player) à la bascule.
+
+Utilisation en ligne de commande :
+    python shadow.py --list decklist        # versions conservées
+    python shadow.py --rollback decklist    # remet en service la version précédente
+"""
+import os
+import sys
+import datetime
+from db import get_conn
+
+SHADOW_SUFFIX = "__shadow"
+VERSION_MARKER = "__v"
+SHADOW_RETENTION = int(os.getenv("SHADOW_RETENTION", "1"))  # Anciennes versions conservées
+MAX_IDENTIFIER = 63  # Longueur maximale d'un identifiant PostgreSQL
+
+def shadow_name(table):
+    """Nom de la table fantôme d'une table."""
+    return f"{table}{SHADOW_SUFFIX}"
+
+def create_shadow(conn, table, columns_ddl, options=""):
+    """
+    (Re)crée la table fantôme de 'table' avec la définition de colonnes donnée et
+    retourne son nom. La table en service n'est pas touchée.
+    """
+    shadow = shadow_name(table)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {shadow}")
+        cur.execute(f"CREATE TABLE {shadow} ({columns_ddl}) {options}")
+    conn.commit()
+    print(f"[SHADOW] Table fantôme '{shadow}' créée (la table '{table}' reste en service)")
+    return shadow
+
+def versions(conn, table):
+    """Versions conservées d'une table, de la plus récente à la plus ancienne."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname FROM pg_class c
+            WHERE c.relkind IN ('r', 'p') AND NOT c.relispartition
+              AND c.relnamespace = 'public'::regnamespace
+              AND left(c.relname, %s) = %s
+            ORDER BY c.relname DESC
+        """, (len(table) + len(VERSION_MARKER), table + VERSION_MARKER))
+        return [row[0] for row in cur.fetchall()]
+
+def _table_exists(cur, name):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+def _dependent_relations(cur, table):
+    """Index et séquences appartenant à une table (renommés avec elle)."""
+    cur.execute("""
+        SELECT c.relname, 'INDEX' FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %(t)s::regclass
+        UNION ALL
+        SELECT c.relname, 'SEQUENCE' FROM pg_depend d JOIN pg_class c ON c.oid = d.objid
+        WHERE d.refobjid = %(t)s::regclass AND d.classid = 'pg_class'::regclass
+          AND c.relkind = 'S' AND d.deptype IN ('a', 'i')
+    """, {'t': table})
+    return cur.fetchall()
+
+def _partitions(cur, table):
+    """Partitions attachées à 'table' (liste vide pour une table non partitionnée)."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+def _rename_table(cur, old, new):
+    """Renomme une table, ses partitions et ses index/séquences (old remplacé par new dans leurs noms)."""
+    for partition in _partitions(cur, old):
+        if partition.startswith(old):
+            _rename_table(cur, partition, f"{new}{partition[len(old):]}"[:MAX_IDENTIFIER])
+    relations = _dependent_relations(cur, old)
+    cur.execute(f"ALTER TABLE {old} RENAME TO {new}")
+    for name, kind in relations:
+        if old in name:
+            renamed = name.replace(old, new, 1)
+        else:
+            renamed = f"{name}_{new[-14:]}"
+        cur.execute(f"ALTER {kind} {name} RENAME TO {renamed[:MAX_IDENTIFIER]}")
+
+def _dependent_views(cur, table):
+    """Vues lisant directement 'table' : (nom, définition), pour les recréer après bascule."""
+    cur.execute("""
+        SELECT DISTINCT v.relname, pg_get_viewdef(v.oid)
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class v ON v.oid = r.ev_class
+        WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = %s::regclass
+          AND v.relkind = 'v'
+    """, (table,))
+    return cur.fetchall()
+
+def _swap(cur, table, source):
+    """Met 'source' en service sous le nom 'table' ; l'ancienne table devient une version."""
+    views = []
+    archived = None
+    if _table_exists(cur, table):
+        views = _dependent_views(cur, table)
+        archived = f"{table}{VERSION_MARKER}{datetime.datetime.now():%Y%m%d%H%M%S}"
+        while _table_exists(cur, archived):
+            archived += "0"
+        _rename_table(cur, table, archived)
+    _rename_table(cur, source, table)
+    # Les vues suivent l'ancienne table (référence par OID) : elles sont redirigées
+    for name, definition in views:
+        cur.execute(f"CREATE OR REPLACE VIEW {name} AS {definition}")
+    return archived
+
+def prune_versions(conn, table, retention=SHADOW_RETENTION):
+    """Supprime les versions au-delà de la rétention (une version encore référencée est gardée)."""
+    dropped = 0
+    for version in versions(conn, table)[retention:]:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE {version}")
+            conn.commit()
+            dropped += 1
+        except Exception as e:
+            conn.rollback()
+            print(f"[SHADOW] Version '{version}' conservée : {e}")
+    return dropped
+
+def swap_in(conn, table, retention=SHADOW_RETENTION):
+    """
+    Bascule atomique de la table fantôme en service (une transaction), puis purge des
+    versions au-delà de la rétention. La transaction en cours de conn est validée.
+    """
+    conn.commit()
+    with conn.cursor() as cur:
+        archived = _swap(cur, table, shadow_name(table))
+    conn.commit()
+    dropped = prune_versions(conn, table, retention)
+    kept = f"ancienne version '{archived}'" if archived else "aucune ancienne version"
+    print(f"[SWAP] '{table}' mise en service ({kept}, {dropped} version(s) purgée(s))")
+
+def rollback(conn, table):
+    """Remet en service la version conservée la plus récente (la table actuelle devient une version)."""
+    available = versions(conn, table)
+    if not available:
+        raise ValueError(f"Aucune version conservée pour '{table}'")
+    with conn.cursor() as cur:
+        archived = _swap(cur, table, available[0])
+    conn.commit()
+    print(f"[ROLLBACK] '{table}' restaurée depuis '{available[0]}' (version remplacée : '{archived}')")
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ('--list', '--rollback'):
+        print("Usage : python shadow.py --list|--rollback <table>")
+        sys.exit(1)
+    action, table_name = sys.argv[1], sys.argv[2]
+    connection = get_conn()
+    if action == '--rollback':
+        rollback(connection, table_name)
+    else:
+        for name in versions(connection, table_name):
+            print(name)
+    connection.close()
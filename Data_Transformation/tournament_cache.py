@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Cache binaire des tournois normalisés.
+
+Chaque fichier JSON est décodé et nettoyé une seule fois : le résultat (tuples déjà
+passés par remove_non_ascii) est sérialisé avec pickle dans CACHE_DIR, indexé par le
+chemin du fichier source, son mtime et sa taille. Les exécutions suivantes relisent
+directement l'enregistrement normalisé tant que le fichier source n'a pas changé.
+
+Utilisation en ligne de commande :
+    python tournament_cache.py                  # préchauffe le cache depuis JSON_FOLDER
+    python tournament_cache.py --rebuild-cache  # vide puis reconstruit le cache
+    python tournament_cache.py --prune          # applique seulement le budget de taille
+"""
+import sys
+import os
+import json
+import pickle
+import tempfile
+import hashlib
+import time
+import metrics
+from normalize import remove_non_ascii  # Normalisation mémoïsée partagée (réexportée)
+
+# Paramètres du cache (surchargeables par variables d'environnement)
+CACHE_DIR = os.getenv(
+    "TOURNAMENT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tournaments")
+)
+CACHE_MAX_MB = int(os.getenv("TOURNAMENT_CACHE_MAX_MB", "2048"))  # Budget disque du cache
+CACHE_VERSION = 1  # À incrémenter dès que le format de normalisation change
+
+def parse_json_bytes(content):
+    """Décode le contenu brut d'un fichier JSON en testant plusieurs encodages."""
+    for encoding in ('utf-8', 'utf-8-sig', 'latin-1', 'cp1252'):
+        try:
+            return json.loads(content.decode(encoding))
+        except (UnicodeDecodeError, ValueError):
+            continue
+    try:
+        return json.loads(content.decode('utf-8', errors='replace'))
+    except ValueError:
+        return None
+
+def _to_int(value, default):
+    """Conversion entière tolérante."""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+def normalize_tournament(data):
+    """
+    Transforme le JSON brut d'un tournoi en enregistrement normalisé :
+    - champs texte nettoyés (remove_non_ascii) ;
+    - joueurs : (player_id, player_name, player_country, placing, decklist) ;
+    - decklist : (card_id, card_name, card_type, count) ;
+    - matches valides à deux joueurs : (p1_id, p1_score, p2_id, p2_score).
+    Retourne None si le tournoi n'a pas d'identifiant exploitable.
+    """
+    if not isinstance(data, dict):
+        return None
+
+    tournament_id = remove_non_ascii(data.get('id'))
+    if not tournament_id:
+        return None
+
+    players = []
+    for player in data.get('players') or []:
+        if not isinstance(player, dict):
+            continue
+        player_id = remove_non_ascii(player.get('id'))
+        if not player_id:
+            continue
+
+        placing = player.get('placing')
+        placing = int(placing) if placing is not None and str(placing).isdigit() else None
+
+        decklist = []
+        for card in player.get('decklist') or []:
+            if not isinstance(card, dict):
+                continue
+            decklist.append((
+                remove_non_ascii(card.get('url')),
+                remove_non_ascii(card.get('name')),
+                remove_non_ascii(card.get('type')),
+                _to_int(card.get('count', 1), 1)
+            ))
+
+        players.append((
+            player_id,
+            remove_non_ascii(player.get('name')),
+            remove_non_ascii(player.get('country')),
+            placing,
+            decklist
+        ))
+
+    matches = []
+    for match in data.get('matches') or []:
+        match_results = match.get('match_results') if isinstance(match, dict) else None
+        if not match_results or len(match_results) != 2:
+            continue
+        try:
+            p1, p2 = match_results
+            matches.append((
+                remove_non_ascii(p1['player_id']),
+                int(p1['score']),
+                remove_non_ascii(p2['player_id']),
+                int(p2['score'])
+            ))
+        except (KeyError, ValueError, TypeError):
+            continue
+
+    return {
+        'id': tournament_id,
+        'name': remove_non_ascii(data.get('name')),
+        'date': data.get('date'),
+        'organizer': remove_non_ascii(data.get('organizer')),
+        'format': remove_non_ascii(data.get('format')),
+        'nb_players': _to_int(data.get('nb_players') or 0, 0),
+        'players': players,
+        'matches': matches,
+    }
+
+def _cache_path(source_path):
+    """Chemin du fichier de cache associé à un fichier JSON source."""
+    key = hashlib.sha1(source_path.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, key[:2], key + '.pkl')
+
+def _record_read(start_time, cache_hit):
+    """Compteurs du rapport de run : fichiers lus, hits du cache et temps de décodage."""
+    metrics.add('json_files')
+    metrics.add('cache_hits', int(cache_hit))
+    metrics.add('json_parse_time', time.perf_counter() - start_time)
+
+def load_entry(file_path):
+    """
+    Retourne l'entrée de cache d'un fichier JSON :
+    {'source', 'mtime_ns', 'size', 'hash', 'version', 'record'}.
+    Le fichier n'est décodé que si le cache est absent ou périmé (mtime/taille/version).
+    """
+    start_time = time.perf_counter()
+    source_path = os.path.abspath(file_path)
+    stat = os.stat(source_path)
+    cache_path = _cache_path(source_path)
+
+    try:
+        with open(cache_path, 'rb') as f:
+            entry = pickle.load(f)
+        if (entry.get('version') == CACHE_VERSION and
+                entry.get('source') == source_path and
+                entry.get('mtime_ns') == stat.st_mtime_ns and
+                entry.get('size') == stat.st_size):
+            os.utime(cache_path)  # Marque l'entrée comme récemment utilisée (éviction LRU)
+            _record_read(start_time, True)
+            return entry
+    except Exception:
+        pass  # Entrée absente, tronquée ou illisible : traitée comme un défaut de cache
+
+    with open(source_path, 'rb') as f:
+        content = f.read()
+
+    data = parse_json_bytes(content)
+    entry = {
+        'source': source_path,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'hash': hashlib.sha1(content).hexdigest(),
+        'version': CACHE_VERSION,
+        'record': normalize_tournament(data),
+    }
+    _record_read(start_time, False)
+
+    # Écriture atomique : plusieurs threads/processus peuvent traiter le même fichier,
+    # chaque écriture passe donc par son propre fichier temporaire (mkstemp)
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(cache_path) + '.', suffix='.tmp',
+                                        dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"[CACHE] Écriture impossible pour {file_path} : {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return entry
+
+def load_tournament(file_path):
+    """Retourne l'enregistrement normalisé d'un tournoi (None si fichier invalide)."""
+    try:
+        return load_entry(file_path)['record']
+    except OSError as e:
+        print(f"[ERREUR] Impossible de lire {file_path}: {e}")
+        return None
+
+def _cache_files():
+    """Liste (chemin, taille, mtime) des fichiers présents dans le cache."""
+    files = []
+    for root, _, names in os.walk(CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+    return files
+
+def clear_cache():
+    """Supprime toutes les entrées du cache (équivalent de --rebuild-cache)."""
+    removed = 0
+    for path, _, _ in _cache_files():
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    print(f"[CACHE] {removed:,} entrées supprimées")
+    return removed
+
+def prune_cache(max_mb=CACHE_MAX_MB):
+    """Évince les entrées les moins récemment utilisées au-delà du budget (en Mo)."""
+    files = _cache_files()
+    total = sum(size for _, size, _ in files)
+    budget = max_mb * 1024 * 1024
+    if total <= budget:
+        return 0
+
+    removed = 0
+    for path, size, _ in sorted(files, key=lambda item: item[2]):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            continue
+    print(f"[CACHE] {removed:,} entrées évincées (budget {max_mb} Mo)")
+    return removed
+
+def warm_cache(json_folder):
+    """Charge tous les fichiers JSON d'un dossier pour alimenter le cache."""
+    start_time = time.time()
+    try:
+        files = [f for f in os.listdir(json_folder) if f.endswith('.json')]
+    except OSError:
+        files = []
+
+    for i, filename in enumerate(files):
+        if i % 1000 == 0:
+            print(f"[CACHE] {i}/{len(files)} fichiers chargés")
+        load_tournament(os.path.join(json_folder, filename))
+
+    elapsed = time.time() - start_time
+    print(f"[OK] Cache prêt : {len(files):,} fichiers en {elapsed:.1f}s")
+
+if __name__ == '__main__':
+    if '--rebuild-cache' in sys.argv:
+        clear_cache()
+    if '--prune' not in sys.argv:
+        warm_cache(os.getenv("JSON_FOLDER", r"E:\DataCollection\output"))
+    prune_cache()